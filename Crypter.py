@@ -2,20 +2,217 @@
 # -*- coding: utf-8 -*-
 """
 Encryption and decryption module.
+
+AES is calculated by one of several backends. The OpenSSL backend (cryptography package) uses the AES instructions
+of the processor. The PyCrypto backend works with pycrypto and pycryptodome. All backends produce the same bytes.
 """
 
-from Crypto.Cipher import AES
-from hashlib import pbkdf2_hmac
+import importlib.util
+from KdfExecutor import pbkdf2_hmac, scrypt, INTERACTIVE
+
+
+class OpenSslBackend:
+    """
+    AES in CBC mode from OpenSSL via the cryptography package. Importing cryptography takes longer than starting
+    the rest of the program so it is imported when the backend is used for the first time.
+    """
+    name = 'openssl'
+
+    @staticmethod
+    def is_available():
+        """
+        :return: is the cryptography package installed?
+        :rtype: bool
+        """
+        return importlib.util.find_spec('cryptography') is not None
+
+    def __init__(self, key, iv):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        self.cipher = Cipher
+        self.algorithm = algorithms.AES(key)
+        self.mode = modes.CBC(iv)
+
+    def encrypt(self, data):
+        """
+        :param bytes data: padded data
+        :return: encrypted data
+        :rtype: bytes
+        """
+        encryptor = self.cipher(self.algorithm, self.mode).encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def decrypt(self, encrypted_data):
+        """
+        :param bytes encrypted_data: encrypted data
+        :return: padded data
+        :rtype: bytes
+        """
+        decryptor = self.cipher(self.algorithm, self.mode).decryptor()
+        return decryptor.update(encrypted_data) + decryptor.finalize()
+
+
+class PyCryptoBackend:
+    """
+    AES in CBC mode from pycrypto or pycryptodome. Like cryptography it is imported when the backend is used for the
+    first time.
+    """
+    name = 'pycrypto'
+
+    @staticmethod
+    def is_available():
+        """
+        :return: is pycrypto or pycryptodome installed?
+        :rtype: bool
+        """
+        return importlib.util.find_spec('Crypto') is not None
+
+    def __init__(self, key, iv):
+        from Crypto.Cipher import AES
+        self.aes = AES
+        self.key = key
+        self.iv = iv
+
+    def encrypt(self, data):
+        """
+        :param bytes data: padded data
+        :return: encrypted data
+        :rtype: bytes
+        """
+        return self.aes.new(self.key, self.aes.MODE_CBC, self.iv).encrypt(data)
+
+    def decrypt(self, encrypted_data):
+        """
+        :param bytes encrypted_data: encrypted data
+        :return: padded data
+        :rtype: bytes
+        """
+        return self.aes.new(self.key, self.aes.MODE_CBC, self.iv).decrypt(encrypted_data)
+
+
+BACKENDS = [OpenSslBackend, PyCryptoBackend]
+KDF_PBKDF2 = 'pbkdf2'
+KDF_SCRYPT = 'scrypt'
+DEFAULT_KDF = {'algorithm': KDF_PBKDF2, 'hash': 'sha512', 'iterations': 32768}
+PBKDF2_HASHES = ['sha256', 'sha512']
+MAX_SCRYPT_MEMORY = 1024 * 1024 * 1024
+IV = b'\xb5\x4f\xcf\xb0\x88\x09\x55\xe5\xbf\x79\xaf\x37\x71\x1c\x28\xb6'
+
+
+def create_kdf(algorithm=KDF_PBKDF2, cost=None):
+    """
+    Returns the parameters of a key derivation function.
+
+    :param str algorithm: KDF_PBKDF2 or KDF_SCRYPT
+    :param int cost: iterations of PBKDF2 or the parameter n of scrypt. Defaults to 32768 for PBKDF2 and 16384
+                     for scrypt.
+    :return: the parameters
+    :rtype: dict
+    :raises ValueError: if the parameters are invalid
+    """
+    if algorithm == KDF_SCRYPT:
+        return check_kdf({'algorithm': KDF_SCRYPT, 'n': 16384 if cost is None else cost, 'r': 8, 'p': 1})
+    return check_kdf({'algorithm': algorithm, 'hash': 'sha512', 'iterations': 32768 if cost is None else cost})
+
+
+def check_kdf(kdf):
+    """
+    Checks the parameters of a key derivation function. Parameters read from a file are checked before they are used
+    so a damaged file can not make the program calculate or allocate memory forever.
+
+    :param dict kdf: the parameters
+    :return: the parameters
+    :rtype: dict
+    :raises ValueError: if the parameters are invalid
+    """
+    if type(kdf) != dict:
+        raise ValueError("The KDF parameters must be a dict.")
+    if kdf.get('algorithm') == KDF_PBKDF2:
+        if kdf.get('hash') not in PBKDF2_HASHES or type(kdf.get('iterations')) != int or \
+                not 0 < kdf['iterations'] <= 100000000:
+            raise ValueError("Invalid PBKDF2 parameters.")
+    elif kdf.get('algorithm') == KDF_SCRYPT:
+        if any(type(kdf.get(name)) != int or kdf[name] < 1 for name in ['n', 'r', 'p']) or \
+                kdf['n'] < 2 or kdf['n'] & (kdf['n'] - 1) != 0 or \
+                128 * kdf['r'] * (kdf['n'] + kdf['p']) > MAX_SCRYPT_MEMORY:
+            raise ValueError("Invalid scrypt parameters.")
+    else:
+        raise ValueError("Unknown KDF algorithm: " + str(kdf.get('algorithm')))
+    return kdf
+
+
+def get_available_backends():
+    """
+    :return: the names of the installed backends, the preferred one first
+    :rtype: [str]
+    """
+    return [backend.name for backend in BACKENDS if backend.is_available()]
+
+
+def get_backend(name=None):
+    """
+    Returns the backend class with the given name or the preferred installed backend.
+
+    :param str name: 'openssl', 'pycrypto' or None for the preferred backend
+    :return: the backend class
+    :raises ValueError: if the backend is unknown or not installed
+    """
+    for backend in BACKENDS:
+        if (name is None or backend.name == name) and backend.is_available():
+            return backend
+    if name is None:
+        raise ValueError("No AES backend is installed. Please install cryptography or pycryptodome.")
+    raise ValueError("The AES backend " + name + " is not available.")
 
 
 class Crypter:
     """
     Encrypt and decrypt with AES in CBC mode with PKCS7 padding. The constructor calculates the key from the given
-    password and salt with PBKDF2 using HMAC with SHA512 and 32768 iterations.
+    password and salt with a key derivation function. The default is PBKDF2 using HMAC with SHA512 and 32768
+    iterations. scrypt can be chosen instead (see create_kdf). The key derivation is scheduled on the KdfExecutor
+    with the given priority.
+
+    :param bytes salt: the salt
+    :param str password: the password
+    :param int priority: priority of the key derivation on the KdfExecutor
+    :param str backend: name of the AES backend (see get_backend). Defaults to the fastest installed one.
+    :param dict kdf: parameters of the key derivation function. Defaults to DEFAULT_KDF.
     """
-    def __init__(self, salt, password):
-        self.iv = b'\xb5\x4f\xcf\xb0\x88\x09\x55\xe5\xbf\x79\xaf\x37\x71\x1c\x28\xb6'
-        self.key = pbkdf2_hmac('sha512', password.encode('utf-8'), salt, 32768)[:32]
+    def __init__(self, salt, password, priority=INTERACTIVE, backend=None, kdf=None):
+        self.iv = IV
+        self.key = self.derive_key(check_kdf(kdf or DEFAULT_KDF), password.encode('utf-8'), salt, priority)
+        self.backend = get_backend(backend)(self.key, self.iv)
+
+    @classmethod
+    def from_key(cls, key, backend=None):
+        """
+        Creates a crypter for a key which is already derived so no key derivation function is run.
+
+        :param bytes key: the key with 32 bytes
+        :param str backend: name of the AES backend (see get_backend)
+        :return: the crypter
+        :rtype: Crypter
+        """
+        crypter = cls.__new__(cls)
+        crypter.iv = IV
+        crypter.key = key
+        crypter.backend = get_backend(backend)(key, IV)
+        return crypter
+
+    @staticmethod
+    def derive_key(kdf, password, salt, priority):
+        """
+        Calculates the AES key.
+
+        :param dict kdf: parameters of the key derivation function
+        :param bytes password: the password
+        :param bytes salt: the salt
+        :param int priority: priority of the key derivation on the KdfExecutor
+        :return: the key with 32 bytes
+        :rtype: bytes
+        """
+        if kdf['algorithm'] == KDF_SCRYPT:
+            return scrypt(password, salt, kdf['n'], kdf['r'], kdf['p'], 32, priority=priority)
+        return pbkdf2_hmac(kdf['hash'], password, salt, kdf['iterations'], priority=priority)[:32]
 
     @staticmethod
     def add_pkcs7_padding(data):
@@ -38,8 +235,7 @@ class Crypter:
         :return: encrypted data
         :rtype: bytes
         """
-        aes_object = AES.new(self.key, AES.MODE_CBC, self.iv)
-        return aes_object.encrypt(self.add_pkcs7_padding(data))
+        return self.backend.encrypt(self.add_pkcs7_padding(data))
 
     @staticmethod
     def remove_pkcs7_padding(data):
@@ -60,5 +256,4 @@ class Crypter:
         :return: decrypted data
         :rtype: bytes
         """
-        aes_object = AES.new(self.key, AES.MODE_CBC, self.iv)
-        return self.remove_pkcs7_padding(aes_object.decrypt(encrypted_data))
+        return self.remove_pkcs7_padding(self.backend.decrypt(encrypted_data))
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Advisory file locks and atomic file replacement for files which several processes use at the same time.
+"""
+
+import os
+import time
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Exclusive advisory lock on a lock file. The lock file is created next to the protected file and is never
+    removed. All processes which use the same lock file wait for each other. Threads of one process wait for each
+    other as well. Use it as a context manager and keep the locked section short.
+
+    The lock is advisory: programs which do not use it are not stopped from writing the protected file.
+
+    :param str lock_file: filename of the lock file
+    """
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self.thread_lock = threading.Lock()
+        self.file = None
+
+    def acquire(self):
+        """
+        Waits until the lock is free and takes it.
+        """
+        self.thread_lock.acquire()
+        try:
+            self.file = open(self.lock_file, 'a+b')
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        self.file.seek(0)
+                        msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+        except BaseException:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.thread_lock.release()
+            raise
+
+    def release(self):
+        """
+        Releases the lock.
+        """
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+            self.file = None
+            self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def write_file_atomically(filename, data):
+    """
+    Writes the data to a temporary file in the same directory and renames it to filename. Readers see either the
+    old or the new file but never a partially written one.
+
+    :param str filename: the file to replace
+    :param bytes data: the new content
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    file_descriptor, temporary_filename = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename),
+                                                           suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        if os.path.isfile(temporary_filename):
+            os.remove(temporary_filename)
+        raise
@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Central scheduler for key derivations. Every PBKDF2 and scrypt calculation of the program runs on the worker threads
+of one KdfExecutor so interactive requests do not have to wait behind a bulk regeneration or a sync.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from hashlib import pbkdf2_hmac as hashlib_pbkdf2_hmac, scrypt as hashlib_scrypt
+
+INTERACTIVE = 0
+SYNC = 1
+BATCH = 2
+PRIORITIES = [INTERACTIVE, SYNC, BATCH]
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', SYNC: 'sync', BATCH: 'batch'}
+_default_executor = None
+_default_executor_lock = threading.Lock()
+_worker_state = threading.local()
+
+
+class KdfJob:
+    """
+    A key derivation waiting for or running on a KdfExecutor. After the job finished wait_time holds the seconds
+    it waited in the queue and run_time the seconds of the calculation.
+
+    :param int priority: INTERACTIVE, SYNC or BATCH
+    :param function: the calculation
+    :param args: arguments of the calculation
+    """
+    def __init__(self, priority, function, args):
+        self.priority = priority
+        self.function = function
+        self.args = args
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.wait_time = None
+        self.run_time = None
+
+    def result(self, timeout=None):
+        """
+        Waits for the job and returns the result of the calculation.
+
+        :param float timeout: seconds to wait or None to wait forever
+        :return: the result
+        """
+        return self.future.result(timeout)
+
+    def cancel(self):
+        """
+        Removes the job from the queue. Running jobs can not be cancelled.
+
+        :return: True if the job was cancelled
+        :rtype: bool
+        """
+        return self.future.cancel()
+
+    def cancelled(self):
+        """
+        :return: True if the job was cancelled
+        :rtype: bool
+        """
+        return self.future.cancelled()
+
+    def done(self):
+        """
+        :return: True if the job finished or was cancelled
+        :rtype: bool
+        """
+        return self.future.done()
+
+
+class KdfExecutor:
+    """
+    Runs key derivations on a fixed number of worker threads. hashlib releases the GIL during PBKDF2 so the workers
+    really calculate in parallel.
+
+    Every job belongs to a priority class. A free worker takes the oldest job of the most urgent class which has not
+    reached its concurrency limit. Within a class the jobs run in the order they were submitted. The limit of the
+    batch class is one less than the number of workers so a bulk job never occupies all workers and an interactive
+    request starts as soon as the currently running derivations allow it. Running derivations are not interrupted.
+
+    Strict priorities would let a steady stream of interactive jobs starve the other classes. So the jobs age: if the
+    oldest job of a class has waited longer than the maximum wait of its class it is taken before the jobs of more
+    urgent classes. If several classes are overdue the one with the oldest job goes first. A sync or batch job
+    therefore waits at most its maximum wait plus the run time of the jobs which are already running or overdue.
+
+    For every class the executor counts the finished and cancelled jobs and sums up their queue wait and run times
+    in statistics.
+
+    :param int workers: number of worker threads. Defaults to the number of CPUs.
+    :param dict limits: maximum number of running jobs per priority class
+    :param dict max_waits: seconds after which a waiting job of the class is preferred. None disables the aging.
+    """
+    def __init__(self, workers=None, limits=None, max_waits=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.limits = {
+            INTERACTIVE: self.workers,
+            SYNC: max(1, self.workers // 2),
+            BATCH: max(1, self.workers - 1)
+        }
+        if limits:
+            self.limits.update(limits)
+        self.max_waits = {
+            INTERACTIVE: None,
+            SYNC: 1.0,
+            BATCH: 2.0
+        }
+        if max_waits:
+            self.max_waits.update(max_waits)
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.running = {priority: 0 for priority in PRIORITIES}
+        self.statistics = {priority: {'jobs': 0, 'cancelled': 0, 'wait_time': 0.0, 'max_wait_time': 0.0,
+                                      'run_time': 0.0} for priority in PRIORITIES}
+        self.condition = threading.Condition()
+        self.threads = []
+        self.stopped = False
+
+    def start_workers(self):
+        """
+        Starts the worker threads on first use.
+        """
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.work, name='kdf-worker-' + str(len(self.threads)), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def submit(self, priority, function, *args):
+        """
+        Queues function(*args) in the given priority class.
+
+        :param int priority: INTERACTIVE, SYNC or BATCH
+        :param function: the calculation
+        :return: the job
+        :rtype: KdfJob
+        """
+        if priority not in self.queues:
+            raise ValueError("Unknown priority: " + str(priority))
+        job = KdfJob(priority, function, args)
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("The executor was shut down.")
+            self.start_workers()
+            self.queues[priority].append(job)
+            self.condition.notify()
+        return job
+
+    def next_priority(self):
+        """
+        Selects the class of the next job: the class with the oldest overdue job or else the most urgent class. Only
+        classes with waiting jobs which have not reached their limit are considered. Call this with the condition
+        acquired.
+
+        :return: the priority class or None if no class may start a job now
+        :rtype: int
+        """
+        ready = [priority for priority in PRIORITIES
+                 if len(self.queues[priority]) > 0 and self.running[priority] < self.limits[priority]]
+        if len(ready) < 1:
+            return None
+        now = time.monotonic()
+        overdue = [priority for priority in ready if self.max_waits.get(priority) is not None
+                   and now - self.queues[priority][0].submitted >= self.max_waits[priority]]
+        if len(overdue) > 0:
+            return min(overdue, key=lambda priority: self.queues[priority][0].submitted)
+        return ready[0]
+
+    def next_job(self):
+        """
+        Takes the next job from the queues. Cancelled jobs are dropped. Call this with the condition acquired.
+
+        :return: the job or None if no class may start a job now
+        :rtype: KdfJob
+        """
+        priority = self.next_priority()
+        while priority is not None:
+            job = self.queues[priority].popleft()
+            if job.future.set_running_or_notify_cancel():
+                self.running[priority] += 1
+                return job
+            self.statistics[priority]['cancelled'] += 1
+            priority = self.next_priority()
+        return None
+
+    def work(self):
+        """
+        Main loop of a worker thread.
+        """
+        _worker_state.active = True
+        while True:
+            with self.condition:
+                job = self.next_job()
+                while job is None:
+                    if self.stopped:
+                        return
+                    self.condition.wait()
+                    job = self.next_job()
+            started = time.monotonic()
+            job.wait_time = started - job.submitted
+            try:
+                result = job.function(*job.args)
+            except BaseException as error:
+                job.run_time = time.monotonic() - started
+                job.future.set_exception(error)
+            else:
+                job.run_time = time.monotonic() - started
+                job.future.set_result(result)
+            with self.condition:
+                self.running[job.priority] -= 1
+                statistics = self.statistics[job.priority]
+                statistics['jobs'] += 1
+                statistics['wait_time'] += job.wait_time
+                statistics['max_wait_time'] = max(statistics['max_wait_time'], job.wait_time)
+                statistics['run_time'] += job.run_time
+                # The finished job may have blocked a class at its limit so every waiting worker has to check again.
+                self.condition.notify_all()
+
+    def get_queue_lengths(self):
+        """
+        :return: the number of waiting jobs per priority class
+        :rtype: dict
+        """
+        with self.condition:
+            return {priority: len(queue) for priority, queue in self.queues.items()}
+
+    def shutdown(self, wait=True):
+        """
+        Cancels all waiting jobs and stops the workers after their current job.
+
+        :param bool wait: wait for the worker threads to finish?
+        """
+        with self.condition:
+            self.stopped = True
+            for priority, queue in self.queues.items():
+                while len(queue) > 0:
+                    if queue.popleft().future.cancel():
+                        self.statistics[priority]['cancelled'] += 1
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+def get_default_executor():
+    """
+    Returns the executor all key derivations of this process share. It is created on first use.
+
+    :return: the executor
+    :rtype: KdfExecutor
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = KdfExecutor()
+        return _default_executor
+
+
+def set_default_executor(executor):
+    """
+    Replaces the executor all key derivations of this process share. Use this to configure the number of workers
+    and the limits of the priority classes. The old executor finishes its running and waiting jobs and does not
+    accept new ones.
+
+    :param KdfExecutor executor: the new executor or None to create a new one with the default settings on next use
+    """
+    global _default_executor
+    with _default_executor_lock:
+        old_executor = _default_executor
+        _default_executor = executor
+    if old_executor is not None and old_executor is not executor:
+        with old_executor.condition:
+            old_executor.stopped = True
+            old_executor.condition.notify_all()
+
+
+def pbkdf2_hmac(hash_name, password, salt, iterations, dklen=None, priority=INTERACTIVE):
+    """
+    Same as hashlib.pbkdf2_hmac but scheduled on the default executor with the given priority. Calls from a worker
+    thread of an executor are calculated directly to avoid waiting for a worker which is already taken.
+
+    :param str hash_name: name of the hash function, e.g. 'sha512'
+    :param bytes password: password
+    :param bytes salt: salt
+    :param int iterations: iteration count
+    :param int dklen: length of the derived key or None for the length of the hash
+    :param int priority: INTERACTIVE, SYNC or BATCH
+    :return: the derived key
+    :rtype: bytes
+    """
+    if getattr(_worker_state, 'active', False):
+        return hashlib_pbkdf2_hmac(hash_name, password, salt, iterations, dklen)
+    return get_default_executor().submit(
+        priority, hashlib_pbkdf2_hmac, hash_name, password, salt, iterations, dklen).result()
+
+
+def scrypt(password, salt, n, r, p, dklen=64, priority=INTERACTIVE):
+    """
+    Same as hashlib.scrypt but scheduled on the default executor with the given priority like pbkdf2_hmac. The
+    memory limit is raised to what the parameters need.
+
+    :param bytes password: password
+    :param bytes salt: salt
+    :param int n: CPU/memory cost, a power of 2
+    :param int r: block size
+    :param int p: parallelization
+    :param int dklen: length of the derived key
+    :param int priority: INTERACTIVE, SYNC or BATCH
+    :return: the derived key
+    :rtype: bytes
+    """
+    maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+
+    def derive_key():
+        return hashlib_scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=dklen)
+
+    if getattr(_worker_state, 'active', False):
+        return derive_key()
+    return get_default_executor().submit(priority, derive_key).result()
+
+
+async def apbkdf2_hmac(hash_name, password, salt, iterations, dklen=None, priority=INTERACTIVE):
+    """
+    Coroutine version of pbkdf2_hmac. The calculation runs on the default executor and the event loop keeps running
+    while it waits. The number of parallel calculations is limited by the executor so a burst of requests queues up
+    instead of oversubscribing the cores. Cancelling the coroutine removes a waiting job from the queue.
+
+    :param str hash_name: name of the hash function, e.g. 'sha512'
+    :param bytes password: password
+    :param bytes salt: salt
+    :param int iterations: iteration count
+    :param int dklen: length of the derived key or None for the length of the hash
+    :param int priority: INTERACTIVE, SYNC or BATCH
+    :return: the derived key
+    :rtype: bytes
+    """
+    import asyncio
+    job = get_default_executor().submit(priority, hashlib_pbkdf2_hmac, hash_name, password, salt, iterations, dklen)
+    return await asyncio.wrap_future(job.future)
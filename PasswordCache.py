@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Encrypted cache for generated passwords.
+"""
+
+import os
+import hmac
+import json
+import time
+import zlib
+import hashlib
+import threading
+from base64 import b64encode, b64decode
+from Crypter import Crypter
+from Packer import Packer
+from FileLock import write_file_atomically
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+DEFAULT_MIN_ITERATIONS = 100000
+CACHE_KEY_LABEL = b'ctSESAM password cache'
+
+
+class PasswordCache:
+    """
+    Stores generated passwords in a file which is encrypted with a key derived from the key of the settings file.
+    The cache key is calculated with HMAC-SHA256 from the key of the settings file and a random nonce which is stored
+    in the cache file. So loading and saving the cache costs no key derivation. Only settings with at least
+    min_iterations are cached because generating their passwords takes much longer than that.
+
+    The cache file names the salt of the settings file whose key encrypts it. The settings file gets a new salt with
+    every save, so the manager passes the new key to set_vault_key and saves the cache again. A cache file for
+    another salt is ignored.
+
+    The cached passwords only belong to the masterpassword they were generated with. The cache stores an HMAC of
+    the masterpassword with a random secret. Another masterpassword finds no entries and replaces them with its
+    first new entry.
+
+    Every entry remembers a hash of all parameters which influence the password: domain, username, salt, iteration
+    count, length and character set. If one of them changes the entry does not match anymore and is replaced.
+
+    :param str cache_file: filename of the cache
+    :param int max_entries: maximum number of cached passwords. The least recently used are dropped first.
+    :param int max_age: maximum age of a cached password in seconds
+    :param int min_iterations: only settings with at least this iteration count are cached
+    """
+    def __init__(self, cache_file, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE,
+                 min_iterations=DEFAULT_MIN_ITERATIONS):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.min_iterations = min_iterations
+        self.vault_salt = None
+        self.vault_key = None
+        self.secret = None
+        self.password_check = None
+        self.entries = None
+        self.changed = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_parameter_hash(setting):
+        """
+        Returns a hash of all parameters of the setting which influence the generated password.
+
+        :param PasswordSetting setting: the setting
+        :return: hex encoded SHA256 hash
+        :rtype: str
+        """
+        return hashlib.sha256(json.dumps([
+            setting.get_domain(),
+            setting.get_username(),
+            str(b64encode(setting.get_salt()), encoding='utf-8'),
+            setting.get_iterations(),
+            setting.get_length(),
+            setting.get_character_set()
+        ]).encode('utf-8')).hexdigest()
+
+    def is_cacheable(self, setting):
+        """
+        Returns True if passwords of this setting are cached.
+
+        :param PasswordSetting setting: the setting
+        :rtype: bool
+        """
+        return setting.get_iterations() >= self.min_iterations and not setting.has_legacy_password()
+
+    def set_vault_key(self, salt, key):
+        """
+        Sets the key of the settings file. The cache can not be used before the settings file was loaded or saved.
+        If the key changes the cached passwords are kept and encrypted with the new key by the next save.
+
+        :param bytes salt: salt of the settings file
+        :param bytes key: key of the settings file (Crypter.key)
+        """
+        with self.lock:
+            if salt == self.vault_salt:
+                return
+            if self.vault_key is not None:
+                self.load()
+                self.changed = len(self.entries) > 0
+            self.vault_salt = salt
+            self.vault_key = key
+
+    def get_cache_key(self, nonce):
+        """
+        Derives the key of the cache file from the key of the settings file.
+
+        :param bytes nonce: the random nonce of the cache file
+        :return: the key with 32 bytes
+        :rtype: bytes
+        """
+        return hmac.new(self.vault_key, CACHE_KEY_LABEL + nonce, hashlib.sha256).digest()
+
+    def get_password_check(self, password):
+        """
+        :param str password: masterpassword
+        :return: hex encoded HMAC of the masterpassword with the secret of the cache
+        :rtype: str
+        """
+        return hmac.new(self.secret, password.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def is_owner(self, password):
+        """
+        Returns True if the cached passwords were generated with this masterpassword.
+
+        :param str password: masterpassword
+        :rtype: bool
+        """
+        return self.secret is not None and hmac.compare_digest(self.password_check, self.get_password_check(password))
+
+    def load(self):
+        """
+        Reads the cache file if it was not read before. A missing file, a file for another salt of the settings file
+        or a file which can not be decrypted results in an empty cache. Call this only while holding the lock.
+        """
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if self.vault_key is not None and os.path.isfile(self.cache_file):
+            with open(self.cache_file, 'br') as file:
+                data = file.read()
+            if data[:32] == self.vault_salt:
+                try:
+                    crypter = Crypter.from_key(self.get_cache_key(data[32:64]))
+                    content = json.loads(str(Packer.decompress(crypter.decrypt(data[64:])), encoding='utf-8'))
+                    self.secret = b64decode(content['secret'])
+                    self.password_check = content['check']
+                    self.entries = content['entries']
+                    if type(self.password_check) != str or type(self.entries) != dict:
+                        raise ValueError("Invalid cache file.")
+                except (zlib.error, ValueError, IndexError, KeyError, TypeError):
+                    self.secret = None
+                    self.entries = {}
+        self.prune()
+
+    def prune(self):
+        """
+        Removes entries which are older than max_age and the least recently used entries above max_entries.
+        """
+        now = time.time()
+        for domain in [domain for domain, entry in self.entries.items() if now - entry['created'] > self.max_age]:
+            self.entries.pop(domain)
+            self.changed = True
+        if len(self.entries) > self.max_entries:
+            by_usage = sorted(self.entries.keys(), key=lambda domain: self.entries[domain]['used'])
+            for domain in by_usage[:len(self.entries) - self.max_entries]:
+                self.entries.pop(domain)
+            self.changed = True
+
+    def get(self, password, setting):
+        """
+        Returns the cached password for the setting or None if there is no valid entry.
+
+        :param str password: masterpassword
+        :param PasswordSetting setting: the setting
+        :return: the cached password or None
+        :rtype: str
+        """
+        with self.lock:
+            if self.vault_key is None:
+                return None
+            self.load()
+            if not self.is_owner(password):
+                return None
+            entry = self.entries.get(setting.get_domain())
+            if entry is None:
+                return None
+            if entry['hash'] != self.get_parameter_hash(setting) or \
+                    time.time() - entry['created'] > self.max_age:
+                self.entries.pop(setting.get_domain())
+                self.changed = True
+                return None
+            entry['used'] = time.time()
+            return entry['password']
+
+    def put(self, password, setting, generated_password):
+        """
+        Stores a generated password in memory. Call save to write it to the cache file.
+
+        :param str password: masterpassword
+        :param PasswordSetting setting: the setting
+        :param str generated_password: the password generated for this setting
+        """
+        with self.lock:
+            if self.vault_key is None:
+                return
+            self.load()
+            if not self.is_owner(password):
+                self.secret = os.urandom(32)
+                self.password_check = self.get_password_check(password)
+                self.entries = {}
+            now = time.time()
+            self.entries[setting.get_domain()] = {
+                'hash': self.get_parameter_hash(setting),
+                'password': generated_password,
+                'created': now,
+                'used': now
+            }
+            self.changed = True
+            self.prune()
+
+    def save(self):
+        """
+        Writes the cache file if the cache was changed. The file is replaced atomically so an interrupted write does
+        not destroy the cached passwords.
+        """
+        with self.lock:
+            if not self.changed or self.entries is None or self.vault_key is None or self.secret is None:
+                return
+            nonce = os.urandom(32)
+            crypter = Crypter.from_key(self.get_cache_key(nonce))
+            content = json.dumps({
+                'secret': str(b64encode(self.secret), encoding='utf-8'),
+                'check': self.password_check,
+                'entries': self.entries
+            })
+            write_file_atomically(self.cache_file, self.vault_salt + nonce + crypter.encrypt(Packer.compress(content)))
+            self.changed = False
+
+    def clear(self):
+        """
+        Removes all entries and deletes the cache file.
+        """
+        with self.lock:
+            self.secret = None
+            self.entries = {}
+            self.changed = False
+            if os.path.isfile(self.cache_file):
+                os.remove(self.cache_file)
@@ -5,9 +5,23 @@ Password manager. It's name is CtSesam because it produces passwords which are c
 c't SESAM implementations.
 """
 
-from hashlib import pbkdf2_hmac
+import os
+import importlib.util
+from KdfExecutor import pbkdf2_hmac, apbkdf2_hmac, INTERACTIVE
 
 DEFAULT_CHARACTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHJKLMNPQRTUVWXYZ0123456789#!"§$%&/()[]{}=-_+*<>;:.'
+RANDOM_DIGEST_SIZE = 64
+MAX_PAIR_TABLE_SIZE = 65536
+
+
+def is_numpy_installed():
+    """
+    Checks for NumPy without importing it. Importing NumPy takes longer than starting the rest of the program so it
+    is imported when many passwords are converted at once.
+
+    :rtype: bool
+    """
+    return importlib.util.find_spec('numpy') is not None
 
 
 class CtSesam:
@@ -53,17 +67,143 @@ class CtSesam:
         :rtype: str
         """
         number = int.from_bytes(digest, byteorder='big')
-        password = ''
-        while number > 0 and len(password) < length:
-            password = password + self.password_characters[number % len(self.password_characters)]
-            number //= len(self.password_characters)
-        return password
+        characters = []
+        while number > 0 and len(characters) < length:
+            number, index = divmod(number, len(self.password_characters))
+            characters.append(self.password_characters[index])
+        return ''.join(characters)
+
+    def convert_bytes_to_passwords(self, data, length, digest_size=RANDOM_DIGEST_SIZE, use_numpy=None):
+        """
+        Bulk version of convert_bytes_to_password: data is split into digests of digest_size bytes and every digest
+        is converted to a password. The passwords are character for character the same as those of
+        convert_bytes_to_password. Use this to create many random passwords (see generate_random_passwords).
+
+        The characters are the digits of the digest in the base of the character set. They are unbiased as long as
+        the digest is much larger than the password: the bias of 64 bytes is below 2^-400 for passwords of up to 10
+        characters from 84 characters.
+
+        With NumPy all digests are divided at once. Without NumPy every digest needs one big division and the
+        remainder is converted with a table of character pairs.
+
+        :param bytes data: pseudo-random data. Its length must be a multiple of digest_size.
+        :param int length: length of the passwords
+        :param int digest_size: bytes per password
+        :param bool use_numpy: use NumPy? Defaults to True if NumPy is installed.
+        :return: the passwords
+        :rtype: [str]
+        :raises ValueError: if the length of data is not a multiple of digest_size
+        """
+        if digest_size < 1 or len(data) % digest_size != 0:
+            raise ValueError("The length of the data must be a multiple of the digest size.")
+        if use_numpy is not False and len(self.password_characters) > 1 and length > 0 and len(data) > 0:
+            try:
+                return self.convert_digests_with_numpy(data, digest_size, length)
+            except ImportError:
+                if use_numpy:
+                    raise
+        digests = [data[start:start + digest_size] for start in range(0, len(data), digest_size)]
+        if len(self.password_characters) < 2 or length < 1:
+            return [self.convert_bytes_to_password(digest, length) for digest in digests]
+        return self.convert_digests(digests, length)
+
+    def convert_digests(self, digests, length):
+        """
+        Pure Python part of convert_bytes_to_passwords. The lowest length digits of every digest are split off with
+        one division and converted two at a time. Digests with fewer digits are converted by
+        convert_bytes_to_password.
+
+        :param [bytes] digests: the digests
+        :param int length: length of the passwords
+        :return: the passwords
+        :rtype: [str]
+        """
+        base = len(self.password_characters)
+        if base ** 2 <= MAX_PAIR_TABLE_SIZE:
+            table = [first + second for second in self.password_characters for first in self.password_characters]
+            chunk_size = 2
+        else:
+            table = list(self.password_characters)
+            chunk_size = 1
+        chunk_base = base ** chunk_size
+        password_base = base ** length
+        chunks = range((length + chunk_size - 1) // chunk_size)
+        passwords = []
+        for digest in digests:
+            number = int.from_bytes(digest, byteorder='big')
+            if number < password_base:
+                passwords.append(self.convert_bytes_to_password(digest, length))
+                continue
+            number %= password_base
+            parts = []
+            for _ in chunks:
+                number, index = divmod(number, chunk_base)
+                parts.append(table[index])
+            passwords.append(''.join(parts)[:length])
+        return passwords
+
+    def convert_digests_with_numpy(self, data, digest_size, length):
+        """
+        NumPy part of convert_bytes_to_passwords. The digests are stored as 32 bit limbs and divided at once by the
+        largest power of the base below 2^32. Every division yields several characters. Digests with fewer digits
+        than length are converted by convert_bytes_to_password.
 
-    def generate(self, master_password, domain, username='', length=10, iterations=4096):
+        :param bytes data: the digests
+        :param int digest_size: bytes per digest
+        :param int length: length of the passwords
+        :return: the passwords
+        :rtype: [str]
+        :raises ImportError: if NumPy is not installed
+        """
+        import numpy
+        base = len(self.password_characters)
+        count = len(data) // digest_size
+        rows = numpy.frombuffer(data, dtype=numpy.uint8).reshape(count, digest_size)
+        if digest_size % 4 > 0:
+            rows = numpy.hstack([numpy.zeros((count, 4 - digest_size % 4), dtype=numpy.uint8), rows])
+        limbs = numpy.ascontiguousarray(rows.view('>u4').T, dtype=numpy.uint64)
+        digits_per_division = 1
+        while base ** (digits_per_division + 1) < 2 ** 32:
+            digits_per_division += 1
+        digits = numpy.empty((count, length), dtype=numpy.intp)
+        remainder = numpy.empty(count, dtype=numpy.uint64)
+        for start in range(0, length, digits_per_division):
+            division_digits = min(digits_per_division, length - start)
+            divisor = numpy.uint64(base ** division_digits)
+            remainder.fill(0)
+            for limb in limbs:
+                remainder <<= numpy.uint64(32)
+                remainder |= limb
+                numpy.floor_divide(remainder, divisor, out=limb)
+                remainder -= limb * divisor
+            for position in range(start, start + division_digits):
+                digits[:, position] = remainder % numpy.uint64(base)
+                remainder //= numpy.uint64(base)
+        characters = numpy.array(list(self.password_characters), dtype='<U1')
+        passwords = characters[digits].view('<U' + str(length)).ravel().tolist()
+        for row in numpy.flatnonzero(~limbs.any(axis=0)):
+            passwords[row] = self.convert_bytes_to_password(data[row * digest_size:(row + 1) * digest_size], length)
+        return passwords
+
+    def generate_random_passwords(self, count, length, digest_size=RANDOM_DIGEST_SIZE, use_numpy=None):
+        """
+        Creates random passwords from os.urandom with convert_bytes_to_passwords.
+
+        :param int count: number of passwords
+        :param int length: length of the passwords
+        :param int digest_size: random bytes per password
+        :param bool use_numpy: use NumPy? Defaults to True if NumPy is installed.
+        :return: the passwords
+        :rtype: [str]
+        """
+        return self.convert_bytes_to_passwords(os.urandom(count * digest_size), length, digest_size, use_numpy)
+
+    def generate(self, master_password, domain, username='', length=10, iterations=4096, priority=INTERACTIVE):
         """
         This method does all the work. It calculates a password with PBKDF2 and convert_bytes_to_password.
         4096 iterations will give you a password in ~0.04s. If you have a fast computer you can increase this
-        to make it harder to hack your masterpassword.
+        to make it harder to hack your masterpassword. The PBKDF2 calculation is scheduled on the KdfExecutor with
+        the given priority.
 
         :param master_password:
         :type master_password: str
@@ -75,12 +215,39 @@ class CtSesam:
         :type length: int
         :param iterations:
         :type iterations: int
+        :param priority: KdfExecutor.INTERACTIVE, SYNC or BATCH
+        :type priority: int
+        :return: a password
+        :rtype: str
+        """
+        if len(self.password_characters) > 0:
+            hash_string = domain + username + master_password
+            hashed_bytes = pbkdf2_hmac('sha512', hash_string.encode('utf-8'), self.salt, iterations,
+                                       priority=priority)
+            return self.convert_bytes_to_password(hashed_bytes, length)
+        else:
+            print('Für das Passwort stehen keine Zeichen zur Verfügung. Sie sollten die Einstellungen ändern.')
+            return ''
+
+    async def agenerate(self, master_password, domain, username='', length=10, iterations=4096,
+                        priority=INTERACTIVE):
+        """
+        Coroutine version of generate. The event loop keeps running during the PBKDF2 calculation on the
+        KdfExecutor.
+
+        :param str master_password: masterpassword
+        :param str domain: the domain
+        :param str username: the username
+        :param int length: length of the password
+        :param int iterations: iteration count of PBKDF2
+        :param int priority: KdfExecutor.INTERACTIVE, SYNC or BATCH
         :return: a password
         :rtype: str
         """
         if len(self.password_characters) > 0:
             hash_string = domain + username + master_password
-            hashed_bytes = pbkdf2_hmac('sha512', hash_string.encode('utf-8'), self.salt, iterations)
+            hashed_bytes = await apbkdf2_hmac('sha512', hash_string.encode('utf-8'), self.salt, iterations,
+                                              priority=priority)
             return self.convert_bytes_to_password(hashed_bytes, length)
         else:
             print('Für das Passwort stehen keine Zeichen zur Verfügung. Sie sollten die Einstellungen ändern.')
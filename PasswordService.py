@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+A local HTTP service which answers password requests of other programs with the settings of one unlocked
+PasswordSettingsManager.
+"""
+
+import os
+import stat
+import json
+import hmac
+import secrets
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from PasswordSetting import PasswordSetting
+from PasswordCache import PasswordCache
+from settingsTransfer import validate_setting_dict
+from SyncOutbox import OutboxFlusher, DEFAULT_FLUSH_INTERVAL
+
+DEFAULT_MAX_QUEUE = 64
+MAX_REQUEST_SIZE = 1024 * 1024
+LISTEN_BACKLOG = 128
+
+
+class ServiceOverloaded(Exception):
+    """
+    Raised if a request can not be admitted because too many jobs are waiting.
+    """
+    pass
+
+
+class PasswordService:
+    """
+    Handles generate, lookup and update requests. The PBKDF2 calculations run on a bounded pool of worker threads.
+    Identical requests which arrive while the first one is still calculated wait for its result instead of starting
+    the calculation again. If more than max_queue jobs are waiting or running new jobs are rejected with
+    ServiceOverloaded so the latency stays predictable.
+
+    Updates are saved to the settings file right away. They are pushed to the sync server together by a background
+    flusher every flush_interval seconds and when the service shuts down. Lookups read the current snapshot of the
+    settings manager so they do not wait for updates, saves or pushes.
+
+    :param PasswordSettingsManager settings_manager: a manager with loaded settings
+    :param str master_password: masterpassword
+    :param int workers: number of worker threads. Defaults to the number of CPUs.
+    :param int max_queue: maximum number of waiting or running jobs
+    :param float flush_interval: seconds between two pushes of pending updates
+    """
+    def __init__(self, settings_manager, master_password, workers=None, max_queue=DEFAULT_MAX_QUEUE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.settings_manager = settings_manager
+        self.master_password = master_password
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.statistics = {'jobs': 0, 'coalesced': 0, 'rejected': 0}
+        self.flusher = OutboxFlusher(settings_manager, master_password, flush_interval, settings_manager.write_lock)
+        self.flusher.start()
+
+    def shutdown(self):
+        """
+        Waits for running jobs, stops the worker threads and pushes pending updates.
+        """
+        self.executor.shutdown(wait=True)
+        self.flusher.stop()
+
+    def submit(self, key, function, *args):
+        """
+        Runs function(*args) on the worker pool. If a job with the same key is already waiting or running its future
+        is returned instead.
+
+        :param key: identifies identical jobs
+        :param function: the job
+        :return: a future for the result
+        :rtype: concurrent.futures.Future
+        :raises ServiceOverloaded: if max_queue jobs are already waiting or running
+        """
+        with self.lock:
+            if key in self.in_flight:
+                self.statistics['coalesced'] += 1
+                return self.in_flight[key]
+            if len(self.in_flight) >= self.max_queue:
+                self.statistics['rejected'] += 1
+                raise ServiceOverloaded()
+            future = self.executor.submit(function, *args)
+            self.in_flight[key] = future
+            self.statistics['jobs'] += 1
+        future.add_done_callback(lambda done_future: self.finish(key))
+        return future
+
+    def finish(self, key):
+        """
+        Forgets a finished job so the next identical request calculates again.
+
+        :param key: the key of the job
+        """
+        with self.lock:
+            self.in_flight.pop(key, None)
+
+    @staticmethod
+    def check_request(request):
+        """
+        Checks the types of the "domain" and "url" fields of a request.
+
+        :param dict request: the request
+        :raises ValueError: if a field is not a string
+        """
+        for field in ['domain', 'url']:
+            if field in request and type(request[field]) != str:
+                raise ValueError("The field " + field + " has to be a string.")
+
+    def find_setting(self, request):
+        """
+        Returns the setting for the "domain" or "url" of a request. A new setting with default values is returned if
+        nothing was found. It is not stored. The setting is looked up in the current snapshot of the manager without
+        waiting for a running save or sync. Do not change it.
+
+        :param dict request: the request
+        :return: the setting
+        :rtype: PasswordSetting
+        """
+        self.check_request(request)
+        snapshot = self.settings_manager.get_snapshot()
+        if type(request.get('domain')) == str and request['domain'] in snapshot:
+            return snapshot.get(request['domain'])
+        if 'url' in request:
+            found_settings = snapshot.find_settings_by_url(request['url'])
+            if len(found_settings) > 0:
+                return found_settings[0]
+        if 'domain' not in request or type(request['domain']) != str or len(request['domain']) < 1:
+            raise ValueError("Please specify a domain or the url of a saved setting.")
+        return PasswordSetting(request['domain'])
+
+    def generate(self, request):
+        """
+        Calculates the password for the setting of the domain or url in the request.
+
+        :param dict request: {"domain": ...} or {"url": ...}
+        :return: the domain of the setting, the username and the password
+        :rtype: dict
+        """
+        setting = self.find_setting(request)
+        if setting.has_legacy_password():
+            password = setting.get_legacy_password()
+        else:
+            key = ('generate', setting.get_domain(), PasswordCache.get_parameter_hash(setting))
+            password = self.submit(key, self.settings_manager.generate_password,
+                                   self.master_password, setting).result()
+        return {'domain': setting.get_domain(), 'username': setting.get_username(), 'password': password}
+
+    def lookup(self, request):
+        """
+        Returns the saved settings for the domain or url in the request.
+
+        :param dict request: {"domain": ...} or {"url": ...}
+        :return: list of settings as dicts
+        :rtype: [dict]
+        """
+        self.check_request(request)
+        snapshot = self.settings_manager.get_snapshot()
+        if type(request.get('domain')) == str and request['domain'] in snapshot:
+            return [snapshot.get(request['domain']).to_dict()]
+        if 'url' in request:
+            return [setting.to_dict() for setting in snapshot.find_settings_by_url(request['url'])]
+        return []
+
+    def update(self, request):
+        """
+        Saves a setting and stores all settings locally. The sync server gets it with the next flush of the outbox.
+
+        :param dict request: {"setting": {...}} with a setting in the format of PasswordSetting.to_dict
+        :return: the saved setting
+        :rtype: dict
+        """
+        if 'setting' not in request:
+            raise ValueError("Please send the setting.")
+        data_set = validate_setting_dict(request['setting'])
+        setting = PasswordSetting(data_set['domain'])
+        setting.load_from_dict(data_set)
+        if 'mDate' not in data_set:
+            setting.set_modification_date()
+        self.submit(('update', setting.get_domain(), json.dumps(data_set, sort_keys=True)),
+                    self.store_setting, setting).result()
+        return setting.to_dict()
+
+    def store_setting(self, setting):
+        """
+        Sets the setting at the manager and saves the settings file.
+
+        :param PasswordSetting setting: the setting
+        """
+        with self.settings_manager.updating():
+            self.settings_manager.set_setting(setting)
+            self.settings_manager.save_settings_to_file(self.master_password)
+
+    def get_action(self, name):
+        """
+        Returns the method which handles the action or None for unknown actions.
+
+        :param str name: generate, lookup or update
+        :return: the method
+        """
+        return {
+            'generate': self.generate,
+            'lookup': self.lookup,
+            'update': self.update
+        }.get(name)
+
+
+class PasswordRequestHandler(BaseHTTPRequestHandler):
+    """
+    Accepts POST requests with a JSON body at /generate, /lookup and /update. The answers have the format
+    {"status": true, "result": ...} or {"status": false, "error": ...}.
+    """
+    def address_string(self):
+        if type(self.client_address) == tuple and len(self.client_address) > 0:
+            return str(self.client_address[0])
+        return 'unix-socket'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, code, answer, headers=None):
+        """
+        Sends a JSON answer.
+
+        :param int code: HTTP status code
+        :param dict answer: the answer
+        :param dict headers: additional headers
+        """
+        body = json.dumps(answer).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.server.token and not hmac.compare_digest(
+                self.headers.get('Authorization', ''), 'Bearer ' + self.server.token):
+            self.send_json(401, {'status': False, 'error': "Unauthorized."})
+            return
+        action = self.server.service.get_action(self.path.strip('/'))
+        if action is None:
+            self.send_json(404, {'status': False, 'error': "Unknown action."})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError("Invalid Content-Length.")
+            if length > MAX_REQUEST_SIZE:
+                self.send_json(413, {'status': False, 'error': "The request is too large."})
+                return
+            request = json.loads(str(self.rfile.read(length), encoding='utf-8'))
+            if type(request) != dict:
+                raise ValueError("The request has to be a JSON object.")
+            result = action(request)
+        except ServiceOverloaded:
+            self.send_json(503, {'status': False, 'error': "Too many requests."}, {'Retry-After': '1'})
+        except (ValueError, UnicodeDecodeError) as error:
+            self.send_json(400, {'status': False, 'error': str(error)})
+        except Exception as error:
+            self.log_error("The request failed: %r", error)
+            self.send_json(500, {'status': False, 'error': "Internal error."})
+        else:
+            self.send_json(200, {'status': True, 'result': result})
+
+
+class PasswordHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    HTTP server for a PasswordService listening on a TCP port of the local host. Every program on the host can
+    connect to the port so clients always have to authenticate.
+
+    :param PasswordService service: the service
+    :param int port: the port. 0 chooses a free port.
+    :param str token: clients have to send the header "Authorization: Bearer <token>". A random token is generated
+                      if it is not set. It is stored in the attribute token.
+    :param str host: the address to listen on
+    """
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, service, port=0, token=None, host='127.0.0.1'):
+        self.service = service
+        self.token = token or secrets.token_urlsafe(32)
+        self.verbose = False
+        HTTPServer.__init__(self, (host, port), PasswordRequestHandler)
+
+
+class PasswordUnixServer(socketserver.ThreadingUnixStreamServer):
+    """
+    HTTP server for a PasswordService listening on a unix socket which only the owner may access. A socket left
+    over at the path is replaced. Any other file is not touched.
+
+    :param PasswordService service: the service
+    :param str socket_file: path of the socket
+    :param str token: if set clients have to send the header "Authorization: Bearer <token>"
+    :raises FileExistsError: if a file which is not a socket exists at the path
+    """
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, service, socket_file, token=None):
+        self.service = service
+        self.token = token
+        self.verbose = False
+        if os.path.lexists(socket_file):
+            if not stat.S_ISSOCK(os.lstat(socket_file).st_mode):
+                raise FileExistsError("Not a socket: " + socket_file)
+            os.remove(socket_file)
+        socketserver.ThreadingUnixStreamServer.__init__(self, socket_file, PasswordRequestHandler, False)
+        try:
+            self.server_bind()
+            os.chmod(socket_file, 0o600)
+            self.server_activate()
+        except BaseException:
+            self.server_close()
+            raise
+
+    def server_close(self):
+        socketserver.ThreadingUnixStreamServer.server_close(self)
+        if os.path.lexists(self.server_address) and stat.S_ISSOCK(os.lstat(self.server_address).st_mode):
+            os.remove(self.server_address)
@@ -5,6 +5,9 @@ Sets of password settings for a domain.
 """
 
 from datetime import datetime
+import copy
+import json
+import hashlib
 import getpass
 import string
 from base64 import b64encode, b64decode
@@ -14,6 +17,30 @@ DEFAULT_CHARACTER_SET_LOWER_CASE = "abcdefghijklmnopqrstuvwxyz"
 DEFAULT_CHARACTER_SET_UPPER_CASE = "ABCDEFGHJKLMNPQRTUVWXYZ"
 DEFAULT_CHARACTER_SET_DIGITS = string.digits
 DEFAULT_CHARACTER_SET_EXTRA = '#!"§$%&/()[]{}=-_+*<>;:.'
+LOWER_CASE = 1
+UPPER_CASE = 2
+DIGITS = 4
+EXTRA = 8
+LETTERS = LOWER_CASE | UPPER_CASE
+ALL_CHARACTER_CLASSES = LOWER_CASE | UPPER_CASE | DIGITS | EXTRA
+CHARACTER_SETS = ["".join([characters for character_class, characters in [
+    (LOWER_CASE, DEFAULT_CHARACTER_SET_LOWER_CASE),
+    (UPPER_CASE, DEFAULT_CHARACTER_SET_UPPER_CASE),
+    (DIGITS, DEFAULT_CHARACTER_SET_DIGITS),
+    (EXTRA, DEFAULT_CHARACTER_SET_EXTRA)] if mask & character_class]) for mask in range(ALL_CHARACTER_CLASSES + 1)]
+CHARACTER_SET_MEMBERS = [frozenset(character_set) for character_set in CHARACTER_SETS]
+CHARACTER_CLASSES_BY_SET = {character_set: mask for mask, character_set in enumerate(CHARACTER_SETS)}
+
+
+def get_fingerprint(data_set):
+    """
+    Returns a hash of a setting dict or a tombstone. Two data sets with the same fingerprint are equal.
+
+    :param dict data_set: a setting in the format of PasswordSetting.to_dict or a tombstone
+    :return: hex encoded hash
+    :rtype: str
+    """
+    return hashlib.sha256(json.dumps(data_set, sort_keys=True).encode('utf-8')).hexdigest()[:32]
 
 
 class PasswordSetting:
@@ -31,9 +58,13 @@ class PasswordSetting:
         self.length = 10
         self.creation_date = datetime.now()
         self.modification_date = self.creation_date
-        self.used_characters = self.get_default_character_set()
+        self.character_classes = ALL_CHARACTER_CLASSES
+        self.custom_characters = None
         self.reserved = None
         self.synced = False
+        self.cached_dict = None
+        self.cached_json = None
+        self.cached_fingerprint = None
 
     def get_domain(self):
         """
@@ -51,6 +82,7 @@ class PasswordSetting:
         :param domain: the domain
         :type domain: str
         """
+        self.invalidate_cache()
         self.domain = domain
         self.synced = False
 
@@ -82,6 +114,7 @@ class PasswordSetting:
         :param username: the username
         :type username: str
         """
+        self.invalidate_cache()
         if username != self.username:
             self.synced = False
         self.username = username
@@ -114,6 +147,7 @@ class PasswordSetting:
         :param legacy_password: a legacy password
         :type legacy_password: str
         """
+        self.invalidate_cache()
         if legacy_password != self.legacy_password:
             self.synced = False
         self.legacy_password = legacy_password
@@ -126,8 +160,7 @@ class PasswordSetting:
         :return: does it use letters?
         :rtype: bool
         """
-        return self.used_characters[:len(DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE)] == \
-            DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE
+        return self.character_classes & LETTERS == LETTERS
 
     def set_use_letters(self, use_letters):
         """
@@ -137,18 +170,7 @@ class PasswordSetting:
         :param use_letters:
         :type use_letters: bool
         """
-        old_character_set = self.used_characters
-        pos = 0
-        while pos < len(self.used_characters):
-            if self.used_characters[pos] in DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE:
-                self.used_characters = self.used_characters[:pos] + self.used_characters[pos + 1:]
-            else:
-                pos += 1
-        if use_letters:
-            self.used_characters = DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE + \
-                self.used_characters
-        if old_character_set != self.used_characters:
-            self.synced = False
+        self.set_use_character_classes(LETTERS, use_letters)
 
     def use_lower_case(self):
         """
@@ -158,7 +180,7 @@ class PasswordSetting:
         :return: using lower case?
         :rtype: bool
         """
-        return self.used_characters[:len(DEFAULT_CHARACTER_SET_LOWER_CASE)] == DEFAULT_CHARACTER_SET_LOWER_CASE
+        return self.character_classes & LOWER_CASE == LOWER_CASE
 
     def set_use_lower_case(self, use_lower_case):
         """
@@ -169,17 +191,7 @@ class PasswordSetting:
         :param use_lower_case:
         :type use_lower_case: bool
         """
-        old_character_set = self.used_characters
-        pos = 0
-        while pos < len(self.used_characters):
-            if self.used_characters[pos] in DEFAULT_CHARACTER_SET_LOWER_CASE:
-                self.used_characters = self.used_characters[:pos] + self.used_characters[pos + 1:]
-            else:
-                pos += 1
-        if use_lower_case:
-            self.used_characters = DEFAULT_CHARACTER_SET_LOWER_CASE + self.used_characters
-        if old_character_set != self.used_characters:
-            self.synced = False
+        self.set_use_character_classes(LOWER_CASE, use_lower_case)
 
     def use_upper_case(self):
         """
@@ -189,10 +201,7 @@ class PasswordSetting:
         :return: use upper case?
         :rtype: bool
         """
-        return self.used_characters[
-            len(DEFAULT_CHARACTER_SET_LOWER_CASE):len(
-                DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE)] \
-            == DEFAULT_CHARACTER_SET_UPPER_CASE
+        return self.character_classes & UPPER_CASE == UPPER_CASE
 
     def set_use_upper_case(self, use_upper_case):
         """
@@ -203,18 +212,7 @@ class PasswordSetting:
         :param use_upper_case:
         :type use_upper_case: bool
         """
-        old_character_set = self.used_characters
-        pos = 0
-        while pos < len(self.used_characters):
-            if self.used_characters[pos] in DEFAULT_CHARACTER_SET_UPPER_CASE:
-                self.used_characters = self.used_characters[:pos] + self.used_characters[pos + 1:]
-            else:
-                pos += 1
-        if use_upper_case:
-            self.used_characters = self.used_characters[:len(DEFAULT_CHARACTER_SET_LOWER_CASE)] + \
-                DEFAULT_CHARACTER_SET_LOWER_CASE + self.used_characters[len(DEFAULT_CHARACTER_SET_LOWER_CASE):]
-        if old_character_set != self.used_characters:
-            self.synced = False
+        self.set_use_character_classes(UPPER_CASE, use_upper_case)
 
     def use_digits(self):
         """
@@ -223,10 +221,7 @@ class PasswordSetting:
         :return: use digits?
         :rtype: bool
         """
-        return self.used_characters[
-            len(DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE):len(
-                DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE + DEFAULT_CHARACTER_SET_DIGITS)] \
-            == DEFAULT_CHARACTER_SET_DIGITS
+        return self.character_classes & DIGITS == DIGITS
 
     def set_use_digits(self, use_digits):
         """
@@ -236,20 +231,7 @@ class PasswordSetting:
         :param use_digits:
         :type use_digits: bool
         """
-        old_character_set = self.used_characters
-        pos = 0
-        while pos < len(self.used_characters):
-            if self.used_characters[pos] in DEFAULT_CHARACTER_SET_DIGITS:
-                self.used_characters = self.used_characters[:pos] + self.used_characters[pos + 1:]
-            else:
-                pos += 1
-        if use_digits:
-            self.used_characters = self.used_characters[
-                :len(DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE)] + \
-                DEFAULT_CHARACTER_SET_DIGITS + self.used_characters[
-                    len(DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE):]
-        if old_character_set != self.used_characters:
-            self.synced = False
+        self.set_use_character_classes(DIGITS, use_digits)
 
     def use_extra(self):
         """
@@ -259,9 +241,7 @@ class PasswordSetting:
         :return: use special characters?
         :rtype: bool
         """
-        return self.used_characters[
-            len(DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE + DEFAULT_CHARACTER_SET_DIGITS):] \
-            == DEFAULT_CHARACTER_SET_EXTRA
+        return self.character_classes & EXTRA == EXTRA
 
     def set_use_extra(self, use_extra):
         """
@@ -272,17 +252,60 @@ class PasswordSetting:
         :param use_extra:
         :type use_extra: bool
         """
-        old_character_set = self.used_characters
-        pos = 0
-        while pos < len(self.used_characters):
-            if self.used_characters[pos] in DEFAULT_CHARACTER_SET_EXTRA:
-                self.used_characters = self.used_characters[:pos] + self.used_characters[pos + 1:]
+        self.set_use_character_classes(EXTRA, use_extra)
+
+    def set_use_character_classes(self, character_classes, use):
+        """
+        Adds or removes default character classes. For character sets built from default classes this only changes
+        the bitmask. Custom character sets are changed like this: If use is False all characters of the classes are
+        removed. If use is True the classes are removed and inserted again in the default order at their default
+        position.
+
+        :param int character_classes: bitmask of LOWER_CASE, UPPER_CASE, DIGITS and EXTRA
+        :param bool use: add or remove the classes?
+        """
+        if self.custom_characters is None:
+            if use:
+                self.set_character_classes(self.character_classes | character_classes)
             else:
-                pos += 1
-        if use_extra:
-            self.used_characters += DEFAULT_CHARACTER_SET_EXTRA
-        if old_character_set != self.used_characters:
+                self.set_character_classes(self.character_classes & ~character_classes)
+        else:
+            removed_characters = CHARACTER_SET_MEMBERS[character_classes]
+            character_set = "".join([character for character in self.custom_characters
+                                     if character not in removed_characters])
+            if use:
+                lowest_class = character_classes & -character_classes
+                if lowest_class == EXTRA:
+                    position = len(character_set)
+                else:
+                    position = len(CHARACTER_SETS[lowest_class - 1])
+                character_set = character_set[:position] + CHARACTER_SETS[character_classes] + \
+                    character_set[position:]
+            self.set_custom_character_set(character_set)
+
+    def get_character_classes(self):
+        """
+        Returns the default character classes used in the character set as a bitmask of LOWER_CASE, UPPER_CASE,
+        DIGITS and EXTRA.
+
+        :return: bitmask of character classes
+        :rtype: int
+        """
+        return self.character_classes
+
+    def set_character_classes(self, character_classes):
+        """
+        Sets the character set to the default character classes in the bitmask. The classes are used in the default
+        order. A custom character set is replaced.
+
+        :param int character_classes: bitmask of LOWER_CASE, UPPER_CASE, DIGITS and EXTRA
+        """
+        self.invalidate_cache()
+        character_classes &= ALL_CHARACTER_CLASSES
+        if self.custom_characters is not None or self.character_classes != character_classes:
             self.synced = False
+        self.character_classes = character_classes
+        self.custom_characters = None
 
     def use_custom_character_set(self):
         """
@@ -291,8 +314,7 @@ class PasswordSetting:
         :return: are we using a custom character set?
         :rtype: bool
         """
-        return not self.used_characters == DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE + \
-            DEFAULT_CHARACTER_SET_DIGITS + DEFAULT_CHARACTER_SET_EXTRA
+        return self.custom_characters is not None or self.character_classes != ALL_CHARACTER_CLASSES
 
     @staticmethod
     def get_default_character_set():
@@ -303,8 +325,7 @@ class PasswordSetting:
         :return: the default character set
         :rtype: str
         """
-        return DEFAULT_CHARACTER_SET_LOWER_CASE + DEFAULT_CHARACTER_SET_UPPER_CASE + \
-            DEFAULT_CHARACTER_SET_DIGITS + DEFAULT_CHARACTER_SET_EXTRA
+        return CHARACTER_SETS[ALL_CHARACTER_CLASSES]
 
     def get_character_set(self):
         """
@@ -313,7 +334,10 @@ class PasswordSetting:
         :return: character set
         :rtype: str
         """
-        return self.used_characters
+        if self.custom_characters is None:
+            return CHARACTER_SETS[self.character_classes]
+        else:
+            return self.custom_characters
 
     def set_custom_character_set(self, character_set):
         """
@@ -321,9 +345,18 @@ class PasswordSetting:
 
         :param str character_set: character set
         """
-        if self.used_characters != character_set:
+        self.invalidate_cache()
+        if self.get_character_set() != character_set:
             self.synced = False
-        self.used_characters = character_set
+        if character_set in CHARACTER_CLASSES_BY_SET:
+            self.character_classes = CHARACTER_CLASSES_BY_SET[character_set]
+            self.custom_characters = None
+        else:
+            self.character_classes = 0
+            for character_class in [LOWER_CASE, UPPER_CASE, DIGITS, EXTRA]:
+                if CHARACTER_SETS[character_class] in character_set:
+                    self.character_classes |= character_class
+            self.custom_characters = character_set
 
     def get_salt(self):
         """
@@ -353,6 +386,7 @@ class PasswordSetting:
         :param salt:
         :type salt: bytes or str
         """
+        self.invalidate_cache()
         if type(salt) == bytes:
             if self.salt != salt:
                 self.synced = False
@@ -380,6 +414,7 @@ class PasswordSetting:
         :param length:
         :type length: int
         """
+        self.invalidate_cache()
         if self.length != length:
             self.synced = False
         self.length = length
@@ -400,6 +435,7 @@ class PasswordSetting:
         :param iterations:
         :type iterations: int
         """
+        self.invalidate_cache()
         if self.iterations != iterations:
             self.synced = False
         self.iterations = iterations
@@ -429,6 +465,7 @@ class PasswordSetting:
         :param creation_date:
         :type creation_date: str
         """
+        self.invalidate_cache()
         if self.creation_date != creation_date:
             self.synced = False
         try:
@@ -464,6 +501,7 @@ class PasswordSetting:
         :param modification_date:
         :type modification_date: str
         """
+        self.invalidate_cache()
         if modification_date and self.modification_date != modification_date:
             self.synced = False
         if type(modification_date) == str:
@@ -498,6 +536,7 @@ class PasswordSetting:
         :param notes:
         :type notes: str
         """
+        self.invalidate_cache()
         if notes != self.notes:
             self.synced = False
         self.notes = notes
@@ -521,10 +560,10 @@ class PasswordSetting:
         :param url: the url
         :type url: str
         """
+        self.invalidate_cache()
         if url != self.url:
             self.synced = False
-        else:
-            return self.url
+        self.url = url
 
     def get_reserved(self):
         """
@@ -568,9 +607,71 @@ class PasswordSetting:
         """
         self.synced = is_synced
 
+    def copy(self):
+        """
+        Returns an independent copy of the setting. All attributes are immutable values so a shallow copy suffices.
+
+        :return: the copy
+        :rtype: PasswordSetting
+        """
+        return copy.copy(self)
+
+    def invalidate_cache(self):
+        """
+        Drops the cached results of to_dict, to_json and get_fingerprint. The setters call this.
+        """
+        self.cached_dict = None
+        self.cached_json = None
+        self.cached_fingerprint = None
+
+    def get_state_hash(self):
+        """
+        Returns a hash of everything the settings file stores about the setting: the dict of to_dict and the synced
+        flag. Two settings with the same hash are saved the same way.
+
+        :return: hex encoded hash
+        :rtype: str
+        """
+        return hashlib.sha256((self.to_json() + str(self.synced)).encode('utf-8')).hexdigest()
+
+    def get_fingerprint(self):
+        """
+        Returns the fingerprint of to_dict (see get_fingerprint). It is cached until a setter changes the setting.
+
+        :return: hex encoded hash
+        :rtype: str
+        """
+        if self.cached_fingerprint is None:
+            self.cached_fingerprint = get_fingerprint(self.to_dict())
+        return self.cached_fingerprint
+
+    def to_json(self):
+        """
+        Returns to_dict serialized with json.dumps. It is cached until a setter changes the setting so saving many
+        settings serializes only the changed ones.
+
+        :return: JSON object
+        :rtype: str
+        """
+        if self.cached_json is None:
+            self.cached_json = json.dumps(self.to_dict())
+        return self.cached_json
+
     def to_dict(self):
         """
-        Returns a dictionary with settings to be saved.
+        Returns a dictionary with settings to be saved. It is built once and cached until a setter changes the
+        setting. Every call returns a new copy.
+
+        :return: a dictionary with settings to be saved
+        :rtype: dict
+        """
+        if self.cached_dict is None:
+            self.cached_dict = self.build_dict()
+        return dict(self.cached_dict)
+
+    def build_dict(self):
+        """
+        Builds the dictionary of to_dict.
 
         :return: a dictionary with settings to be saved
         :rtype: dict
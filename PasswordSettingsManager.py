@@ -7,14 +7,46 @@ The PasswordSettingsManager handles the settings and manages storage and synchro
 import os
 import json
 import struct
+import hashlib
+import threading
+from functools import partial
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from PasswordSetting import PasswordSetting
-from Crypter import Crypter
+from concurrent.futures import ThreadPoolExecutor
+from PasswordSetting import PasswordSetting, get_fingerprint
+from PasswordGenerator import CtSesam
+from PasswordCache import PasswordCache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_AGE, DEFAULT_MIN_ITERATIONS
+from Crypter import Crypter, DEFAULT_KDF, create_kdf
+from VaultHeader import pack_header, unpack_header
+from KdfExecutor import INTERACTIVE, SYNC, BATCH
 from Packer import Packer
 from SyncManager import SyncManager
-from base64 import b64decode, b64encode
+from SyncOutbox import SyncOutbox
+from FileLock import FileLock, write_file_atomically
+from SearchIndex import SearchIndex
+from SettingsSnapshot import SettingsSnapshot
+from SyncMerge import merge_settings, merge_replicas, is_tombstone, create_tombstone, differs, \
+    collect_tombstones, get_blob_hash, TOMBSTONE_HORIZON
 
 PASSWORD_SETTINGS_FILE = os.path.expanduser('~/.ctSESAM.pws')
+CONFLICT_KEEP_NEWER = 'newer'
+CONFLICT_OVERWRITE = 'overwrite'
+CONFLICT_SKIP = 'skip'
+MAX_REPORTED_IMPORT_ERRORS = 100
+PUSH_ATTEMPTS = 3
+ROTATION_ATTEMPTS = 3
+BLOCKING_WORKERS = 4
+
+
+def join_json_object(members):
+    """
+    Builds a JSON object from already serialized values. The result equals json.dumps of the dict.
+
+    :param members: pairs of key and JSON value
+    :return: JSON object
+    :rtype: str
+    """
+    return '{' + ', '.join(json.dumps(key) + ': ' + value for key, value in members) + '}'
 
 
 class PasswordSettingsManager:
@@ -22,15 +54,170 @@ class PasswordSettingsManager:
     Use this class to manage password settings. It can save the settings locally to the settings file and it can
     export them to be sent to a sync server.
 
+    Deleted settings are synchronized as tombstones. Tombstones are dropped from the data on the sync server when
+    they are older than the tombstone horizon. tombstone_report holds the number of tombstones collected by the last
+    push and the bytes they took in the compressed data.
+
+    Local changes are recorded in a SyncOutbox next to the settings file until the sync server has them. Changes
+    which could not be pushed are pushed with the next successful connection.
+
+    Several processes may use the same settings file. Saving locks the file (see FileLock), merges the changes
+    another process saved since this manager loaded or saved the file and replaces the file atomically. Pushes name
+    the hash of the pulled blob. If the server rejects a push because another client pushed in the meantime the
+    manager pulls, merges and tries again.
+
+    If backup sync servers are configured (see SyncManager) their blobs are merged as well when they differ from
+    the blob of the main server (see SyncMerge.merge_replicas). Then the merged data is pushed to all servers.
+
+    The manager can be shared by many threads. The settings are kept in SettingsSnapshot objects which are never
+    changed after they were published. Lookups (get_setting, find_settings_by_url, get_domain_list, get_snapshot)
+    read the current snapshot without locks so they never wait for a save, a sync or a merge. Methods which change
+    something take a write lock, change a draft of the next snapshot and publish it with a single assignment when
+    they are done. Settings returned by the manager are copies: change them and pass them to set_setting.
+
+    asyncio programs use the coroutines aload, astore_settings, aupdate_from_sync and agenerate_password. They talk
+    to the sync server without blocking the event loop. File access, encryption and merges run on a pool of at most
+    blocking_workers threads and password generation runs on the KdfExecutor. Coroutines which change the settings
+    wait for each other. They may run at the same time as threads which use the blocking methods.
+
     :param settings_file: Filename of the settings file. Defaults to PASSWORD_SETTINGS_FILE as defined in the source
     :type settings_file: str
+    :param tombstone_horizon: tombstones of this age are dropped from the sync data
+    :type tombstone_horizon: datetime.timedelta
+    :param int blocking_workers: maximum number of threads for the blocking work of the coroutines
+    :param int max_connections: maximum number of concurrent requests to the sync server of the coroutines
+    :param dict kdf: key derivation function for the settings file (see Crypter.create_kdf). If it is not set the
+                     function of the loaded file is kept. New files use Crypter.DEFAULT_KDF.
     """
-    def __init__(self, settings_file=PASSWORD_SETTINGS_FILE):
+    def __init__(self, settings_file=PASSWORD_SETTINGS_FILE, tombstone_horizon=TOMBSTONE_HORIZON,
+                 blocking_workers=BLOCKING_WORKERS, max_connections=None, kdf=None):
         self.settings_file = settings_file
+        self.kdf = kdf
+        self.tombstone_horizon = tombstone_horizon
+        self.tombstone_report = {'collected': 0, 'bytes_saved': 0}
         self.remote_data = None
-        self.settings = []
-        self.sync_manager = SyncManager()
+        self.snapshot = SettingsSnapshot()
+        self.draft = None
+        self.writer = None
+        self.write_lock = threading.RLock()
+        self.search_lock = threading.RLock()
+        self.deleted_settings = {}
+        self.sync_base = {}
+        self.search_index = None
+        self.password_cache = None
+        self.vault_key = None
+        self.sync_manager = SyncManager(settings_file + '.sync-state', max_connections)
+        self.outbox = SyncOutbox(settings_file + '.outbox')
+        self.file_lock = FileLock(settings_file + '.lock')
+        self.file_digest = None
+        self.file_base = {}
+        self.saved_state_hash = None
+        self.remote_hash = None
+        self.replicas_differ = False
         self.update_remote = False
+        self.blocking_workers = blocking_workers
+        self.blocking_executor = None
+        self.async_write_locks = {}
+
+    @property
+    def settings(self):
+        """
+        The settings of the current snapshot. A thread which is changing the settings sees its draft.
+
+        :return: domain -> PasswordSetting. Do not change it.
+        :rtype: dict
+        """
+        return self.get_current().settings
+
+    def get_current(self):
+        """
+        Returns the draft if the calling thread is changing the settings and the published snapshot otherwise.
+
+        :rtype: SettingsSnapshot
+        """
+        draft = self.draft
+        if draft is not None and self.writer == threading.get_ident():
+            return draft
+        return self.snapshot
+
+    def get_snapshot(self):
+        """
+        Returns the published snapshot. It does not change so a thread can do many consistent reads on it.
+
+        :rtype: SettingsSnapshot
+        """
+        return self.snapshot
+
+    @contextmanager
+    def updating(self):
+        """
+        Context manager for changes: it takes the write lock and publishes the draft at the end. Nested calls in the
+        same thread publish once at the end of the outermost call.
+        """
+        with self.write_lock:
+            if self.writer is not None:
+                yield
+                return
+            self.writer = threading.get_ident()
+            try:
+                yield
+            finally:
+                draft = self.draft
+                self.draft = None
+                self.writer = None
+                if draft is not None:
+                    self.publish(draft)
+
+    def get_draft(self):
+        """
+        Returns the draft of the next snapshot. It is created with the first change. Call this only within updating.
+
+        :rtype: SettingsSnapshot
+        """
+        if self.draft is None:
+            self.draft = self.snapshot.create_draft()
+        return self.draft
+
+    def publish(self, draft):
+        """
+        Makes the draft the current snapshot. The search index is updated with the changed settings first.
+
+        :param SettingsSnapshot draft: the draft
+        """
+        with self.search_lock:
+            if self.search_index is not None:
+                for domain in draft.changed_domains:
+                    if domain in draft.settings:
+                        self.search_index.add(draft.settings[domain])
+                    else:
+                        self.search_index.remove(domain)
+            draft.changed_domains = set()
+            self.snapshot = draft
+
+    def run_blocking(self, function, *args):
+        """
+        Runs a blocking function on the thread pool of the coroutines.
+
+        :param function: the function
+        :param args: its arguments
+        :return: an awaitable for the result
+        """
+        if self.blocking_executor is None:
+            self.blocking_executor = ThreadPoolExecutor(max_workers=self.blocking_workers,
+                                                        thread_name_prefix='settings-manager')
+        import asyncio
+        return asyncio.get_running_loop().run_in_executor(self.blocking_executor, partial(function, *args))
+
+    def get_async_write_lock(self):
+        """
+        :return: the lock which serializes the coroutines which change the settings in the running event loop
+        :rtype: asyncio.Lock
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_write_locks:
+            self.async_write_locks = {loop: asyncio.Lock()}
+        return self.async_write_locks[loop]
 
     def load_settings(self, password, update_from_sync=True, omit_sync_settings_questions=False):
         """
@@ -41,139 +228,623 @@ class PasswordSettingsManager:
         :param bool omit_sync_settings_questions: do not ask for questions? (Defalut: False)
         :type password: str
         """
-        self.load_settings_from_file(password, not update_from_sync or omit_sync_settings_questions)
+        self.load_settings_from_file(password, not update_from_sync or omit_sync_settings_questions,
+                                     defer_sync_settings=not update_from_sync)
         if update_from_sync:
             self.update_from_sync(password)
 
-    def load_settings_from_file(self, password, omit_sync_settings_questions=False):
+    async def aload(self, password, update_from_sync=True):
+        """
+        Coroutine version of load_settings. It never asks for sync settings.
+
+        :param str password: masterpassword
+        :param bool update_from_sync: do a sync update?
+        """
+        async with self.get_async_write_lock():
+            await self.run_blocking(self.load_settings_from_file, password, True, not update_from_sync)
+            if update_from_sync:
+                await self.aupdate_from_sync_unlocked(password)
+
+    def load_settings_from_file(self, password, omit_sync_settings_questions=False, defer_sync_settings=False):
         """
         This loads the saved settings. It is a good idea to call this method the minute you have a password.
+        The search index is not built here but with the first search.
 
         :param str password: masterpassword
         :param bool omit_sync_settings_questions: do not ask for questions? (Defalut: False)
+        :param bool defer_sync_settings: do not decrypt the sync settings now but only when they are needed for
+                                         a sync or for saving the settings file. Use this if you do not sync.
         :type password: str
         """
-        if os.path.isfile(self.settings_file):
-            file = open(self.settings_file, 'br')
-            data = file.read()
-            crypter = Crypter(data[:32], password)
-            sync_settings_len = struct.unpack('!I', data[32:36])[0]
-            if sync_settings_len > 0:
-                self.sync_manager.load_binary_sync_settings(crypter.decrypt(data[36:36+sync_settings_len]))
-            saved_settings = json.loads(str(Packer.decompress(crypter.decrypt(data[36+sync_settings_len:])),
-                                            encoding='utf-8'))
-            for domain_name in saved_settings['settings'].keys():
-                data_set = saved_settings['settings'][domain_name]
-                found = False
-                i = 0
-                while i < len(self.settings):
-                    setting = self.settings[i]
-                    if setting.get_domain() == domain_name:
-                        found = True
-                        if datetime.strptime(data_set['mDate'], "%Y-%m-%dT%H:%M:%S") > setting.get_m_date():
+        with self.updating():
+            if os.path.isfile(self.settings_file):
+                was_empty = len(self.settings) < 1 and len(self.deleted_settings) < 1
+                with open(self.settings_file, 'br') as file:
+                    data = file.read()
+                kdf, salt, crypter, encrypted_sync_settings, encrypted_settings = \
+                    self.open_settings_file(data, password)
+                if self.kdf is None:
+                    self.kdf = kdf
+                if len(encrypted_sync_settings) > 0:
+                    if defer_sync_settings:
+                        self.sync_manager.defer_binary_sync_settings(lambda: crypter.decrypt(encrypted_sync_settings))
+                    else:
+                        binary_sync_settings = crypter.decrypt(encrypted_sync_settings)
+                        if len(binary_sync_settings) > 0:
+                            self.sync_manager.load_binary_sync_settings(binary_sync_settings)
+                saved_settings = json.loads(str(Packer.decompress(crypter.decrypt(encrypted_settings)),
+                                                encoding='utf-8'))
+                synced_domains = set(saved_settings['synced'])
+                for domain_name in saved_settings['settings'].keys():
+                    data_set = saved_settings['settings'][domain_name]
+                    if domain_name in self.settings:
+                        if datetime.strptime(data_set['mDate'], "%Y-%m-%dT%H:%M:%S") > \
+                                self.settings[domain_name].get_m_date():
+                            setting = self.settings[domain_name].copy()
                             setting.load_from_dict(data_set)
-                            setting.set_synced(setting.get_domain() in saved_settings['synced'])
-                    i += 1
-                if not found:
-                    new_setting = PasswordSetting(domain_name)
-                    new_setting.load_from_dict(data_set)
-                    new_setting.set_synced(new_setting.get_domain() in saved_settings['synced'])
-                    self.settings.append(new_setting)
-            file.close()
-        else:
-            if not omit_sync_settings_questions:
-                self.sync_manager.ask_for_sync_settings()
+                            setting.set_synced(setting.get_domain() in synced_domains)
+                            self.replace_setting(setting)
+                    else:
+                        new_setting = PasswordSetting(domain_name)
+                        new_setting.load_from_dict(data_set)
+                        new_setting.set_synced(new_setting.get_domain() in synced_domains)
+                        self.add_setting(new_setting)
+                for domain_name, tombstone in saved_settings.get('deleted', {}).items():
+                    if domain_name not in self.settings:
+                        self.deleted_settings[domain_name] = tombstone
+                self.sync_base.update(saved_settings.get('syncBase', {}))
+                self.file_digest = hashlib.sha256(data).hexdigest()
+                self.file_base = self.get_fingerprints(self.get_export_dict())
+                self.saved_state_hash = self.get_state_hash() if was_empty else None
+                self.outbox.load(salt, crypter.key)
+                self.set_vault_key(salt, crypter)
+                self.apply_outbox()
+            else:
+                if not omit_sync_settings_questions:
+                    self.sync_manager.ask_for_sync_settings()
+
+    @staticmethod
+    def open_settings_file(data, password):
+        """
+        Splits the content of a settings file into its parts and creates the crypter with the key derivation function
+        of its header (see VaultHeader).
+
+        :param bytes data: the content of the settings file
+        :param str password: masterpassword
+        :return: the parameters of the key derivation function, the salt, the crypter, the encrypted sync settings and
+                 the encrypted settings
+        :rtype: (dict, bytes, Crypter, bytes, bytes)
+        """
+        kdf, offset = unpack_header(data)
+        salt = data[offset:offset+32]
+        sync_settings_len = struct.unpack('!I', data[offset+32:offset+36])[0]
+        start = offset + 36 + sync_settings_len
+        return kdf, salt, Crypter(salt, password, kdf=kdf), data[offset+36:start], data[start:]
+
+    def apply_outbox(self):
+        """
+        Applies the pending changes of the outbox which are not in the settings yet. This happens if the program
+        stopped after saving the outbox.
+        """
+        with self.updating():
+            for domain_name, data_set in self.outbox.entries.items():
+                if is_tombstone(data_set):
+                    self.remove_setting(domain_name)
+                    self.deleted_settings[domain_name] = data_set
+                elif domain_name not in self.settings or self.settings[domain_name].to_dict() != data_set:
+                    setting = PasswordSetting(domain_name)
+                    setting.load_from_dict(data_set)
+                    self.add_setting(setting)
 
     def store_settings(self, password):
         """
-        Stores settings locally and remotely.
+        Stores settings locally and remotely. The settings file is saved before the push so no change is lost if
+        the push fails. After a successful push it is saved again to remember the new synchronization state.
+
+        The settings file is only saved if something changed since it was loaded or saved (see is_dirty). Nothing is
+        pushed if the merged settings equal the pulled ones (see is_push_necessary). So storing unchanged settings
+        neither derives a key nor writes the file nor talks to the server.
 
         :param password: masterpassword
         :type password: str
         :return:
         """
-        self.save_settings_to_file(password)
-        self.update_sync_server_if_necessary(password)
+        with self.updating():
+            if self.is_dirty():
+                self.save_settings_to_file(password)
+            if self.update_sync_server_if_necessary(password):
+                self.save_settings_to_file(password)
+
+    async def astore_settings(self, password):
+        """
+        Coroutine version of store_settings.
+
+        :param str password: masterpassword
+        """
+        async with self.get_async_write_lock():
+            if self.is_dirty():
+                await self.run_blocking(self.save_settings_to_file, password)
+            if await self.aupdate_sync_server_if_necessary(password):
+                await self.run_blocking(self.save_settings_to_file, password)
+
+    def flush_outbox(self, password):
+        """
+        Pulls, merges and pushes if there are pending changes in the outbox and saves the settings file.
+
+        :param str password: masterpassword
+        :return: True if all changes reached the sync server
+        :rtype: bool
+        """
+        with self.updating():
+            if not self.sync_manager.has_sync_settings():
+                return False
+            if not self.update_from_sync(password) and self.remote_data is None:
+                return False
+            self.update_sync_server_if_necessary(password)
+            self.save_settings_to_file(password)
+            return len(self.outbox) < 1
 
     # noinspection PyUnresolvedReferences
+    def set_kdf_cost(self, cost):
+        """
+        Changes the cost of the key derivation function of the settings file. The algorithm of the loaded file is
+        kept (Crypter.DEFAULT_KDF if there was no file). The new cost is used from the next save on.
+
+        :param int cost: iterations of PBKDF2 or the parameter n of scrypt
+        :raises ValueError: if the cost is invalid for the algorithm
+        """
+        with self.updating():
+            self.kdf = create_kdf((self.kdf or DEFAULT_KDF)['algorithm'], cost)
+
     def save_settings_to_file(self, password):
         """
         This actually saves the settings to a file on the disk. The file is encrypted so you need to supply the
         password.
 
+        The file is locked while it is saved. If another process saved the file since this manager loaded or saved
+        it its changes are merged first (see merge_settings_file). The new file replaces the old one atomically.
+
+        The key is derived with the function in kdf. It is stored in the header of the file (see VaultHeader).
+        Files of older versions get the header with the first save.
+
         :param password: masterpassword
         :type password: str
         """
-        salt = os.urandom(32)
-        crypter = Crypter(salt, password)
-        file = open(self.settings_file, 'bw')
-        encrypted_sync_settings = crypter.encrypt(self.sync_manager.get_binary_sync_settings())
-        file.write(salt + struct.pack('!I', len(encrypted_sync_settings)) + encrypted_sync_settings +
-                   crypter.encrypt(Packer.compress(json.dumps(self.get_settings_as_dict()))))
-        file.close()
-        try:
-            import win32con
-            import win32api
-            win32api.SetFileAttributes(self.settings_file, win32con.FILE_ATTRIBUTE_HIDDEN)
-        except ImportError:
-            pass
+        with self.updating():
+            salt = os.urandom(32)
+            kdf = self.kdf or DEFAULT_KDF
+            crypter = Crypter(salt, password, kdf=kdf)
+            with self.file_lock:
+                if os.path.isfile(self.settings_file):
+                    with open(self.settings_file, 'br') as file:
+                        data = file.read()
+                    if hashlib.sha256(data).hexdigest() != self.file_digest:
+                        self.merge_settings_file(data, password)
+                encrypted_sync_settings = crypter.encrypt(self.sync_manager.get_binary_sync_settings())
+                saved_settings = self.get_saved_settings_json()
+                state_hash = self.get_state_hash(saved_settings)
+                export_data = self.get_export_dict()
+                self.outbox.refresh(export_data)
+                self.outbox.save(salt, crypter.key)
+                data = pack_header(kdf) + salt + struct.pack('!I', len(encrypted_sync_settings)) + \
+                    encrypted_sync_settings + crypter.encrypt(Packer.compress(saved_settings))
+                write_file_atomically(self.settings_file, data)
+                self.file_digest = hashlib.sha256(data).hexdigest()
+                self.set_vault_key(salt, crypter)
+                self.file_base = self.get_fingerprints(export_data)
+                self.saved_state_hash = state_hash
+            try:
+                import win32con
+                import win32api
+                win32api.SetFileAttributes(self.settings_file, win32con.FILE_ATTRIBUTE_HIDDEN)
+            except ImportError:
+                pass
+
+    def get_saved_settings_json(self):
+        """
+        Returns everything the settings file stores apart from the sync settings as JSON: the settings, the synced
+        domains, the tombstones and the sync base. The settings are spliced together from their cached JSON (see
+        PasswordSetting.to_json) so only changed settings are serialized again.
+
+        :return: JSON object
+        :rtype: str
+        """
+        settings = self.settings.values()
+        saved_settings = json.dumps({
+            'synced': [setting.get_domain() for setting in settings if setting.is_synced()],
+            'deleted': self.deleted_settings,
+            'syncBase': self.sync_base
+        })
+        return '{"settings": ' + join_json_object((setting.get_domain(), setting.to_json()) for setting in settings) + \
+            ', ' + saved_settings[1:]
+
+    def get_state_hash(self, saved_settings=None):
+        """
+        Returns a hash of the state the settings file stores: the saved settings, the key derivation function and the
+        sync settings. Deferred sync settings are not decrypted. They did not change since the file was loaded.
+
+        :param str saved_settings: the result of get_saved_settings_json if you already have it
+        :return: hex encoded hash
+        :rtype: str
+        """
+        if saved_settings is None:
+            saved_settings = self.get_saved_settings_json()
+        state_hash = hashlib.sha256(saved_settings.encode('utf-8'))
+        state_hash.update(json.dumps(self.kdf or DEFAULT_KDF, sort_keys=True).encode('utf-8'))
+        if self.sync_manager.has_deferred_sync_settings():
+            state_hash.update(b'deferred')
+        else:
+            state_hash.update(self.sync_manager.get_binary_sync_settings())
+        return state_hash.hexdigest()
+
+    def is_dirty(self):
+        """
+        Returns True if the state differs from the one of the last load or save of the settings file or if the file
+        was not loaded or saved yet.
+
+        :rtype: bool
+        """
+        return self.saved_state_hash is None or self.get_state_hash() != self.saved_state_hash
+
+    def merge_settings_file(self, data, password):
+        """
+        Merges the settings another process saved to the settings file since this manager loaded or saved it. This
+        is a three-way merge like the merge with the sync server (see SyncMerge.merge_settings): the base is the
+        content of the file at the last load or save. Settings taken from the file keep their synced flag and their
+        sync base. Local tombstones are kept even if the file does not know the domain because the sync server may
+        still have the setting. Pending outbox changes of the other process are added to the outbox.
+
+        :param bytes data: the content of the settings file
+        :param str password: masterpassword
+        """
+        with self.updating():
+            kdf, salt, crypter, encrypted_sync_settings, encrypted_settings = self.open_settings_file(data, password)
+            saved_settings = json.loads(str(Packer.decompress(crypter.decrypt(encrypted_settings)), encoding='utf-8'))
+            file_data = {domain_name: self.normalize_data_set(domain_name, data_set)
+                         for domain_name, data_set in saved_settings['settings'].items()}
+            for domain_name, tombstone in saved_settings.get('deleted', {}).items():
+                if domain_name not in file_data:
+                    file_data[domain_name] = self.normalize_data_set(domain_name, tombstone)
+            local_data = self.get_export_dict()
+            merged_data = merge_settings(local_data, file_data, self.file_base, self.get_fingerprints(local_data))
+            for domain_name, data_set in local_data.items():
+                if is_tombstone(data_set) and domain_name not in file_data:
+                    merged_data[domain_name] = data_set
+            synced_domains = set(saved_settings['synced'])
+            file_sync_base = saved_settings.get('syncBase', {})
+            for domain_name in [domain_name for domain_name in self.deleted_settings if domain_name not in merged_data]:
+                self.deleted_settings.pop(domain_name)
+            for domain_name in [domain_name for domain_name in self.settings if domain_name not in merged_data]:
+                self.remove_setting(domain_name)
+            for domain_name, data_set in merged_data.items():
+                if local_data.get(domain_name) == data_set:
+                    continue
+                if is_tombstone(data_set):
+                    self.remove_setting(domain_name)
+                    self.deleted_settings[domain_name] = data_set
+                else:
+                    new_setting = PasswordSetting(domain_name)
+                    new_setting.load_from_dict(data_set)
+                    new_setting.set_synced(domain_name in synced_domains and file_data.get(domain_name) == data_set)
+                    self.add_setting(new_setting)
+                if domain_name in file_sync_base:
+                    self.sync_base[domain_name] = file_sync_base[domain_name]
+                else:
+                    self.sync_base.pop(domain_name, None)
+            other_outbox = SyncOutbox(self.outbox.outbox_file)
+            other_outbox.load(salt, crypter.key)
+            for domain_name, data_set in other_outbox.entries.items():
+                if domain_name not in self.outbox.get_pending_domains():
+                    self.outbox.record(domain_name, data_set)
 
     def update_sync_server_if_necessary(self, password):
         """
-        Checks if the sync server needs to be updated. If necessary it does a push.
+        Checks if the sync server needs to be updated. If necessary it does a push. Nothing is pushed if the settings
+        were not pulled before because the push would overwrite the settings of other clients or if the merged
+        settings do not differ from the pulled ones. Tombstones which are not needed anymore are dropped from the
+        pushed data.
+
+        The push is only accepted if the data on the server did not change since the pull. If another client pushed
+        in the meantime the data is pulled and merged again and the push is repeated up to PUSH_ATTEMPTS times.
 
         :param password: masterpassword
         :type password: str
+        :return: True if data was pushed
+        :rtype: bool
+        """
+        with self.updating():
+            if self.remote_data is None:
+                return False
+            for attempt in range(PUSH_ATTEMPTS):
+                if attempt > 0 and not self.update_from_sync(password):
+                    return False
+                pushed = self.push_if_necessary(password)
+                if pushed is not None:
+                    return pushed
+            print("Die Daten auf dem Sync-Server wurden gleichzeitig von einem anderen Gerät geändert. " +
+                  "Bitte synchronisieren Sie später erneut.")
+            return False
+
+    async def aupdate_sync_server_if_necessary(self, password):
+        """
+        Coroutine version of update_sync_server_if_necessary. Call it only while holding get_async_write_lock.
+
+        :param str password: masterpassword
+        :return: True if data was pushed
+        :rtype: bool
+        """
+        if self.remote_data is None:
+            return False
+        for attempt in range(PUSH_ATTEMPTS):
+            if attempt > 0 and not await self.aupdate_from_sync_unlocked(password):
+                return False
+            pushed = await self.apush_if_necessary(password)
+            if pushed is not None:
+                return pushed
+        print("Die Daten auf dem Sync-Server wurden gleichzeitig von einem anderen Gerät geändert. " +
+              "Bitte synchronisieren Sie später erneut.")
+        return False
+
+    def push_if_necessary(self, password):
+        """
+        Pushes the merged data if it differs from the pulled data. The push names the hash of the pulled blob.
+
+        :param password: masterpassword
+        :type password: str
+        :return: True if data was pushed, False if nothing was pushed and None if the server rejected the push
+                 because another client pushed since the pull
+        :rtype: bool
+        """
+        with self.updating():
+            push = self.prepare_push(password)
+            if push is None:
+                return False
+            if self.sync_manager.push(push['export_data'], push['expected_hash']):
+                self.finish_push(push)
+                return True
+            if self.sync_manager.push_conflict:
+                return None
+            return False
+
+    async def apush_if_necessary(self, password):
+        """
+        Coroutine version of push_if_necessary.
+
+        :param str password: masterpassword
+        :return: True if data was pushed, False if nothing was pushed and None if the server rejected the push
+        :rtype: bool
+        """
+        push = await self.run_blocking(self.prepare_push, password)
+        if push is None:
+            return False
+        if await self.sync_manager.apush(push['export_data'], push['expected_hash']):
+            await self.run_blocking(self.finish_push, push)
+            return True
+        if self.sync_manager.push_conflict:
+            return None
+        return False
+
+    def prepare_push(self, password):
+        """
+        Builds and encrypts the data for a push. If no push is necessary the pending changes which the server already
+        has are acknowledged.
+
+        :param str password: masterpassword
+        :return: the push (see finish_push) or None if no push is necessary
+        :rtype: dict
+        """
+        with self.updating():
+            push_data, collected = self.get_push_data()
+            if not self.is_push_necessary(push_data):
+                self.update_remote = False
+                self.outbox.acknowledge(self.remote_data)
+                return None
+            bytes_saved = 0
+            if len(collected) > 0:
+                with_tombstones = dict(push_data)
+                with_tombstones.update(collected)
+                bytes_saved = max(0, len(Packer.compress(self.get_export_json(with_tombstones))) -
+                                  len(Packer.compress(self.get_export_json(push_data))))
+            return {
+                'push_data': push_data,
+                'collected': collected,
+                'bytes_saved': bytes_saved,
+                'export_data': self.get_export_data(password, export_data=push_data),
+                'expected_hash': self.remote_hash
+            }
+
+    def finish_push(self, push):
+        """
+        Records that the server accepted a push: the pushed data is the new base for the next merge. Settings which
+        were changed by another thread since prepare_push are not marked as synced.
+
+        :param dict push: the result of prepare_push
+        """
+        push_data = push['push_data']
+        collected = push['collected']
+        with self.updating():
+            self.remote_hash = get_blob_hash(push['export_data'])
+            self.replicas_differ = False
+            for domain_name in collected.keys():
+                self.deleted_settings.pop(domain_name, None)
+            self.tombstone_report = {
+                'collected': len(collected),
+                'bytes_saved': push['bytes_saved']
+            }
+            self.remote_data = push_data
+            for domain_name, data_set in self.remote_data.items():
+                if domain_name in self.deleted_settings:
+                    self.deleted_settings[domain_name] = data_set
+            self.sync_base = {domain_name: get_fingerprint(data_set)
+                              for domain_name, data_set in self.remote_data.items()}
+            local_data = self.get_export_dict()
+            for domain_name in self.get_domain_list():
+                self.set_synced_if_equal(domain_name, local_data[domain_name], self.remote_data.get(domain_name))
+            self.update_remote = differs(local_data, self.remote_data)
+            self.outbox.acknowledge(self.remote_data)
+
+    def get_push_data(self):
+        """
+        Builds the data for the next push: the settings and the tombstones which are still needed.
+
+        :return: the data for the push and the collected tombstones
+        :rtype: (dict, dict)
         """
-        if self.update_remote:
-            if self.sync_manager.push(self.get_export_data(password)):
-                self.set_all_settings_to_synced()
+        return collect_tombstones(self.get_export_dict(), self.tombstone_horizon)
+
+    def is_push_necessary(self, push_data):
+        """
+        Returns True if the push data differs from the pulled data or if the blobs of the sync server and its backup
+        servers differ.
+
+        :param dict push_data: the result of get_push_data
+        :rtype: bool
+        """
+        return self.replicas_differ or differs(push_data, self.remote_data)
 
     def get_setting(self, domain):
         """
         This function always returns a setting. If no setting was stored for the given domain a new PasswordSetting
-        object is created.
+        object is created and stored.
+
+        The returned setting is a copy. Changes are stored with set_setting.
 
         :param domain: The "domain" is the identifier of a settings object.
         :type domain: str
         :return: a setting object
         :rtype: PasswordSetting
         """
-        for setting in self.settings:
-            if setting.get_domain() == domain:
-                return setting
-        setting = PasswordSetting(domain)
-        self.settings.append(setting)
-        return setting
+        setting = self.get_current().get(domain)
+        if setting is None:
+            with self.updating():
+                setting = self.settings.get(domain)
+                if setting is None:
+                    setting = PasswordSetting(domain)
+                    self.add_setting(setting)
+        return setting.copy()
+
+    def find_settings_by_url(self, url):
+        """
+        Finds the settings which belong to an url. The host of the url is looked up in the url index. If there is no
+        setting for the host the parent domains are tried up to the registrable domain. Settings with a matching
+        domain or url are returned in the order they were added.
+
+        :param str url: an url or a domain
+        :return: copies of the matching settings. The list is empty if nothing was found.
+        :rtype: [PasswordSetting]
+        """
+        return [setting.copy() for setting in self.get_current().find_settings_by_url(url)]
+
+    def search(self, query, limit=10, min_similarity=0.5):
+        """
+        Searches the domain, username, url and notes of all settings. Settings which contain the query are found
+        first. Settings which contain a large part of it are found too so typos are tolerated. The search index is
+        built with the first search so looking up a single setting does not pay for it. It is kept up to date when a
+        snapshot is published.
+
+        :param str query: the search string
+        :param int limit: maximum number of results
+        :param float min_similarity: lower values tolerate more typos (see SearchIndex.search)
+        :return: copies of the matching settings with the best match first
+        :rtype: [PasswordSetting]
+        """
+        with self.search_lock:
+            snapshot = self.snapshot
+            if self.search_index is None:
+                self.build_search_index()
+            matches = self.search_index.find_matches(query, limit, min_similarity)
+        return [snapshot.settings[domain].copy() for score, domain in SearchIndex.rank(matches, limit)]
+
+    def build_search_index(self):
+        """
+        Builds the search index from the published snapshot. Changes of drafts which are not published yet are added
+        when they are published.
+        """
+        with self.search_lock:
+            search_index = SearchIndex()
+            for setting in self.snapshot.settings.values():
+                search_index.add(setting)
+            self.search_index = search_index
+
+    def index_setting(self, setting):
+        """
+        Updates the url index for the given setting. The index maps the full and the registrable domain of the
+        setting's domain and url to the setting. The search index is updated when the draft is published.
+
+        :param PasswordSetting setting: the setting
+        """
+        with self.updating():
+            self.get_draft().index_setting(setting)
+
+    def unindex_domain(self, domain):
+        """
+        Removes a setting from the url index. The search index is updated when the draft is published.
+
+        :param str domain: the domain of the setting
+        """
+        with self.updating():
+            self.get_draft().unindex_domain(domain)
+
+    def add_setting(self, setting):
+        """
+        Puts the setting at the end of the internal list and updates the indexes. An existing setting for the same
+        domain is replaced. The manager keeps the object so it must not be changed afterwards. Use set_setting for
+        settings which are changed later.
+
+        :param PasswordSetting setting: the setting
+        """
+        with self.updating():
+            self.deleted_settings.pop(setting.get_domain(), None)
+            self.get_draft().put(setting)
+
+    def replace_setting(self, setting):
+        """
+        Replaces the stored setting for the same domain without changing its position and updates the indexes. The
+        manager keeps the object so it must not be changed afterwards.
+
+        :param PasswordSetting setting: the setting
+        """
+        with self.updating():
+            self.get_draft().put(setting, keep_position=True)
+
+    def remove_setting(self, domain):
+        """
+        Removes the setting for the domain from the internal list and the indexes.
+
+        :param str domain: the domain of the setting
+        """
+        with self.updating():
+            self.get_draft().remove(domain)
 
     def set_setting(self, setting):
         """
         This saves the supplied setting only in memory. Call save_settings_to_file if you want to have it saved to
-        disk.
+        disk. Nothing happens if the setting equals the stored one (see PasswordSetting.get_state_hash).
 
-        :param PasswordSetting setting: the setting which should be saved
+        :param PasswordSetting setting: the setting which should be saved. The manager stores a copy.
         """
-        for i, existing_setting in enumerate(self.settings):
-            if existing_setting.get_domain() == setting.get_domain():
-                self.settings.pop(i)
-        self.settings.append(setting)
-        self.update_remote = True
+        with self.updating():
+            stored_setting = self.settings.get(setting.get_domain())
+            if stored_setting is not None and stored_setting.get_state_hash() == setting.get_state_hash():
+                return
+            setting = setting.copy()
+            self.add_setting(setting)
+            self.outbox.record(setting.get_domain(), setting.to_dict())
+            self.update_remote = True
 
     def delete_setting(self, setting):
         """
-        This removes the setting from the internal list. Call save_settings_to_file if you want to have the change
-        saved to disk.
+        This removes the setting from the internal list. A tombstone is kept so the deletion is synchronized to other
+        clients. Call save_settings_to_file if you want to have the change saved to disk.
 
         :param setting: PasswordSetting object
         :type setting: PasswordSetting
         """
-        i = 0
-        while i < len(self.settings):
-            existing_setting = self.settings[i]
-            if existing_setting.get_domain() == setting.get_domain():
-                self.settings.pop(i)
-            else:
-                i += 1
+        with self.updating():
+            self.remove_setting(setting.get_domain())
+            self.deleted_settings[setting.get_domain()] = create_tombstone()
+            self.outbox.record(setting.get_domain(), self.deleted_settings[setting.get_domain()])
+            self.update_remote = True
 
     def get_domain_list(self):
         """
@@ -182,7 +853,7 @@ class PasswordSettingsManager:
         :return: a list of domain names
         :rtype: [str]
         """
-        return [setting.get_domain() for setting in self.settings]
+        return self.get_current().get_domain_list()
 
     def get_settings_as_dict(self):
         """
@@ -193,107 +864,518 @@ class PasswordSettingsManager:
         :rtype: dict
         """
         settings_list = {'settings': {}, 'synced': []}
-        for setting in self.settings:
+        for setting in self.settings.values():
             settings_list['settings'][setting.get_domain()] = setting.to_dict()
             if setting.is_synced():
                 settings_list['synced'].append(setting.get_domain())
         return settings_list
 
-    def get_export_data(self, password, salt=None):
+    def get_export_dict(self):
+        """
+        Returns the data for the sync server: the dicts of all settings and the tombstones of deleted settings.
+
+        :return: domain -> setting dict or tombstone
+        :rtype: dict
+        """
+        export_data = {}
+        for domain_name, tombstone in self.deleted_settings.items():
+            export_data[domain_name] = tombstone
+        for setting in self.settings.values():
+            export_data[setting.get_domain()] = setting.to_dict()
+        return export_data
+
+    def get_export_json(self, export_data):
+        """
+        Serializes export data with json.dumps. Data sets which equal the stored setting use its cached JSON (see
+        PasswordSetting.to_json).
+
+        :param dict export_data: the result of get_export_dict or get_push_data
+        :return: JSON object
+        :rtype: str
+        """
+        fragments = []
+        for domain_name, data_set in export_data.items():
+            setting = self.settings.get(domain_name)
+            if setting is not None and setting.to_dict() == data_set:
+                fragments.append((domain_name, setting.to_json()))
+            else:
+                fragments.append((domain_name, json.dumps(data_set)))
+        return join_json_object(fragments)
+
+    def get_fingerprints(self, export_data):
+        """
+        Returns the fingerprints of export data. Data sets which equal the stored setting use its cached fingerprint
+        (see PasswordSetting.get_fingerprint).
+
+        :param dict export_data: the result of get_export_dict
+        :return: domain -> fingerprint
+        :rtype: dict
+        """
+        fingerprints = {}
+        for domain_name, data_set in export_data.items():
+            setting = self.settings.get(domain_name)
+            if setting is not None and setting.to_dict() == data_set:
+                fingerprints[domain_name] = setting.get_fingerprint()
+            else:
+                fingerprints[domain_name] = get_fingerprint(data_set)
+        return fingerprints
+
+    def get_export_data(self, password, salt=None, export_data=None):
         """
-        This gives you a base64 encoded string of encrypted settings data (the blob).
+        This gives you the encrypted settings data (the blob) as raw bytes.
 
         :param password: masterpassword
         :type password: str
         :param salt: salt for the encryption: This is for testing only! Do not set it normally!
         :type salt: bytes
+        :param export_data: the result of get_export_dict if you already have it
+        :type export_data: dict
         :return: encrypted settings blob
-        :rtype: str
+        :rtype: bytes
         """
-        settings_list = self.get_settings_as_dict()['settings']
-        if self.remote_data:
-            for domain_name in self.remote_data.keys():
-                data_set = self.remote_data[domain_name]
-                if 'deleted' in data_set and data_set['deleted']:
-                    for i, setting_dict in enumerate(settings_list):
-                        if setting_dict['domain'] == setting_dict['domain'] and datetime.strptime(
-                                data_set['mDate'], "%Y-%m-%dT%H:%M:%S") > datetime.strptime(
-                                setting_dict['mDate'], "%Y-%m-%dT%H:%M:%S"):
-                            settings_list[i] = data_set
-                if domain_name not in settings_list.keys():
-                    settings_list[domain_name] = {
-                        'mDate': datetime.now(),
-                        'deleted': True
-                    }
+        if export_data is None:
+            export_data = self.get_export_dict()
         if not salt:
             salt = os.urandom(32)
-        crypter = Crypter(salt, password)
-        return b64encode(b'\x00' + salt + crypter.encrypt(Packer.compress(json.dumps(settings_list))))
+        crypter = Crypter(salt, password, SYNC)
+        return b'\x00' + salt + crypter.encrypt(Packer.compress(self.get_export_json(export_data)))
 
     def update_from_sync(self, password):
         """
-        Call this method to pull settings from the sync server.
+        Call this method to pull settings from the sync server. The pulled settings are merged with the local
+        settings using the fingerprints of the last synchronized state (see SyncMerge.merge_settings). Afterwards
+        update_remote tells if the merged settings differ from the ones on the server.
 
         :param password: the masterpassword
         :type password: str
+        :return: True if the pull was successful
+        :rtype: bool
+        """
+        with self.updating():
+            pull_successful, data = self.sync_manager.pull()
+            return self.apply_pull(password, pull_successful, data)
+
+    async def aupdate_from_sync(self, password):
+        """
+        Coroutine version of update_from_sync.
+
+        :param str password: the masterpassword
+        :return: True if the pull was successful
+        :rtype: bool
+        """
+        async with self.get_async_write_lock():
+            return await self.aupdate_from_sync_unlocked(password)
+
+    async def aupdate_from_sync_unlocked(self, password):
+        """
+        aupdate_from_sync for callers which already hold get_async_write_lock.
+
+        :param str password: the masterpassword
+        :return: True if the pull was successful
+        :rtype: bool
+        """
+        pull_successful, data = await self.sync_manager.apull()
+        return await self.run_blocking(self.apply_pull, password, pull_successful, data)
+
+    def apply_pull(self, password, pull_successful, data):
+        """
+        Merges the result of a pull into the settings (see update_from_sync).
+
+        :param str password: the masterpassword
+        :param bool pull_successful: was the pull successful?
+        :param bytes data: the pulled blob
+        :return: True if the pull was successful
+        :rtype: bool
+        """
+        with self.updating():
+            if not pull_successful:
+                print("Sync failed: No connection to the server.")
+                return False
+            self.remote_hash = get_blob_hash(data)
+            remote_data = self.decrypt_sync_data(data, password)
+            if remote_data is None:
+                self.remote_hash = None
+                print("Unknown data format version! Could not update.")
+                return False
+            self.replicas_differ = False
+            for replica_data in self.sync_manager.get_replica_data():
+                replica = self.decrypt_sync_data(replica_data, password)
+                if replica is not None:
+                    remote_data = merge_replicas(remote_data, replica, self.sync_base)
+                    self.replicas_differ = True
+            if not len(data) > 0 and not self.replicas_differ:
+                self.remote_data = {}
+                self.sync_base = {}
+                self.update_remote = True
+                return True
+            self.remote_data = remote_data
+            self.merge(self.remote_data)
+            return True
+
+    def decrypt_sync_data(self, data, password):
+        """
+        Decrypts a blob of the sync server.
+
+        :param bytes data: the blob
+        :param str password: the masterpassword
+        :return: domain -> normalized data set or None if the format is unknown
+        :rtype: dict
         """
-        pull_successful, data = self.sync_manager.pull()
-        if not pull_successful:
-            print("Sync failed: No connection to the server.")
-            return False
         if not len(data) > 0:
-            return False
-        binary_data = b64decode(data)
-        data_version = binary_data[:1]
-        if data_version == b'\x00':
-            encryption_salt = binary_data[1:33]
-            encrypted_data = binary_data[33:]
-            crypter = Crypter(encryption_salt, password)
-            self.remote_data = json.loads(
-                str(Packer.decompress(crypter.decrypt(encrypted_data)), encoding='utf-8'))
-            self.update_remote = False
-            for domain_name in self.remote_data.keys():
-                data_set = self.remote_data[domain_name]
-                found = False
-                i = 0
-                while i < len(self.settings):
-                    setting = self.settings[i]
-                    if setting.get_domain() == domain_name:
-                        found = True
-                        if datetime.strptime(data_set['mDate'], "%Y-%m-%dT%H:%M:%S") > setting.get_m_date():
-                            if 'deleted' in data_set and data_set['deleted']:
-                                self.settings.pop(i)
-                            else:
-                                setting.load_from_dict(data_set)
-                                setting.set_synced(True)
-                                self.update_remote = True
-                                i += 1
-                        else:
-                            i += 1
-                    else:
-                        i += 1
-                if not found:
+            return {}
+        if data[:1] != b'\x00':
+            return None
+        crypter = Crypter(data[1:33], password, SYNC)
+        remote_data = json.loads(str(Packer.decompress(crypter.decrypt(data[33:])), encoding='utf-8'))
+        return {domain_name: self.normalize_data_set(domain_name, data_set)
+                for domain_name, data_set in remote_data.items()}
+
+    @staticmethod
+    def normalize_data_set(domain_name, data_set):
+        """
+        Converts a data set from the sync server to the form PasswordSetting.to_dict produces so it can be compared
+        with local settings. Other clients may omit fields with default values.
+
+        :param str domain_name: the domain
+        :param dict data_set: setting dict or tombstone
+        :return: the normalized data set
+        :rtype: dict
+        """
+        if is_tombstone(data_set):
+            return create_tombstone(data_set.get('mDate'))
+        setting = PasswordSetting(domain_name)
+        setting.load_from_dict(data_set)
+        return setting.to_dict()
+
+    def merge(self, remote_data):
+        """
+        Merges the data of the sync server into the local settings in one pass. Settings which are equal to the
+        remote version are marked as synced and become the new base for the next merge.
+
+        :param dict remote_data: domain -> normalized setting dict or tombstone from the sync server
+        """
+        with self.updating():
+            local_data = self.get_export_dict()
+            self.outbox.refresh(local_data)
+            merged_data = merge_settings(local_data, remote_data, self.get_base_fingerprints(remote_data),
+                                         self.get_fingerprints(local_data))
+            for domain_name in [domain_name for domain_name in self.deleted_settings if domain_name not in merged_data]:
+                self.deleted_settings.pop(domain_name)
+            for domain_name in [domain_name for domain_name in self.settings if domain_name not in merged_data]:
+                self.remove_setting(domain_name)
+            for domain_name, data_set in merged_data.items():
+                remote_data_set = remote_data.get(domain_name)
+                if is_tombstone(data_set):
+                    if domain_name in self.settings:
+                        self.remove_setting(domain_name)
+                    self.deleted_settings[domain_name] = data_set
+                elif local_data.get(domain_name) != data_set:
                     new_setting = PasswordSetting(domain_name)
                     new_setting.load_from_dict(data_set)
-                    new_setting.set_synced(True)
-                    self.settings.append(new_setting)
-            for setting in self.settings:
-                found = False
-                for domain_name in self.remote_data.keys():
-                    data_set = self.remote_data[domain_name]
-                    if setting.get_domain() == domain_name:
-                        found = True
-                        if setting.get_m_date() >= datetime.strptime(data_set['mDate'], "%Y-%m-%dT%H:%M:%S"):
-                            self.update_remote = True
-                if not found:
-                    self.update_remote = True
-        else:
-            print("Unknown data format version! Could not update.")
+                    self.add_setting(new_setting)
+                self.set_synced_if_equal(domain_name, data_set, remote_data_set)
+            sync_base = {}
+            for domain_name, data_set in merged_data.items():
+                if remote_data.get(domain_name) == data_set:
+                    sync_base[domain_name] = get_fingerprint(data_set)
+                elif domain_name in self.sync_base:
+                    sync_base[domain_name] = self.sync_base[domain_name]
+            self.sync_base = sync_base
+            self.outbox.acknowledge(remote_data)
+            self.update_remote = self.is_push_necessary(self.get_push_data()[0])
+
+    def get_base_fingerprints(self, remote_data):
+        """
+        Returns the fingerprints of the last synchronized state. Settings files of older versions do not contain
+        them. For these the local version of settings which are marked as synced and exist on the server is used as
+        base unless the domain has pending changes in the outbox.
+
+        :param dict remote_data: the normalized data from the server
+        :return: domain -> fingerprint
+        :rtype: dict
+        """
+        base = dict(self.sync_base)
+        pending_domains = self.outbox.get_pending_domains()
+        for setting in self.settings.values():
+            if setting.get_domain() not in base and setting.get_domain() not in pending_domains and \
+                    setting.get_domain() in remote_data and setting.is_synced():
+                base[setting.get_domain()] = setting.get_fingerprint()
+        return base
+
+    def set_synced_if_equal(self, domain_name, data_set, remote_data_set):
+        """
+        Marks the setting as synced if its merged version equals the version on the server.
+
+        :param str domain_name: the domain
+        :param dict data_set: the merged version
+        :param dict remote_data_set: the version on the server or None
+        """
+        self.set_synced(domain_name, data_set == remote_data_set)
+
+    def set_synced(self, domain_name, is_synced=True):
+        """
+        Sets the synced flag of the setting for the domain if it exists. The setting is replaced by a copy with the
+        new flag if the flag changes (see replace_setting).
+
+        :param str domain_name: the domain
+        :param bool is_synced: the new flag
+        """
+        setting = self.settings.get(domain_name)
+        if setting is not None and setting.is_synced() != is_synced:
+            with self.updating():
+                setting = setting.copy()
+                setting.set_synced(is_synced)
+                self.replace_setting(setting)
 
     def set_all_settings_to_synced(self):
         """
         Convenience function for marking all saved settings as synced. Call this after a successful update at the
         sync server.
         """
-        for setting in self.settings:
-            setting.set_synced(True)
+        with self.updating():
+            for domain_name in self.get_domain_list():
+                self.set_synced(domain_name)
+
+    def import_settings(self, password, filename, file_format=None, conflict_policy=CONFLICT_KEEP_NEWER):
+        """
+        Imports settings from a CSV or JSON Lines file. The file is read and validated record by record in a single
+        pass. Settings for domains which already exist are handled according to the conflict policy:
+        CONFLICT_KEEP_NEWER keeps the setting with the newer modification date and treats imported records without
+        one as older, CONFLICT_OVERWRITE always takes the imported setting and CONFLICT_SKIP always keeps the existing
+        one. If anything was imported the settings are pushed if they were pulled before (see
+        update_sync_server_if_necessary) and the settings file is saved once afterwards. If the push fails the
+        imported settings stay in the outbox of the saved file.
+
+        :param str password: masterpassword
+        :param str filename: name of the file to import
+        :param str file_format: settingsTransfer.FORMAT_CSV or settingsTransfer.FORMAT_JSON_LINES. If not set the
+                                format is guessed from the file extension.
+        :param str conflict_policy: CONFLICT_KEEP_NEWER, CONFLICT_OVERWRITE or CONFLICT_SKIP
+        :return: a report with the number of imported, skipped and invalid records and the first error messages
+        :rtype: dict
+        """
+        with self.updating():
+            from settingsTransfer import read_settings, guess_format
+            if conflict_policy not in [CONFLICT_KEEP_NEWER, CONFLICT_OVERWRITE, CONFLICT_SKIP]:
+                raise ValueError("Unknown conflict policy: " + str(conflict_policy))
+            if not file_format:
+                file_format = guess_format(filename)
+            report = {'imported': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+            with open(filename, 'r', encoding='utf-8', errors='surrogateescape', newline='') as file:
+                for line_number, data_set, error in read_settings(file, file_format):
+                    if error:
+                        report['invalid'] += 1
+                        if len(report['errors']) < MAX_REPORTED_IMPORT_ERRORS:
+                            report['errors'].append((line_number, error))
+                        continue
+                    domain_name = data_set['domain']
+                    if domain_name in self.settings:
+                        if conflict_policy == CONFLICT_SKIP or (
+                                conflict_policy == CONFLICT_KEEP_NEWER and (
+                                    'mDate' not in data_set or
+                                    datetime.strptime(data_set['mDate'], "%Y-%m-%dT%H:%M:%S") <=
+                                    self.settings[domain_name].get_m_date())):
+                            report['skipped'] += 1
+                            continue
+                    new_setting = PasswordSetting(domain_name)
+                    new_setting.load_from_dict(data_set)
+                    self.set_setting(new_setting)
+                    report['imported'] += 1
+            if report['imported'] > 0:
+                self.update_sync_server_if_necessary(password)
+                self.save_settings_to_file(password)
+            return report
+
+    def export_settings(self, filename, file_format=None):
+        """
+        Exports all settings to a CSV or JSON Lines file. The settings are written one at a time. Be aware that the
+        exported file is not encrypted and contains legacy passwords.
+
+        :param str filename: name of the file to write
+        :param str file_format: settingsTransfer.FORMAT_CSV or settingsTransfer.FORMAT_JSON_LINES. If not set the
+                                format is guessed from the file extension.
+        :return: number of exported settings
+        :rtype: int
+        """
+        from settingsTransfer import write_settings, guess_format
+        if not file_format:
+            file_format = guess_format(filename)
+        with open(filename, 'w', encoding='utf-8', newline='') as file:
+            return write_settings(file, self.get_snapshot().settings.values(), file_format)
+
+    def enable_password_cache(self, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE,
+                              min_iterations=DEFAULT_MIN_ITERATIONS):
+        """
+        Caches generated passwords of settings with high iteration counts in an encrypted file next to the settings
+        file. See PasswordCache for details.
+
+        :param int max_entries: maximum number of cached passwords
+        :param int max_age: maximum age of a cached password in seconds
+        :param int min_iterations: only settings with at least this iteration count are cached
+        """
+        self.password_cache = PasswordCache(self.settings_file + '.cache', max_entries, max_age, min_iterations)
+        if self.vault_key is not None:
+            self.password_cache.set_vault_key(*self.vault_key)
+
+    def set_vault_key(self, salt, crypter):
+        """
+        Remembers the salt and the key of the settings file after it was loaded or saved. The password cache is
+        encrypted with a key derived from it so it does not need a key derivation of its own.
+
+        :param bytes salt: salt of the settings file
+        :param Crypter crypter: crypter of the settings file
+        """
+        self.vault_key = (salt, crypter.key)
+        if self.password_cache is not None:
+            self.password_cache.set_vault_key(salt, crypter.key)
+            self.password_cache.save()
+
+    def generate_password(self, master_password, setting, save_cache=True, priority=INTERACTIVE):
+        """
+        Calculates the password for a setting. Settings with a legacy password return it instead. If the password
+        cache is enabled cached passwords are used and new ones are stored.
+
+        :param str master_password: masterpassword
+        :param PasswordSetting setting: the setting
+        :param bool save_cache: write the password cache file after a new password was cached?
+        :param int priority: priority of the key derivation on the KdfExecutor
+        :return: the password
+        :rtype: str
+        """
+        if setting.has_legacy_password():
+            return setting.get_legacy_password()
+        use_cache = self.password_cache is not None and self.password_cache.is_cacheable(setting)
+        if use_cache:
+            password = self.password_cache.get(master_password, setting)
+            if password is not None:
+                return password
+        sesam = CtSesam()
+        sesam.set_password_character_set(setting.get_character_set())
+        sesam.set_salt(setting.get_salt())
+        password = sesam.generate(
+            master_password,
+            setting.get_domain(),
+            setting.get_username(),
+            setting.get_length(),
+            setting.get_iterations(),
+            priority)
+        if use_cache:
+            self.password_cache.put(master_password, setting, password)
+            if save_cache:
+                self.password_cache.save()
+        return password
+
+    async def agenerate_password(self, master_password, setting, save_cache=True, priority=INTERACTIVE):
+        """
+        Coroutine version of generate_password. The event loop is not blocked while the password is calculated.
+
+        :param str master_password: masterpassword
+        :param PasswordSetting setting: the setting
+        :param bool save_cache: write the password cache file after a new password was cached?
+        :param int priority: priority of the key derivation on the KdfExecutor
+        :return: the password
+        :rtype: str
+        """
+        if setting.has_legacy_password():
+            return setting.get_legacy_password()
+        if self.password_cache is not None and self.password_cache.is_cacheable(setting):
+            return await self.run_blocking(self.generate_password, master_password, setting, save_cache, priority)
+        sesam = CtSesam()
+        sesam.set_password_character_set(setting.get_character_set())
+        sesam.set_salt(setting.get_salt())
+        return await sesam.agenerate(
+            master_password,
+            setting.get_domain(),
+            setting.get_username(),
+            setting.get_length(),
+            setting.get_iterations(),
+            priority)
+
+    def rotate_policy(self, password, setting_filter=None, iterations=None, length=None, character_classes=None,
+                      new_salt=False, workers=None):
+        """
+        Changes the password policy of many settings at once. Settings with a legacy password are not changed.
+        The old and the new passwords of all affected settings are calculated on a pool of worker threads with batch
+        priority so interactive password requests of the same process are not delayed. After that the settings are
+        replaced, saved to the settings file once and pushed to the sync server once.
+
+        The passwords are calculated from a snapshot without holding the write lock so other threads can change
+        settings in the meantime. The write lock is only taken to replace the settings. Settings which another thread
+        changed since the snapshot are rotated again from their new version. After ROTATION_ATTEMPTS rounds the
+        remaining settings are rotated while holding the write lock.
+
+        Use the returned report to change the passwords on the websites.
+
+        :param str password: masterpassword
+        :param setting_filter: a function which gets a PasswordSetting and returns True if it should be changed.
+                               If not set all settings are changed.
+        :param int iterations: new iteration count or None to keep it
+        :param int length: new password length or None to keep it
+        :param int character_classes: bitmask of PasswordSetting.LOWER_CASE, UPPER_CASE, DIGITS and EXTRA or None to
+                                      keep the character set
+        :param bool new_salt: create a new random salt for every setting?
+        :param int workers: number of worker threads. Defaults to the number of CPUs.
+        :return: a list of dicts with the domain, the old and the new password and the changed fields
+        :rtype: [dict]
+        """
+        def rotate(setting):
+            if setting.has_legacy_password() or (setting_filter and not setting_filter(setting)):
+                return None
+            new_setting = PasswordSetting(setting.get_domain())
+            new_setting.load_from_dict(setting.to_dict())
+            if iterations:
+                new_setting.set_iterations(iterations)
+            if length:
+                new_setting.set_length(length)
+            if character_classes is not None:
+                new_setting.set_character_classes(character_classes)
+            if new_salt:
+                new_setting.set_salt(os.urandom(32))
+            if new_setting.to_dict() == setting.to_dict():
+                return None
+            new_setting.set_modification_date()
+            return new_setting
+
+        def generate(setting):
+            return self.generate_password(password, setting, False, BATCH)
+
+        report = []
+        pending = None
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for attempt in range(ROTATION_ATTEMPTS + 1):
+                with self.updating() if attempt == ROTATION_ATTEMPTS else nullcontext():
+                    snapshot = self.get_current()
+                    old_settings = []
+                    new_settings = []
+                    for domain, setting in snapshot.settings.items():
+                        new_setting = rotate(setting) if pending is None or domain in pending else None
+                        if new_setting is not None:
+                            old_settings.append(setting)
+                            new_settings.append(new_setting)
+                    old_passwords = list(executor.map(generate, old_settings))
+                    new_passwords = list(executor.map(generate, new_settings))
+                    pending = set()
+                    with self.updating():
+                        for old_setting, new_setting, old_password, new_password in zip(
+                                old_settings, new_settings, old_passwords, new_passwords):
+                            if self.settings.get(old_setting.get_domain()) is not old_setting:
+                                pending.add(old_setting.get_domain())
+                                continue
+                            old_dict = old_setting.to_dict()
+                            new_dict = new_setting.to_dict()
+                            report.append({
+                                'domain': new_setting.get_domain(),
+                                'old_password': old_password,
+                                'new_password': new_password,
+                                'changes': sorted([key for key in new_dict.keys() if key != 'mDate' and
+                                                   (key not in old_dict or old_dict[key] != new_dict[key])])
+                            })
+                            self.set_setting(new_setting)
+                if len(pending) < 1:
+                    break
+        if len(report) < 1:
+            return []
+        if self.password_cache is not None:
+            self.password_cache.save()
+        self.store_settings(password)
+        return report
@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Full-text search over password settings with a trigram index.
+"""
+
+import heapq
+import bisect
+
+SEARCH_FIELDS = ['domain', 'username', 'url', 'notes']
+FIELD_WEIGHTS = {'domain': 4, 'username': 3, 'url': 2, 'notes': 1}
+PADDING = '\x00'
+
+
+def get_trigrams(text):
+    """
+    Returns the set of trigrams (all substrings with three characters) of a text.
+
+    :param str text: lower case text
+    :return: trigrams
+    :rtype: set
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def get_field_trigrams(text):
+    """
+    Returns the trigrams of a field. The text is padded so fields with only one or two characters have trigrams too.
+
+    :param str text: lower case text
+    :return: trigrams
+    :rtype: set
+    """
+    if len(text) < 1:
+        return set()
+    return get_trigrams(PADDING + text + PADDING)
+
+
+def get_rank_key(key):
+    """
+    Returns the sort key of a setting among the matches in the same field: shorter domains first, then
+    alphabetically.
+
+    :param str key: the domain of the setting
+    :return: sort key
+    :rtype: (int, str)
+    """
+    return len(key), key
+
+
+class SearchIndex:
+    """
+    An inverted index which maps every trigram to the set of settings containing it in their domain, username, url
+    or notes. Queries are answered by looking only at the settings which share trigrams with the query. Settings
+    containing the query as a substring are ranked first: domain matches before username, url and notes matches.
+    Settings which contain only a part of the trigrams of the query are found too so typos in the query are
+    tolerated.
+
+    The keys are also kept in the order of their rank. Queries with many matches walk this order and stop as soon as
+    enough matches are found so common terms do not have to look at every setting containing them.
+    """
+    def __init__(self):
+        self.documents = {}
+        self.postings = {field: {} for field in SEARCH_FIELDS}
+        self.ranked_keys = None
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, setting):
+        """
+        Adds a setting to the index. An older version of the setting is replaced.
+
+        :param PasswordSetting setting: the setting
+        """
+        key = setting.get_domain()
+        self.remove(key)
+        fields = {
+            'domain': setting.get_domain().lower(),
+            'username': setting.get_username().lower(),
+            'url': setting.get_url().lower(),
+            'notes': setting.get_notes().lower()
+        }
+        self.documents[key] = fields
+        if self.ranked_keys is not None:
+            bisect.insort(self.ranked_keys, get_rank_key(key))
+        for field in SEARCH_FIELDS:
+            postings = self.postings[field]
+            for trigram in get_field_trigrams(fields[field]):
+                if trigram not in postings:
+                    postings[trigram] = set()
+                postings[trigram].add(key)
+
+    def remove(self, key):
+        """
+        Removes a setting from the index.
+
+        :param str key: the domain of the setting
+        """
+        if key not in self.documents:
+            return
+        fields = self.documents.pop(key)
+        if self.ranked_keys is not None:
+            del self.ranked_keys[bisect.bisect_left(self.ranked_keys, get_rank_key(key))]
+        for field in SEARCH_FIELDS:
+            postings = self.postings[field]
+            for trigram in get_field_trigrams(fields[field]):
+                keys = postings[trigram]
+                keys.discard(key)
+                if len(keys) < 1:
+                    postings.pop(trigram)
+
+    def get_ranked_keys(self):
+        """
+        Returns the rank keys of all settings in sorted order. The list is sorted once when it is first needed and
+        kept sorted afterwards so building the index does not pay for it.
+
+        :return: sorted list of (length, domain) tuples
+        :rtype: [(int, str)]
+        """
+        if self.ranked_keys is None:
+            self.ranked_keys = sorted(get_rank_key(key) for key in self.documents)
+        return self.ranked_keys
+
+    def find_substring_matches(self, field, query, count, exclude=frozenset()):
+        """
+        Returns the best ranked settings which contain the query in the given field. The settings are visited in the
+        order of their rank until count matches are found. The walk is given up after as many steps as there are
+        candidates in the rarest posting list of the query. Only then are all these candidates checked.
+
+        :param str field: one of SEARCH_FIELDS
+        :param str query: lower case query
+        :param int count: maximum number of matches
+        :param set exclude: keys which are not returned
+        :return: keys of up to count matches with the best match first
+        :rtype: [str]
+        """
+        documents = self.documents
+        postings = self.postings[field]
+        if len(query) < 3:
+            # Every setting in these postings contains the query because the query is a part of the trigram.
+            key_sets = [keys for trigram, keys in postings.items() if query in trigram]
+            rarest = None
+            budget = sum(len(keys) for keys in key_sets)
+        else:
+            key_sets = []
+            for trigram in get_trigrams(query):
+                if trigram not in postings:
+                    return []
+                key_sets.append(postings[trigram])
+            rarest = min(key_sets, key=len)
+            budget = len(rarest)
+        if budget < 1 or count < 1:
+            return []
+        matches = []
+        for step, (length, key) in enumerate(self.get_ranked_keys()):
+            if step >= budget:
+                break
+            if (rarest is None or key in rarest) and key not in exclude and query in documents[key][field]:
+                matches.append(key)
+                if len(matches) >= count:
+                    return matches
+        else:
+            return matches
+        candidates = rarest if rarest is not None else set().union(*key_sets)
+        return heapq.nsmallest(count, [key for key in candidates
+                                       if key not in exclude and query in documents[key][field]], key=get_rank_key)
+
+    def find_similar(self, field, query_trigrams, min_similarity):
+        """
+        Returns the settings which contain at least the fraction min_similarity of the query trigrams in the given
+        field together with that fraction.
+
+        :param str field: one of SEARCH_FIELDS
+        :param set query_trigrams: trigrams of the query
+        :param float min_similarity: minimal fraction of found trigrams
+        :return: dict mapping keys to the fraction of found trigrams
+        :rtype: dict
+        """
+        postings = self.postings[field]
+        known_trigrams = sorted([trigram for trigram in query_trigrams if trigram in postings],
+                                key=lambda trigram: len(postings[trigram]))
+        required = max(1, -int(-len(query_trigrams) * min_similarity // 1))
+        if len(known_trigrams) < required:
+            return {}
+        # A setting which contains the required number of trigrams has to contain at least one of the
+        # len(known_trigrams) - required + 1 rarest trigrams so only their postings need to be visited.
+        candidates = set()
+        for trigram in known_trigrams[:len(known_trigrams) - required + 1]:
+            candidates.update(postings[trigram])
+        similar = {}
+        for key in candidates:
+            found = sum(1 for trigram in known_trigrams if key in postings[trigram])
+            if found >= required:
+                similar[key] = found / len(query_trigrams)
+        return similar
+
+    def find_matches(self, query, limit=10, min_similarity=0.5):
+        """
+        Collects the matches of a query without ranking them. This is the part of search which reads the index so
+        only this part has to be protected against concurrent changes. The lists and dicts of the result are not
+        shared with the index.
+
+        :param str query: the search string
+        :param int limit: maximum number of results. Only the best substring matches are collected and similar
+                          settings are not looked for if there are enough substring matches.
+        :param float min_similarity: see search
+        :return: (field, keys) tuples of the substring matches in the order of SEARCH_FIELDS and a dict mapping the
+                 keys of the other similar settings to their similarity
+        :rtype: ([(str, [str])], dict)
+        """
+        query = query.lower().strip()
+        if len(query) < 1:
+            return [], {}
+        substring_matches = []
+        found = set()
+        for field in SEARCH_FIELDS:
+            keys = self.find_substring_matches(field, query, limit - len(found), found)
+            found.update(keys)
+            substring_matches.append((field, keys))
+            if len(found) >= limit:
+                return substring_matches, {}
+        query_trigrams = get_trigrams(query)
+        similar = {}
+        if len(query_trigrams) < 1:
+            return substring_matches, similar
+        for field in SEARCH_FIELDS:
+            for key, similarity in self.find_similar(field, query_trigrams, min_similarity).items():
+                if key not in found and similarity > similar.get(key, 0):
+                    similar[key] = similarity
+        return substring_matches, similar
+
+    @staticmethod
+    def rank(matches, limit=10):
+        """
+        Ranks the result of find_matches. Only the best limit matches are sorted.
+
+        :param tuple matches: the result of find_matches
+        :param int limit: maximum number of results
+        :return: list of (score, domain) tuples with the best match first
+        :rtype: [(float, str)]
+        """
+        substring_matches, similar = matches
+        results = []
+        for field, keys in substring_matches:
+            for key in heapq.nsmallest(limit - len(results), keys, key=get_rank_key):
+                results.append((1 + FIELD_WEIGHTS[field], key))
+            if len(results) >= limit:
+                return results
+        for key, similarity in heapq.nsmallest(limit - len(results), similar.items(),
+                                               key=lambda item: (-item[1], len(item[0]), item[0])):
+            results.append((similarity, key))
+        return results
+
+    def search(self, query, limit=10, min_similarity=0.5):
+        """
+        Searches the index. Exact substring matches get a score of 1 plus the weight of the field where the query
+        was found. Other settings are scored with the fraction of the trigrams of the query they contain. Queries
+        with less than three characters only find substring matches.
+
+        :param str query: the search string
+        :param int limit: maximum number of results
+        :param float min_similarity: fraction of the trigrams of the query which have to be found in a field if the
+                                     query is not a substring of it. Lower values tolerate more typos.
+        :return: list of (score, domain) tuples with the best match first
+        :rtype: [(float, str)]
+        """
+        return self.rank(self.find_matches(query, limit, min_similarity), limit)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Immutable views of the settings of a PasswordSettingsManager.
+"""
+
+from domainExtractor import extract_full_domain, extract_top_domain
+
+
+class SettingsSnapshot:
+    """
+    The settings of a PasswordSettingsManager at one point in time together with the url index. A published snapshot
+    is never changed so any number of threads can read it without locks. Writers change a copy (the draft) and
+    publish it as the next version.
+
+    The settings in a snapshot must not be changed either. To change a setting get a copy from
+    PasswordSettingsManager.get_setting, change it and pass it to PasswordSettingsManager.set_setting.
+
+    :param dict settings: domain -> PasswordSetting in the order they were added
+    :param dict url_index: host -> tuple of the domains of the settings for this host
+    :param dict indexed_hosts: domain -> frozenset of the hosts of the setting in the url index
+    :param int version: number of the snapshot. Every published draft has a higher number than its predecessor.
+    """
+    def __init__(self, settings=None, url_index=None, indexed_hosts=None, version=0):
+        self.settings = settings if settings is not None else {}
+        self.url_index = url_index if url_index is not None else {}
+        self.indexed_hosts = indexed_hosts if indexed_hosts is not None else {}
+        self.version = version
+        self.changed_domains = set()
+
+    def __len__(self):
+        return len(self.settings)
+
+    def __contains__(self, domain):
+        return domain in self.settings
+
+    def create_draft(self):
+        """
+        Returns a copy for the next version. Only the dicts are copied. The settings and the tuples of the url index
+        are shared because they are never changed.
+
+        :return: the draft
+        :rtype: SettingsSnapshot
+        """
+        return SettingsSnapshot(dict(self.settings), dict(self.url_index), dict(self.indexed_hosts), self.version + 1)
+
+    def get(self, domain):
+        """
+        :param str domain: the domain
+        :return: the setting or None. Do not change it.
+        :rtype: PasswordSetting
+        """
+        return self.settings.get(domain)
+
+    def get_domain_list(self):
+        """
+        :return: the domains of all settings in the order they were added
+        :rtype: [str]
+        """
+        return list(self.settings.keys())
+
+    def find_settings_by_url(self, url):
+        """
+        Finds the settings which belong to an url (see PasswordSettingsManager.find_settings_by_url).
+
+        :param str url: an url or a domain
+        :return: the matching settings. Do not change them.
+        :rtype: [PasswordSetting]
+        """
+        host = extract_full_domain(url).lower()
+        top_domain = extract_top_domain(url).lower()
+        while True:
+            if host in self.url_index:
+                return [self.settings[domain] for domain in self.url_index[host]]
+            if host == top_domain or '.' not in host:
+                return []
+            host = host.split('.', 1)[1]
+
+    def put(self, setting, keep_position=False):
+        """
+        Stores the setting in the draft and updates the url index. Call this only on drafts.
+
+        :param PasswordSetting setting: the setting
+        :param bool keep_position: keep the position of an existing setting for the same domain instead of moving
+                                   it to the end. Its position in the url index is kept too if its hosts did not
+                                   change.
+        """
+        domain = setting.get_domain()
+        if not keep_position:
+            self.settings.pop(domain, None)
+        self.settings[domain] = setting
+        if keep_position and self.indexed_hosts.get(domain) == self.get_hosts(setting):
+            self.changed_domains.add(domain)
+        else:
+            self.index_setting(setting)
+
+    def remove(self, domain):
+        """
+        Removes the setting for the domain from the draft and from the url index. Call this only on drafts.
+
+        :param str domain: the domain
+        """
+        self.settings.pop(domain, None)
+        self.unindex_domain(domain)
+
+    @staticmethod
+    def get_hosts(setting):
+        """
+        Returns the full and the registrable domain of the setting's domain and url.
+
+        :param PasswordSetting setting: the setting
+        :return: the hosts in lower case
+        :rtype: frozenset
+        """
+        hosts = set()
+        for url in [setting.get_domain(), setting.get_url()]:
+            if len(url) > 0:
+                hosts.add(extract_full_domain(url).lower())
+                hosts.add(extract_top_domain(url).lower())
+        return frozenset(hosts)
+
+    def index_setting(self, setting):
+        """
+        Maps the full and the registrable domain of the setting's domain and url to the setting. Call this only on
+        drafts.
+
+        :param PasswordSetting setting: the setting
+        """
+        domain = setting.get_domain()
+        hosts = self.get_hosts(setting)
+        self.unindex_domain(domain)
+        for host in hosts:
+            self.url_index[host] = self.url_index.get(host, ()) + (domain,)
+        self.indexed_hosts[domain] = hosts
+
+    def unindex_domain(self, domain):
+        """
+        Removes a setting from the url index. Call this only on drafts.
+
+        :param str domain: the domain of the setting
+        """
+        for host in self.indexed_hosts.pop(domain, ()):
+            domains = tuple(indexed_domain for indexed_domain in self.url_index[host] if indexed_domain != domain)
+            if len(domains) > 0:
+                self.url_index[host] = domains
+            else:
+                self.url_index.pop(host)
+        self.changed_domains.add(domain)
@@ -5,66 +5,414 @@ import requests
 import json
 import base64
 import os
+import time
+import random
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+PULL_RETRIES = 2
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+FAILURE_THRESHOLD = 3
+COOL_DOWN = 300
+MAX_CONNECTIONS = 4
+LATENCY_SMOOTHING = 0.3
+OCTET_STREAM = 'application/octet-stream'
+EXPECTED_HASH_HEADER = 'X-Expected-Hash'
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failed requests. After failure_threshold failures the breaker opens and all requests are
+    skipped for cool_down seconds. After that one request is tried again: if it succeeds the breaker closes, if it
+    fails the breaker opens again. The state is saved in a small JSON file so the next run of the program knows
+    about the failures too.
+
+    :param str state_file: filename of the state file
+    :param int failure_threshold: number of consecutive failures which open the breaker
+    :param float cool_down: seconds to skip requests after the breaker opened
+    """
+    def __init__(self, state_file, failure_threshold=FAILURE_THRESHOLD, cool_down=COOL_DOWN):
+        self.state_file = state_file
+        self.failure_threshold = failure_threshold
+        self.cool_down = cool_down
+        self.failures = 0
+        self.opened_until = 0
+        self.load()
+
+    def load(self):
+        """
+        Reads the state file. A missing or broken file means no failures.
+        """
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            self.failures = int(state['failures'])
+            self.opened_until = float(state['openedUntil'])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.failures = 0
+            self.opened_until = 0
+
+    def save(self):
+        """
+        Writes the state file. If there are no failures the file is removed.
+        """
+        try:
+            if self.failures == 0:
+                if os.path.isfile(self.state_file):
+                    os.remove(self.state_file)
+            else:
+                with open(self.state_file, 'w', encoding='utf-8') as file:
+                    json.dump({'failures': self.failures, 'openedUntil': self.opened_until}, file)
+        except OSError:
+            pass
+
+    def get_remaining_cool_down(self):
+        """
+        :return: seconds until requests are allowed again. 0 if the breaker is closed.
+        :rtype: float
+        """
+        return max(0.0, self.opened_until - time.time())
+
+    def is_open(self):
+        """
+        :return: True if requests should be skipped
+        :rtype: bool
+        """
+        return self.get_remaining_cool_down() > 0
+
+    def record_success(self):
+        """
+        Closes the breaker.
+        """
+        if self.failures > 0:
+            self.failures = 0
+            self.opened_until = 0
+            self.save()
+
+    def record_failure(self):
+        """
+        Counts a failure and opens the breaker if there were failure_threshold failures in a row.
+        """
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_until = time.time() + self.cool_down
+        self.save()
 
 
 class Sync:
     """
     Sync connection wrapper.
 
+    Every request has a connect and a read timeout. Pulls do not change anything on the server so failed pulls are
+    repeated up to pull_retries times after an exponentially growing random delay. Pushes are tried once. If a
+    circuit breaker is given requests are skipped while it is open.
+
+    A push may name the hash of the blob it was merged with (see SyncMerge.get_blob_hash). A server which supports
+    this answers with 409 Conflict if its blob has a different hash. conflict tells if the last push was rejected
+    for this reason. Servers which do not know the precondition ignore it and overwrite their blob.
+
+    apull and apush are coroutine versions of pull and push for asyncio programs. Their requests are sent with post
+    on a pool of max_connections threads so the event loop is never blocked and both versions behave the same.
+
+    latency is the exponentially smoothed duration of the successful requests in seconds (None before the first
+    one). SyncManager uses it to rank several servers.
+
+    Servers may support a binary variant of the protocol which sends the encrypted blob as raw bytes instead of
+    base64 in a JSON string or a form field. Pulls accept both: a server which supports the variant answers with an
+    application/octet-stream body, other servers answer with JSON as before. After a binary answer pushes send the
+    raw bytes as application/octet-stream body with the expected hash in the X-Expected-Hash header. If the server
+    rejects this with 400 or 415 the push is repeated as form and the binary variant is not used anymore. The
+    blobs passed to and returned by pull and push are the raw encrypted bytes in both variants. Only the JSON and
+    form variant encode them with base64.
+
     :param str server_url: https://my.server.domain/path/to/php/
     :param str username:
     :param str password:
+    :param str cert_filename: certificate of the server
+    :param tuple timeout: connect and read timeout in seconds
+    :param int pull_retries: number of repetitions of failed pulls
+    :param CircuitBreaker circuit_breaker: breaker which stops requests after repeated failures
+    :param int max_connections: maximum number of concurrent requests of apull and apush
+    :param bool allow_binary: offer the binary variant of the protocol?
     """
-    def __init__(self, server_url, username, password, cert_filename):
+    def __init__(self, server_url, username, password, cert_filename, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 pull_retries=PULL_RETRIES, circuit_breaker=None, max_connections=MAX_CONNECTIONS,
+                 allow_binary=True):
         self.server_url = server_url
         self.username = username
         self.password = password
         self.certificate_filename = cert_filename
+        self.timeout = timeout
+        self.pull_retries = pull_retries
+        self.circuit_breaker = circuit_breaker
+        self.max_connections = max_connections
+        self.executor = None
+        self.conflict = False
+        self.latency = None
+        self.allow_binary = allow_binary
+        self.binary = False
         self.headers = {
             'content-type': 'application/x-www-form-urlencoded',
             'Authorization': 'Basic ' + str(base64.b64encode(
                 (self.username + ':' + self.password).encode('utf-8')
             ), encoding='utf-8')
         }
+        if allow_binary:
+            self.headers['Accept'] = OCTET_STREAM + ', application/json;q=0.9'
+
+    def is_suspended(self):
+        """
+        :return: True if requests are skipped because the circuit breaker is open
+        :rtype: bool
+        """
+        return self.circuit_breaker is not None and self.circuit_breaker.is_open()
+
+    def record_result(self, reachable):
+        """
+        Tells the circuit breaker if the server answered. Only network errors, server errors and invalid answers
+        count as failures.
 
-    def pull(self):
+        :param bool reachable: did the server answer properly?
         """
-        Read the base64 encoded data from the sync server.
+        if self.circuit_breaker is not None:
+            if reachable:
+                self.circuit_breaker.record_success()
+            else:
+                self.circuit_breaker.record_failure()
+
+    def record_latency(self, seconds):
+        """
+        Adds the duration of a successful request to the smoothed latency.
+
+        :param float seconds: duration of the request
+        """
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
 
-        :return: base64 encoded data
+    @staticmethod
+    def get_backoff(attempt):
+        """
+        Returns a random delay between 0 and BACKOFF_BASE * 2^attempt seconds (at most BACKOFF_MAX).
+
+        :param int attempt: number of the failed attempt starting with 0
+        :return: delay in seconds
+        :rtype: float
+        """
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def get_certificate_path(self):
+        """
+        :return: path of the certificate file. Relative paths are relative to this module.
         :rtype: str
         """
-        request = requests.post(self.server_url + "ajax/read.php",
-                                data="",
-                                headers=self.headers,
-                                verify=os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                                    self.certificate_filename))
-        if request.status_code == requests.codes.ok:
-            received_data = json.loads(request.text)
-            if 'status' in received_data and received_data['status']:
-                if 'result' in received_data:
-                    return True, received_data['result']
-                else:
-                    return True, ''
+        return os.path.join(os.path.dirname(os.path.realpath(__file__)), self.certificate_filename)
+
+    def post(self, path, data, headers=None):
+        """
+        Sends a request to the server.
+
+        :param str path: path relative to the server url
+        :param data: form data or the body as bytes
+        :param dict headers: headers which are added to or replace the default headers
+        :return: the response or None if the server could not be reached
+        """
+        try:
+            return requests.post(self.server_url + path,
+                                 data=data,
+                                 headers=dict(self.headers, **headers) if headers else self.headers,
+                                 verify=self.get_certificate_path(),
+                                 timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            return None
+
+    def get_executor(self):
+        """
+        :return: the thread pool which sends the requests of the coroutines. It is created with the first request.
+        :rtype: ThreadPoolExecutor
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix='sync')
+        return self.executor
+
+    async def apost(self, path, data, headers=None):
+        """
+        Coroutine version of post. The request runs on the thread pool of get_executor.
+
+        :param str path: path relative to the server url
+        :param data: form data or the body as bytes
+        :param dict headers: headers which are added to or replace the default headers
+        :return: the response or None if the server could not be reached
+        """
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(self.get_executor(),
+                                                                partial(self.post, path, data, headers))
+
+    def evaluate_pull_response(self, response):
+        """
+        Interprets the answer to a pull and tells the circuit breaker about it.
+
+        :param response: the response or None
+        :return: the result of the pull or None if the pull should be repeated
+        :rtype: (bool, bytes)
+        """
+        if response is None or response.status_code >= 500:
+            return None
+        if response.status_code != requests.codes.ok:
+            self.record_result(True)
+            return False, b''
+        if self.allow_binary and response.headers.get('content-type', '').startswith(OCTET_STREAM):
+            self.record_result(True)
+            self.binary = True
+            return True, response.content
+        self.binary = False
+        try:
+            received_data = json.loads(response.text)
+        except ValueError:
+            return None
+        self.record_result(True)
+        if type(received_data) == dict and 'status' in received_data and received_data['status']:
+            if 'result' in received_data:
+                try:
+                    return True, base64.b64decode(received_data['result'])
+                except (ValueError, TypeError):
+                    return False, b''
             else:
-                return False, ''
+                return True, b''
         else:
-            return False, ''
+            return False, b''
+
+    def pull(self, stop=None):
+        """
+        Read the encrypted blob from the sync server.
+
+        :param threading.Event stop: if it is set no further retries are made. A delay before a retry ends early.
+        :return: was the pull successful and the blob
+        :rtype: (bool, bytes)
+        """
+        if self.is_suspended():
+            return False, b''
+        for attempt in range(self.pull_retries + 1):
+            if attempt > 0:
+                if stop is None:
+                    time.sleep(self.get_backoff(attempt - 1))
+                elif stop.wait(self.get_backoff(attempt - 1)):
+                    break
+            result = self.evaluate_pull_response(self.post("ajax/read.php", ""))
+            if result is not None:
+                return result
+        self.record_result(False)
+        return False, b''
+
+    async def apull(self):
+        """
+        Coroutine version of pull.
+
+        :return: was the pull successful and the blob
+        :rtype: (bool, bytes)
+        """
+        import asyncio
+        if self.is_suspended():
+            return False, b''
+        for attempt in range(self.pull_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.get_backoff(attempt - 1))
+            result = self.evaluate_pull_response(await self.apost("ajax/read.php", ""))
+            if result is not None:
+                return result
+        self.record_result(False)
+        return False, b''
+
+    def get_push_request(self, data, expected_hash):
+        """
+        :param bytes data: the blob
+        :param str expected_hash: hash of the pulled blob or None
+        :return: the body and the headers of a push in the binary variant or the form and None
+        :rtype: (object, dict)
+        """
+        if self.binary:
+            headers = {'content-type': OCTET_STREAM}
+            if expected_hash is not None:
+                headers[EXPECTED_HASH_HEADER] = expected_hash
+            return data, headers
+        return self.get_push_form(data, expected_hash), None
 
-    def push(self, data):
+    def is_binary_rejected(self, response):
+        """
+        Checks if the server rejected a binary push because it does not support the binary variant. In this case
+        the variant is switched off. Call this only for binary pushes.
+
+        :param response: the response or None
+        :return: should the push be repeated as form?
+        :rtype: bool
+        """
+        if response is not None and response.status_code in [requests.codes.bad_request,
+                                                             requests.codes.unsupported_media_type]:
+            self.binary = False
+            return True
+        return False
+
+    @staticmethod
+    def get_push_form(data, expected_hash):
+        """
+        :param bytes data: the blob
+        :param str expected_hash: hash of the pulled blob or None
+        :return: the form data of a push with the base64 encoded blob
+        :rtype: dict
+        """
+        form = {'data': str(base64.b64encode(data), encoding='ascii')}
+        if expected_hash is not None:
+            form['expectedHash'] = expected_hash
+        return form
+
+    def evaluate_push_response(self, response):
+        """
+        Interprets the answer to a push and tells the circuit breaker about it.
+
+        :param response: the response or None
+        :return: was the push successful?
+        :rtype: bool
+        """
+        self.record_result(response is not None and response.status_code < 500)
+        self.conflict = response is not None and response.status_code == requests.codes.conflict
+        return response is not None and response.status_code == requests.codes.ok
+
+    def push(self, data, expected_hash=None):
         """
         Push data to the server. This overwrites data living there. Please pull and merge first.
 
-        :param str data: base64 encoded data
+        :param bytes data: the blob
+        :param str expected_hash: hash of the pulled blob the data was merged with or None to overwrite in any case
         :return: was the push successful?
         :rtype: bool
         """
-        response = requests.post(self.server_url + "ajax/write.php",
-                                 data={'data': data},
-                                 headers=self.headers,
-                                 verify=os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                                     self.certificate_filename))
-        if response.status_code == requests.codes.ok:
-            return True
-        else:
+        self.conflict = False
+        if self.is_suspended():
+            return False
+        body, headers = self.get_push_request(data, expected_hash)
+        response = self.post("ajax/write.php", body, headers)
+        if headers is not None and self.is_binary_rejected(response):
+            response = self.post("ajax/write.php", self.get_push_form(data, expected_hash))
+        return self.evaluate_push_response(response)
+
+    async def apush(self, data, expected_hash=None):
+        """
+        Coroutine version of push.
+
+        :param bytes data: the blob
+        :param str expected_hash: hash of the pulled blob the data was merged with or None to overwrite in any case
+        :return: was the push successful?
+        :rtype: bool
+        """
+        self.conflict = False
+        if self.is_suspended():
             return False
+        body, headers = self.get_push_request(data, expected_hash)
+        response = await self.apost("ajax/write.php", body, headers)
+        if headers is not None and self.is_binary_rejected(response):
+            response = await self.apost("ajax/write.php", self.get_push_form(data, expected_hash))
+        return self.evaluate_push_response(response)
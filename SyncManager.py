@@ -4,27 +4,83 @@
 Manages Sync connections.
 """
 
-from Sync import Sync
 from Packer import Packer
+from SyncMerge import get_blob_hash
 from tempfile import NamedTemporaryFile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import json
+import time
+import threading
+
+PULL_GRACE_PERIOD = 0.5
+SHUTDOWN_TIMEOUT = 25
 
 
 class SyncManager:
     """
-    Synchronization manager. This initializes and stores settings and handles the Sync object.
+    Synchronization manager. This initializes and stores settings and handles the Sync object. The Sync class and
+    with it the network libraries are imported when the first Sync object is created so programs which do not
+    synchronize start faster.
+
+    Besides the sync server backup servers can be configured (see add_backup_server). They get the same blob:
+
+    * A pull asks all servers at the same time. It returns as soon as every server answered or grace_period seconds
+      after the first answer. Servers which did not answer in time are listed in slow_targets. Servers with an open
+      circuit breaker are skipped. The requests to slow servers are told to stop retrying and finish in the
+      background within the timeout of the connection. shutdown waits for them.
+    * The blob of the first server in the configured order which answered is returned (the main target). Blobs of
+      other servers which differ from it are kept in replica_data so the caller can merge them.
+    * A push sends the blob to all servers which answered the pull at the same time. Every server gets the hash of
+      the blob it answered as precondition. The push is successful if the main target took it. Failed pushes to
+      the other servers are repaired by the next push.
+
+    :param str state_file: file for the state of the circuit breaker of the connection. Without it failures are
+                           not remembered between runs of the program. Backup servers use the same name with a
+                           number at the end.
+    :param int max_connections: maximum number of concurrent requests of apull and apush. Defaults to
+                                Sync.MAX_CONNECTIONS.
     """
-    def __init__(self):
+    def __init__(self, state_file=None, max_connections=None):
+        self.state_file = state_file
+        self.max_connections = max_connections
         self.server_address = ""
         self.username = ""
         self.password = ""
         self.certificate = ""
         self.certificate_file = None
         self.sync = None
+        self.backups = []
+        self.backup_certificate_files = []
+        self.backup_syncs = []
+        self.grace_period = PULL_GRACE_PERIOD
+        self.main_target = None
+        self.replica_data = []
+        self.pulled_hashes = {}
+        self.slow_targets = set()
+        self.stragglers = set()
+        self.stragglers_lock = threading.Lock()
+        self.deferred_sync_settings = None
+        self.push_conflict = False
 
     def __del__(self):
         if self.certificate_file:
             self.certificate_file.close()
+        for certificate_file in self.backup_certificate_files:
+            certificate_file.close()
+
+    def has_sync_settings(self):
+        """
+        :return: True if settings for a sync server are loaded or deferred
+        :rtype: bool
+        """
+        return bool(self.sync or self.deferred_sync_settings)
+
+    def has_deferred_sync_settings(self):
+        """
+        :return: True if the sync settings were deferred and not loaded yet (see defer_binary_sync_settings)
+        :rtype: bool
+        """
+        return bool(self.deferred_sync_settings)
 
     def get_binary_sync_settings(self):
         """
@@ -33,16 +89,41 @@ class SyncManager:
         :return: binary settings
         :rtype: bytes
         """
+        if self.deferred_sync_settings:
+            return self.deferred_sync_settings()
         if self.sync:
-            return Packer.compress(json.dumps({
+            sync_settings = {
                 "server-address": self.server_address,
                 "username": self.username,
                 "password": self.password,
                 "certificate": self.certificate
-            }).encode('utf-8'))
+            }
+            if len(self.backups) > 0:
+                sync_settings["backups"] = self.backups
+            return Packer.compress(json.dumps(sync_settings).encode('utf-8'))
         else:
             return b''
 
+    def defer_binary_sync_settings(self, decrypt):
+        """
+        Remembers how to get the packed sync settings without decrypting or loading them. They are loaded when a
+        pull or push needs them. Until then get_binary_sync_settings passes them through unchanged.
+
+        :param decrypt: a function without parameters which returns the packed sync settings
+        """
+        self.deferred_sync_settings = decrypt
+
+    def load_deferred_sync_settings(self):
+        """
+        Loads the sync settings passed to defer_binary_sync_settings.
+        """
+        if self.deferred_sync_settings:
+            decrypt = self.deferred_sync_settings
+            self.deferred_sync_settings = None
+            data = decrypt()
+            if len(data) > 0:
+                self.load_binary_sync_settings(data)
+
     def load_binary_sync_settings(self, data):
         """
         loads sync settings
@@ -58,6 +139,7 @@ class SyncManager:
             self.username = settings_dict["username"]
             self.password = settings_dict["password"]
             self.certificate = settings_dict["certificate"]
+            self.backups = settings_dict.get("backups", [])
             if self.certificate_file:
                 self.certificate_file.close()
             self.certificate_file = NamedTemporaryFile()
@@ -71,6 +153,7 @@ class SyncManager:
         """
         Ask the user for sync settings: Asks for server-URL, username and password.
         """
+        self.deferred_sync_settings = None
         print("Bitte geben Sie die Einstellungen für Ihren Synchronisations-Server an...")
         self.server_address = input("URL: ")
         self.username = input("Benutzername: ")
@@ -87,37 +170,366 @@ class SyncManager:
         self.certificate_file.seek(0)
         self.create_sync()
         print("Teste die Verbindung...")
-        if len(self.sync.pull()) > 0:
+        if self.sync.circuit_breaker:
+            self.sync.circuit_breaker.record_success()
+        if self.sync.pull()[0]:
+            print("Verbindung erfolgreich getestet.")
+        else:
+            print("Es konnte keine Verbindung aufgebaut werden.")
+
+    def ask_for_backup_sync_settings(self):
+        """
+        Asks the user for the settings of a backup server and adds it.
+        """
+        self.load_deferred_sync_settings()
+        if not self.sync:
+            print("Bitte geben Sie zuerst die Einstellungen für Ihren Synchronisations-Server an.")
+            return
+        print("Bitte geben Sie die Einstellungen für den zusätzlichen Synchronisations-Server an...")
+        server_address = input("URL: ")
+        username = input("Benutzername: ")
+        password = input("Passwort: ")
+        certificate = ""
+        line = input("Zertifikat im .pem-Format (beenden mit einer Leerzeile): ")
+        while len(line) > 0:
+            certificate += line + "\n"
+            line = input("")
+        self.add_backup_server(server_address, username, password, certificate)
+        print("Teste die Verbindung...")
+        if self.backup_syncs[-1].pull()[0]:
             print("Verbindung erfolgreich getestet.")
         else:
             print("Es konnte keine Verbindung aufgebaut werden.")
 
+    def add_backup_server(self, server_address, username, password, certificate):
+        """
+        Adds a backup server. Backup servers are only used together with the sync server.
+
+        :param str server_address: url of the server
+        :param str username: username
+        :param str password: password
+        :param str certificate: certificate of the server in PEM format
+        """
+        self.backups.append({
+            "server-address": server_address,
+            "username": username,
+            "password": password,
+            "certificate": certificate
+        })
+        if self.sync:
+            self.create_sync()
+
     def create_sync(self):
         """
-        creates a sync object.
+        creates a sync object for the sync server and for every backup server.
+        """
+        from Sync import Sync, CircuitBreaker, MAX_CONNECTIONS
+        circuit_breaker = None
+        if self.state_file:
+            circuit_breaker = CircuitBreaker(self.state_file)
+        self.sync = Sync(self.server_address, self.username, self.password, self.certificate_file.name,
+                         circuit_breaker=circuit_breaker, max_connections=self.max_connections or MAX_CONNECTIONS)
+        for certificate_file in self.backup_certificate_files:
+            certificate_file.close()
+        self.backup_certificate_files = []
+        self.backup_syncs = []
+        for number, backup in enumerate(self.backups, 1):
+            certificate_file = NamedTemporaryFile()
+            certificate_file.write(backup["certificate"].encode('utf-8'))
+            certificate_file.flush()
+            self.backup_certificate_files.append(certificate_file)
+            circuit_breaker = None
+            if self.state_file:
+                circuit_breaker = CircuitBreaker(self.state_file + '.' + str(number))
+            self.backup_syncs.append(Sync(backup["server-address"], backup["username"], backup["password"],
+                                          certificate_file.name, circuit_breaker=circuit_breaker,
+                                          max_connections=self.max_connections or MAX_CONNECTIONS))
+        self.main_target = None
+        self.pulled_hashes = {}
+
+    def get_targets(self):
+        """
+        :return: the Sync objects of the sync server and of the backup servers in the configured order
+        :rtype: [Sync]
+        """
+        if not self.sync:
+            return []
+        return [self.sync] + self.backup_syncs
+
+    def get_target_health(self):
+        """
+        :return: for every server its url, its smoothed latency in seconds (None if unknown), whether its circuit
+                 breaker is open and whether it was too slow for the last pull
+        :rtype: [dict]
+        """
+        return [{'server': target.server_url, 'latency': target.latency, 'suspended': target.is_suspended(),
+                 'slow': target in self.slow_targets} for target in self.get_targets()]
+
+    @staticmethod
+    def is_pull_successful(result):
+        """
+        :param (bool, bytes) result: the result of a pull
+        :return: was the pull successful?
+        :rtype: bool
+        """
+        return result[0]
+
+    @staticmethod
+    def timed_request(target, request, succeeded, stop=None):
+        """
+        Sends a request and records its duration if it was successful.
+
+        :param Sync target: the server
+        :param request: function which gets the target and the stop event and does the request
+        :param succeeded: function which gets the result and tells if the request was successful
+        :param threading.Event stop: set when nobody waits for the result anymore
+        :return: the result of the request
+        """
+        start = time.monotonic()
+        result = request(target, stop)
+        if succeeded(result):
+            target.record_latency(time.monotonic() - start)
+        return result
+
+    def run_on_targets(self, targets, request, succeeded, grace_period=None):
         """
-        self.sync = Sync(self.server_address, self.username, self.password, self.certificate_file.name)
+        Sends a request to several servers at the same time. A single request is sent without extra thread.
+
+        Requests which did not answer in time are not cancelled because a running HTTP request can not be
+        interrupted. Their stop event is set so they do not retry and they are kept in stragglers until they finish.
+        Their threads are joined by shutdown or when the interpreter exits.
+
+        :param [Sync] targets: the servers
+        :param request: function which gets a target and a threading.Event and does the request. The event is set
+                        when the result is not waited for anymore. Requests should not start a retry then.
+        :param succeeded: function which gets a result and tells if the request was successful
+        :param float grace_period: return this many seconds after the first successful request. None waits for all.
+        :return: target -> result for the targets which answered in time
+        :rtype: dict
+        """
+        if len(targets) == 1:
+            return {targets[0]: self.timed_request(targets[0], request, succeeded)}
+        results = {}
+        if len(targets) < 1:
+            return results
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix='sync')
+        futures = {executor.submit(self.timed_request, target, request, succeeded, stop): target
+                   for target in targets}
+        pending = set(futures.keys())
+        deadline = None
+        while len(pending) > 0:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout, FIRST_COMPLETED)
+            if len(done) < 1:
+                break
+            for future in done:
+                results[futures[future]] = future.result()
+                if deadline is None and grace_period is not None and succeeded(results[futures[future]]):
+                    deadline = time.monotonic() + grace_period
+        if len(pending) > 0:
+            stop.set()
+            with self.stragglers_lock:
+                self.stragglers.update(pending)
+            for future in pending:
+                future.add_done_callback(self.remove_straggler)
+        executor.shutdown(wait=False)
+        return results
+
+    def remove_straggler(self, future):
+        """
+        Forgets a request which did not answer in time when it is finished.
+
+        :param concurrent.futures.Future future: the request
+        """
+        with self.stragglers_lock:
+            self.stragglers.discard(future)
+
+    def shutdown(self, timeout=None):
+        """
+        Waits for the requests which did not answer in time (see run_on_targets). Call this before the program exits
+        or before the sync settings are thrown away.
+
+        :param float timeout: maximum seconds to wait. None waits until all are finished.
+        :return: are all requests finished?
+        :rtype: bool
+        """
+        with self.stragglers_lock:
+            stragglers = list(self.stragglers)
+        done, not_done = wait(stragglers, timeout)
+        return len(not_done) < 1
+
+    async def arun_on_targets(self, targets, request, succeeded, grace_period=None):
+        """
+        Coroutine version of run_on_targets. request returns an awaitable. Requests which did not answer in time are
+        cancelled.
+        """
+        import asyncio
+
+        async def timed_request(target):
+            start = time.monotonic()
+            result = await request(target)
+            if succeeded(result):
+                target.record_latency(time.monotonic() - start)
+            return result
+
+        tasks = {asyncio.ensure_future(timed_request(target)): target for target in targets}
+        results = {}
+        pending = set(tasks.keys())
+        deadline = None
+        while len(pending) > 0:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if len(done) < 1:
+                break
+            for task in done:
+                results[tasks[task]] = task.result()
+                if deadline is None and grace_period is not None and succeeded(results[tasks[task]]):
+                    deadline = time.monotonic() + grace_period
+        for task in pending:
+            task.cancel()
+        return results
+
+    def get_pull_targets(self):
+        """
+        Prepares a pull: forgets the state of the last one and returns the servers which should be asked.
+
+        :rtype: [Sync]
+        """
+        self.load_deferred_sync_settings()
+        self.main_target = None
+        self.replica_data = []
+        self.pulled_hashes = {}
+        if self.sync and self.sync.is_suspended():
+            print("Der Sync-Server war zuletzt nicht erreichbar. Die Synchronisation wird für " +
+                  str(int(self.sync.circuit_breaker.get_remaining_cool_down())) + " Sekunden ausgesetzt.")
+        targets = [target for target in self.get_targets() if not target.is_suspended()]
+        if self.sync and len(targets) < 1:
+            targets = [self.sync]
+        return targets
+
+    def evaluate_pulls(self, targets, results):
+        """
+        Chooses the main target and collects the differing blobs of the other servers.
+
+        :param [Sync] targets: the asked servers in the configured order
+        :param dict results: target -> result of its pull
+        :return: the result of the pull of the main target
+        :rtype: (bool, bytes)
+        """
+        self.slow_targets = {target for target in targets if target not in results}
+        successful = [target for target in targets if target in results and results[target][0]]
+        if len(successful) < 1:
+            return False, b''
+        for target in successful:
+            self.pulled_hashes[target] = get_blob_hash(results[target][1])
+        self.main_target = successful[0]
+        data = results[self.main_target][1]
+        for target in successful[1:]:
+            if results[target][1] != data and results[target][1] not in self.replica_data:
+                self.replica_data.append(results[target][1])
+        return True, data
+
+    def get_replica_data(self):
+        """
+        :return: the blobs of the last pull which differ from the returned one
+        :rtype: [bytes]
+        """
+        return self.replica_data
+
+    def get_push_requests(self, data, expected_hash):
+        """
+        :param bytes data: the blob
+        :param str expected_hash: hash of the pulled blob of the main target or None to overwrite the data
+        :return: the main target and target -> expected hash for every server which gets the push
+        :rtype: (Sync, dict)
+        """
+        main_target = self.main_target or self.sync
+        expected_hashes = {main_target: expected_hash}
+        for target in self.get_targets():
+            if target is not main_target and target in self.pulled_hashes and not target.is_suspended():
+                expected_hashes[target] = self.pulled_hashes[target] if expected_hash is not None else None
+        return main_target, expected_hashes
+
+    def evaluate_pushes(self, data, main_target, results):
+        """
+        Remembers the new blob hash of the servers which took the push and sets push_conflict.
+
+        :param bytes data: the pushed blob
+        :param Sync main_target: the main target
+        :param dict results: target -> result of its push
+        :return: did the main target take the push?
+        :rtype: bool
+        """
+        for target, pushed in results.items():
+            if pushed:
+                self.pulled_hashes[target] = get_blob_hash(data)
+        if results.get(main_target):
+            return True
+        self.push_conflict = main_target.conflict
+        if not self.push_conflict:
+            print("Synchronisation fehlgeschlagen.")
+        return False
 
     def pull(self):
         """
-        pulls data from the sync server. Returns an empty string if no connection is possible.
+        pulls data from the sync server. Returns an unsuccessful result if no connection is possible.
 
-        :return: pulled base64 data
-        :rtype: str
+        :return: was the pull successful and the pulled blob
+        :rtype: (bool, bytes)
         """
-        if self.sync:
-            return self.sync.pull()
-        else:
-            return False, ''
+        targets = self.get_pull_targets()
+        if not self.sync:
+            return False, b''
+        return self.evaluate_pulls(targets, self.run_on_targets(
+            targets, lambda target, stop: target.pull(stop), self.is_pull_successful, self.grace_period))
 
-    def push(self, data):
+    def push(self, data, expected_hash=None):
         """
-        pushes data to the sync server. If the push fails an error message is displayed.
+        pushes data to the sync server. If the push fails an error message is displayed. If the server rejected the
+        push because its data changed since the pull push_conflict is True and no message is displayed.
 
-        :param str data: base64 data
+        :param bytes data: the blob
+        :param str expected_hash: hash of the pulled blob or None to overwrite the data on the server
+        :return: was the push successful?
+        :rtype: bool
         """
-        if self.sync:
-            if not self.sync.push(data):
-                print("Synchronisation fehlgeschlagen.")
-        else:
+        self.push_conflict = False
+        self.load_deferred_sync_settings()
+        if not self.sync:
+            print("Sie haben keine gültigen Einstellungen für den sync server.")
+            return False
+        main_target, expected_hashes = self.get_push_requests(data, expected_hash)
+        return self.evaluate_pushes(data, main_target, self.run_on_targets(
+            list(expected_hashes.keys()), lambda target, stop: target.push(data, expected_hashes[target]), bool))
+
+    async def apull(self):
+        """
+        Coroutine version of pull which does not block the event loop.
+
+        :return: was the pull successful and the pulled blob
+        :rtype: (bool, bytes)
+        """
+        targets = self.get_pull_targets()
+        if not self.sync:
+            return False, b''
+        return self.evaluate_pulls(targets, await self.arun_on_targets(
+            targets, lambda target: target.apull(), self.is_pull_successful, self.grace_period))
+
+    async def apush(self, data, expected_hash=None):
+        """
+        Coroutine version of push which does not block the event loop.
+
+        :param bytes data: the blob
+        :param str expected_hash: hash of the pulled blob or None to overwrite the data on the server
+        :return: was the push successful?
+        :rtype: bool
+        """
+        self.push_conflict = False
+        self.load_deferred_sync_settings()
+        if not self.sync:
             print("Sie haben keine gültigen Einstellungen für den sync server.")
+            return False
+        main_target, expected_hashes = self.get_push_requests(data, expected_hash)
+        return self.evaluate_pushes(data, main_target, await self.arun_on_targets(
+            list(expected_hashes.keys()), lambda target: target.apush(data, expected_hashes[target]), bool))
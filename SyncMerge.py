@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Three-way merge of the local settings, the settings on the sync server and the state of the last synchronization.
+"""
+
+import hashlib
+from datetime import datetime, timedelta
+from PasswordSetting import get_fingerprint
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+TOMBSTONE_HORIZON = timedelta(days=90)
+
+
+def get_blob_hash(blob):
+    """
+    Returns the hash of the raw bytes of a sync blob. A push can name the hash of the blob it was merged with so the
+    server rejects it if another client pushed in the meantime. The hash of an empty server is the hash of b''.
+
+    :param bytes blob: the encrypted blob
+    :return: hex encoded hash
+    :rtype: str
+    """
+    return hashlib.sha256(blob).hexdigest()
+
+
+def is_tombstone(data_set):
+    """
+    Returns True if the data set marks a deleted setting.
+
+    :param dict data_set: a data set of the sync blob
+    :rtype: bool
+    """
+    return bool(data_set.get('deleted', False))
+
+
+def create_tombstone(modification_date=None):
+    """
+    Creates the entry which replaces a deleted setting in the sync blob.
+
+    :param str modification_date: date of the deletion in the format YYYY-MM-DDTHH:MM:SS. Defaults to now.
+    :return: the tombstone
+    :rtype: dict
+    """
+    if modification_date is None:
+        modification_date = datetime.now().strftime(DATE_FORMAT)
+    return {'mDate': modification_date, 'deleted': True}
+
+
+def merge_tombstones(tombstone, other_tombstone):
+    """
+    Combines two versions of a tombstone: the later date wins.
+
+    :param dict tombstone: a tombstone
+    :param dict other_tombstone: another tombstone for the same domain
+    :return: the combined tombstone
+    :rtype: dict
+    """
+    return create_tombstone(max(tombstone['mDate'], other_tombstone['mDate']))
+
+
+def get_newer(local_data_set, remote_data_set, local_fingerprint=None, remote_fingerprint=None):
+    """
+    Resolves a conflict between two changed data sets: the newer one wins. If both were changed at the same second
+    the one with the greater fingerprint wins so every client resolves the conflict in the same way.
+
+    :param dict local_data_set: the local version
+    :param dict remote_data_set: the remote version
+    :param str local_fingerprint: fingerprint of the local version if it is already known
+    :param str remote_fingerprint: fingerprint of the remote version if it is already known
+    :return: the winning data set
+    :rtype: dict
+    """
+    if local_data_set.get('mDate', '') != remote_data_set.get('mDate', ''):
+        if local_data_set.get('mDate', '') > remote_data_set.get('mDate', ''):
+            return local_data_set
+        return remote_data_set
+    if local_fingerprint is None:
+        local_fingerprint = get_fingerprint(local_data_set)
+    if remote_fingerprint is None:
+        remote_fingerprint = get_fingerprint(remote_data_set)
+    if local_fingerprint > remote_fingerprint:
+        return local_data_set
+    return remote_data_set
+
+
+def merge_settings(local, remote, base, local_fingerprints=None, remote_fingerprints=None):
+    """
+    Merges the local and the remote data sets in one pass over all domains. For every domain the fingerprints of the
+    local and the remote version are compared with the fingerprint of the last synchronized version (the base):
+
+    * If only one side changed since the last synchronization its version is taken.
+    * If both sides changed the newer version wins.
+    * A deleted setting is represented by a tombstone. A local tombstone which the server does not know is dropped
+      because there is nothing to delete on the server. Two tombstones are combined with merge_tombstones.
+    * A setting which did not change since the last synchronization but is missing on the server was deleted by
+      another client and its tombstone was already collected (see collect_tombstones). It is dropped as well.
+
+    Every fingerprint is calculated at most once. Pass the fingerprints you already know (for example the cached
+    ones of PasswordSetting) to skip their calculation.
+
+    :param dict local: domain -> local setting dict or tombstone
+    :param dict remote: domain -> data set from the sync server
+    :param dict base: domain -> fingerprint of the last synchronized data set
+    :param dict local_fingerprints: domain -> fingerprint of the local data set. Missing ones are calculated.
+    :param dict remote_fingerprints: domain -> fingerprint of the remote data set. Missing ones are calculated.
+    :return: domain -> merged data set
+    :rtype: dict
+    """
+    if local_fingerprints is None:
+        local_fingerprints = {}
+    if remote_fingerprints is None:
+        remote_fingerprints = {}
+    merged = {}
+    for domain, remote_data_set in remote.items():
+        local_data_set = local.get(domain)
+        if local_data_set is None:
+            merged[domain] = remote_data_set
+            continue
+        local_fingerprint = local_fingerprints.get(domain) or get_fingerprint(local_data_set)
+        remote_fingerprint = remote_fingerprints.get(domain) or get_fingerprint(remote_data_set)
+        base_fingerprint = base.get(domain)
+        if local_fingerprint == remote_fingerprint or remote_fingerprint == base_fingerprint:
+            merged[domain] = local_data_set
+        elif is_tombstone(local_data_set) and is_tombstone(remote_data_set):
+            merged[domain] = merge_tombstones(local_data_set, remote_data_set)
+        elif local_fingerprint == base_fingerprint:
+            merged[domain] = remote_data_set
+        else:
+            merged[domain] = get_newer(local_data_set, remote_data_set, local_fingerprint, remote_fingerprint)
+    for domain, local_data_set in local.items():
+        if domain not in remote and not is_tombstone(local_data_set) and \
+                (local_fingerprints.get(domain) or get_fingerprint(local_data_set)) != base.get(domain):
+            merged[domain] = local_data_set
+    return merged
+
+
+def merge_replicas(data, replica_data, base):
+    """
+    Combines the data of two sync servers which hold replicas of the same settings. A replica may be stale because
+    its server was not reachable for some pushes. So a domain which is missing in one replica is kept unless the
+    other replica still has the version of the last synchronization: then it was deleted and collected since.
+    Domains in both replicas are merged like in merge_settings.
+
+    :param dict data: domain -> data set of the main server
+    :param dict replica_data: domain -> data set of another server
+    :param dict base: domain -> fingerprint of the last synchronized data set
+    :return: domain -> merged data set
+    :rtype: dict
+    """
+    replica_fingerprints = {domain: get_fingerprint(data_set) for domain, data_set in replica_data.items()}
+    merged = merge_settings(data, {domain: data_set for domain, data_set in replica_data.items()
+                                   if domain in data or replica_fingerprints[domain] != base.get(domain)},
+                            base, remote_fingerprints=replica_fingerprints)
+    for domain, data_set in data.items():
+        if domain not in merged:
+            merged[domain] = data_set
+    return merged
+
+
+def differs(data, other_data):
+    """
+    Returns True if the two dicts of data sets are not equal.
+
+    :param dict data: domain -> data set
+    :param dict other_data: domain -> data set
+    :rtype: bool
+    """
+    if data.keys() != other_data.keys():
+        return True
+    for domain, data_set in data.items():
+        if data_set != other_data[domain]:
+            return True
+    return False
+
+
+def collect_tombstones(data, horizon=TOMBSTONE_HORIZON, now=None):
+    """
+    Prepares data for a push: tombstones which are at least as old as the horizon are dropped. Every client which
+    synchronized within the horizon has seen them. A client which did not does not resurrect the deleted settings
+    because the merge drops unchanged settings which are missing on the server (see merge_settings).
+
+    :param dict data: domain -> setting dict or tombstone
+    :param datetime.timedelta horizon: tombstones of this age are dropped
+    :param datetime.datetime now: the current time. This is for testing only.
+    :return: the data for the push and the collected tombstones
+    :rtype: (dict, dict)
+    """
+    if now is None:
+        now = datetime.now()
+    horizon_date = (now - horizon).strftime(DATE_FORMAT)
+    compacted = {}
+    collected = {}
+    for domain, data_set in data.items():
+        if is_tombstone(data_set) and data_set['mDate'] <= horizon_date:
+            collected[domain] = data_set
+        else:
+            compacted[domain] = data_set
+    return compacted, collected
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Persistent queue of local changes which were not pushed to the sync server yet.
+"""
+
+import os
+import hmac
+import json
+import zlib
+import hashlib
+import threading
+from Crypter import Crypter
+from Packer import Packer
+from FileLock import write_file_atomically
+from SyncMerge import is_tombstone
+
+DEFAULT_FLUSH_INTERVAL = 60
+OUTBOX_KEY_LABEL = b'ctSESAM sync outbox'
+
+
+class SyncOutbox:
+    """
+    Records the settings and tombstones of all local changes until the sync server has them. Several changes of the
+    same domain collapse into one entry with the latest version so a burst of changes results in a single push.
+
+    The outbox is saved next to the settings file whenever the settings file is saved. Like the PasswordCache it is
+    encrypted with a key which is calculated with HMAC-SHA256 from the key of the settings file and a random nonce
+    stored in the outbox file. So saving and loading it costs no extra key derivation and the settings file and the
+    outbox are never encrypted with the same key. The outbox file names the salt of its settings file. An outbox
+    with a different salt does not belong to the current settings file and is ignored.
+
+    :param str outbox_file: filename of the outbox
+    """
+    def __init__(self, outbox_file):
+        self.outbox_file = outbox_file
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, domain, data_set):
+        """
+        Records a local change. An older pending change of the same domain is replaced.
+
+        :param str domain: the domain
+        :param dict data_set: the setting dict or the tombstone
+        """
+        with self.lock:
+            self.entries[domain] = data_set
+
+    def refresh(self, local_data):
+        """
+        Updates the entries with the current local versions. Settings may be changed after they were recorded.
+        Entries of domains which do not exist locally anymore are dropped.
+
+        :param dict local_data: domain -> current setting dict or tombstone
+        """
+        with self.lock:
+            for domain, data_set in list(self.entries.items()):
+                local_data_set = local_data.get(domain)
+                if local_data_set is None:
+                    self.entries.pop(domain)
+                elif local_data_set != data_set:
+                    self.entries[domain] = local_data_set
+
+    def get_pending_domains(self):
+        """
+        :return: the domains with pending changes
+        :rtype: set
+        """
+        with self.lock:
+            return set(self.entries.keys())
+
+    def acknowledge(self, remote_data):
+        """
+        Removes the entries the server already has. A pending tombstone is acknowledged if the server has a tombstone
+        or no entry for the domain.
+
+        :param dict remote_data: domain -> data set on the server
+        """
+        with self.lock:
+            for domain, data_set in list(self.entries.items()):
+                remote_data_set = remote_data.get(domain)
+                if remote_data_set == data_set or (is_tombstone(data_set) and (
+                        remote_data_set is None or is_tombstone(remote_data_set))):
+                    self.entries.pop(domain)
+
+    @staticmethod
+    def get_outbox_key(vault_key, nonce):
+        """
+        Derives the key of the outbox file from the key of the settings file.
+
+        :param bytes vault_key: key of the settings file (Crypter.key)
+        :param bytes nonce: the random nonce of the outbox file
+        :return: the key with 32 bytes
+        :rtype: bytes
+        """
+        return hmac.new(vault_key, OUTBOX_KEY_LABEL + nonce, hashlib.sha256).digest()
+
+    def load(self, salt, vault_key):
+        """
+        Reads the outbox file. A missing file, a file of another settings file or a file which can not be decrypted
+        results in an empty outbox.
+
+        :param bytes salt: salt of the settings file
+        :param bytes vault_key: key of the settings file (Crypter.key)
+        """
+        with self.lock:
+            self.entries = {}
+            if not os.path.isfile(self.outbox_file):
+                return
+            with open(self.outbox_file, 'br') as file:
+                data = file.read()
+            if data[:32] != salt:
+                return
+            crypter = Crypter.from_key(self.get_outbox_key(vault_key, data[32:64]))
+            try:
+                self.entries = json.loads(str(Packer.decompress(crypter.decrypt(data[64:])), encoding='utf-8'))
+            except (zlib.error, ValueError, IndexError):
+                self.entries = {}
+
+    def save(self, salt, vault_key):
+        """
+        Writes the outbox file with a new nonce. An empty outbox removes the file.
+
+        :param bytes salt: salt of the settings file
+        :param bytes vault_key: key of the settings file (Crypter.key)
+        """
+        with self.lock:
+            if len(self.entries) > 0:
+                nonce = os.urandom(32)
+                crypter = Crypter.from_key(self.get_outbox_key(vault_key, nonce))
+                write_file_atomically(self.outbox_file,
+                                      salt + nonce + crypter.encrypt(Packer.compress(json.dumps(self.entries))))
+            elif os.path.isfile(self.outbox_file):
+                os.remove(self.outbox_file)
+
+
+class OutboxFlusher:
+    """
+    Background thread which flushes the outbox of a PasswordSettingsManager every interval seconds if it has pending
+    changes. Use this in long running programs so many small changes are pushed together.
+
+    :param PasswordSettingsManager settings_manager: the manager
+    :param str password: masterpassword
+    :param float interval: seconds between two flushes
+    :param lock: a lock which protects the manager against concurrent use
+    """
+    def __init__(self, settings_manager, password, interval=DEFAULT_FLUSH_INTERVAL, lock=None):
+        self.settings_manager = settings_manager
+        self.password = password
+        self.interval = interval
+        self.lock = lock or threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sync-outbox-flusher', daemon=True)
+
+    def start(self):
+        """
+        Starts the background thread.
+        """
+        self.thread.start()
+
+    def flush(self):
+        """
+        Flushes the outbox now if it has pending changes.
+
+        :return: True if the outbox is empty afterwards
+        :rtype: bool
+        """
+        with self.lock:
+            if len(self.settings_manager.outbox) < 1:
+                return True
+            return self.settings_manager.flush_outbox(self.password)
+
+    def run(self):
+        """
+        Main loop of the background thread.
+        """
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def stop(self, flush=True):
+        """
+        Stops the background thread.
+
+        :param bool flush: flush pending changes a last time?
+        """
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if flush:
+            self.flush()
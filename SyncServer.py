@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+A small reference implementation of the sync server protocol (ajax/read.php and ajax/write.php) for tests and
+benchmarks. It keeps the data in memory and serves HTTPS on the local host with a self-signed certificate. It
+supports the binary variant of the protocol (see Sync).
+"""
+
+import ssl
+import json
+import base64
+import binascii
+import hmac
+import time
+import threading
+import subprocess
+import socketserver
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from SyncMerge import get_blob_hash
+from Sync import OCTET_STREAM, EXPECTED_HASH_HEADER
+
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+LISTEN_BACKLOG = 128
+
+
+def create_self_signed_certificate(certificate_file, key_file, host='localhost'):
+    """
+    Creates a self-signed certificate for the host and 127.0.0.1 with the openssl command line tool.
+
+    :param str certificate_file: filename for the certificate in PEM format
+    :param str key_file: filename for the private key in PEM format
+    :param str host: name of the host
+    :raises RuntimeError: if openssl is not available or fails
+    """
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-sha256', '-days', '30',
+                        '-keyout', key_file, '-out', certificate_file, '-subj', '/CN=' + host,
+                        '-addext', 'subjectAltName=DNS:' + host + ',IP:127.0.0.1'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    except (OSError, subprocess.CalledProcessError) as error:
+        raise RuntimeError("Could not create a certificate with openssl: " + str(error))
+
+
+class SyncRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers ajax/read.php and ajax/write.php for users authenticated with HTTP basic auth.
+    """
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_body(self, code, content_type, body):
+        """
+        Sends an answer.
+
+        :param int code: HTTP status code
+        :param str content_type: the content type
+        :param bytes body: the body
+        """
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count_traffic('sent', len(body))
+
+    def send_json(self, code, answer):
+        """
+        Sends a JSON answer.
+
+        :param int code: HTTP status code
+        :param dict answer: the answer
+        """
+        self.send_body(code, 'application/json', json.dumps(answer).encode('utf-8'))
+
+    def get_user(self):
+        """
+        Checks the basic auth header.
+
+        :return: the username or None if the credentials are wrong
+        :rtype: str
+        """
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Basic '):
+            return None
+        try:
+            username, password = str(base64.b64decode(authorization[6:]), encoding='utf-8').split(':', 1)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if username not in self.server.users or not hmac.compare_digest(self.server.users[username], password):
+            return None
+        return username
+
+    def do_POST(self):
+        username = self.get_user()
+        if username is None:
+            self.send_json(401, {'status': False, 'error': "Unauthorized."})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_REQUEST_SIZE:
+            self.send_json(413, {'status': False, 'error': "The request is too large."})
+            return
+        body = self.rfile.read(length)
+        self.server.count_traffic('received', len(body))
+        if self.server.delay > 0:
+            time.sleep(self.server.delay)
+        if self.path.endswith('/ajax/read.php'):
+            data = self.server.read(username)
+            if self.server.binary and OCTET_STREAM in self.headers.get('Accept', ''):
+                self.send_body(200, OCTET_STREAM, data)
+            elif len(data) > 0:
+                self.send_json(200, {'status': 'ok', 'result': str(base64.b64encode(data), encoding='ascii')})
+            else:
+                self.send_json(200, {'status': 'ok'})
+        elif self.path.endswith('/ajax/write.php'):
+            if self.headers.get('Content-Type', '').startswith(OCTET_STREAM):
+                if not self.server.binary:
+                    self.send_json(415, {'status': False, 'error': "Binary data is not supported."})
+                    return
+                data = body
+                expected_hash = self.headers.get(EXPECTED_HASH_HEADER)
+            else:
+                form = parse_qs(str(body, encoding='utf-8'))
+                if 'data' not in form:
+                    self.send_json(400, {'status': False, 'error': "No data."})
+                    return
+                try:
+                    data = base64.b64decode(form['data'][0], validate=True)
+                except (binascii.Error, ValueError):
+                    self.send_json(400, {'status': False, 'error': "Invalid data."})
+                    return
+                expected_hash = form['expectedHash'][0] if 'expectedHash' in form else None
+            if expected_hash is None:
+                self.send_json(200, self.server.write(username, data))
+            elif self.server.write_if_unchanged(username, data, expected_hash):
+                self.send_json(200, {'status': 'ok'})
+            else:
+                self.send_json(409, {'status': False, 'error': "The data was changed by another client."})
+        else:
+            self.send_json(404, {'status': False, 'error': "Unknown path."})
+
+
+class SyncServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    In-memory sync server. Pass the certificate file to Sync to connect to it:
+    ``Sync(server.get_url(), username, password, certificate_file)``.
+
+    A write with an expectedHash field only succeeds if the stored blob has this hash (compare and swap). Otherwise
+    the server answers with 409 Conflict. Writes without the field overwrite the blob.
+
+    Set delay to the number of seconds the server should wait before it answers to simulate a slow server. Set
+    binary to False to simulate a server which only knows the form and JSON variant of the protocol. traffic counts
+    the bytes of the received and sent bodies.
+
+    data maps the usernames to the stored blobs as raw bytes. Only the JSON and form variant encode them with base64.
+
+    :param dict users: username -> password
+    :param str certificate_file: certificate in PEM format. Without certificate the server speaks plain HTTP.
+    :param str key_file: private key of the certificate in PEM format
+    :param int port: the port. 0 chooses a free port.
+    :param str host: the address to listen on
+    """
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, users, certificate_file=None, key_file=None, port=0, host='127.0.0.1'):
+        self.users = users
+        self.data = {}
+        self.statistics = {'reads': 0, 'writes': 0, 'conflicts': 0}
+        self.lock = threading.Lock()
+        self.verbose = False
+        self.delay = 0
+        self.binary = True
+        self.traffic = {'received': 0, 'sent': 0}
+        self.scheme = 'http'
+        HTTPServer.__init__(self, (host, port), SyncRequestHandler)
+        if certificate_file:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate_file, key_file)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = 'https'
+
+    def get_url(self):
+        """
+        :return: the server url in the format Sync expects
+        :rtype: str
+        """
+        return self.scheme + '://localhost:' + str(self.server_address[1]) + '/'
+
+    def count_traffic(self, direction, length):
+        """
+        :param str direction: 'received' or 'sent'
+        :param int length: number of bytes
+        """
+        with self.lock:
+            self.traffic[direction] += length
+
+    def read(self, username):
+        """
+        :param str username: the user
+        :return: the stored blob or empty bytes if the user has no data yet
+        :rtype: bytes
+        """
+        with self.lock:
+            self.statistics['reads'] += 1
+            return self.data.get(username, b'')
+
+    def write(self, username, data):
+        """
+        :param str username: the user
+        :param bytes data: the encrypted blob
+        :return: the answer of write.php
+        :rtype: dict
+        """
+        with self.lock:
+            self.statistics['writes'] += 1
+            self.data[username] = data
+            return {'status': 'ok'}
+
+    def write_if_unchanged(self, username, data, expected_hash):
+        """
+        Writes the blob only if the stored blob has the expected hash.
+
+        :param str username: the user
+        :param bytes data: the encrypted blob
+        :param str expected_hash: hash of the blob the client merged with
+        :return: True if the blob was written
+        :rtype: bool
+        """
+        with self.lock:
+            if get_blob_hash(self.data.get(username, b'')) != expected_hash:
+                self.statistics['conflicts'] += 1
+                return False
+            self.statistics['writes'] += 1
+            self.data[username] = data
+            return True
+
+    def start(self):
+        """
+        Serves requests in a background thread.
+
+        :return: the thread
+        :rtype: threading.Thread
+        """
+        thread = threading.Thread(target=self.serve_forever, name='sync-server', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Versioned header of the settings file. It records the key derivation function of the file and its parameters so
+every machine can choose how expensive unlocking is.
+
+Layout: MAGIC (8 bytes), the format version (1 byte), the length of the header (4 bytes, big endian) and the header
+as UTF-8 encoded JSON object, e.g. ``{"kdf": {"algorithm": "scrypt", "n": 16384, "r": 8, "p": 1}}``. The rest of
+the file follows as before: salt (32 bytes), length of the encrypted sync settings (4 bytes), encrypted sync
+settings and encrypted settings.
+
+Files of older versions start directly with the salt. They use PBKDF2 with SHA512 and 32768 iterations and are
+converted to the new layout when they are saved.
+"""
+
+import json
+import struct
+from Crypter import DEFAULT_KDF, check_kdf
+
+MAGIC = b'ctSESAM\x89'
+VERSION = 1
+LEGACY_KDF = DEFAULT_KDF
+MAX_HEADER_LENGTH = 64 * 1024
+
+
+def pack_header(kdf):
+    """
+    :param dict kdf: parameters of the key derivation function (see Crypter.create_kdf)
+    :return: the header
+    :rtype: bytes
+    """
+    header = json.dumps({'kdf': check_kdf(kdf)}, sort_keys=True).encode('utf-8')
+    return MAGIC + struct.pack('!BI', VERSION, len(header)) + header
+
+
+def unpack_header(data):
+    """
+    Reads the header at the start of the settings file.
+
+    :param bytes data: the content of the settings file
+    :return: the parameters of the key derivation function and the position of the salt
+    :rtype: (dict, int)
+    :raises ValueError: if the header is damaged or of a newer version
+    """
+    if not data.startswith(MAGIC):
+        return LEGACY_KDF, 0
+    start = len(MAGIC) + struct.calcsize('!BI')
+    if len(data) < start:
+        raise ValueError("The header of the settings file is incomplete.")
+    version, header_length = struct.unpack('!BI', data[len(MAGIC):start])
+    if version != VERSION:
+        raise ValueError("Unknown version of the settings file: " + str(version))
+    if header_length > MAX_HEADER_LENGTH or len(data) < start + header_length:
+        raise ValueError("The header of the settings file is incomplete.")
+    try:
+        header = json.loads(str(data[start:start + header_length], encoding='utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        raise ValueError("The header of the settings file is damaged.")
+    if type(header) != dict:
+        raise ValueError("The header of the settings file is damaged.")
+    return check_kdf(header.get('kdf')), start + header_length
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compares the AES backends of the Crypter on vaults of several megabytes. For every backend and size it reports the
+throughput of encrypt and decrypt and checks that all backends produce the same bytes.
+
+Usage: python benchmarks/aes_backends.py --sizes 1,8,32 --repeat 5
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from Crypter import Crypter, get_available_backends
+
+MASTER_PASSWORD = 'xyz'
+
+
+def measure(function, data, repeat):
+    """
+    Calls the function repeat times with the data.
+
+    :return: the result of the last call and the best time in seconds
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(data)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return result, best
+
+
+def run(size, repeat, crypters):
+    """
+    Runs the benchmark for one vault size and prints the results.
+    """
+    data = os.urandom(size * 1024 * 1024)
+    ciphertexts = set()
+    for name, crypter in crypters.items():
+        ciphertext, encrypt_time = measure(crypter.encrypt, data, repeat)
+        plaintext, decrypt_time = measure(crypter.decrypt, ciphertext, repeat)
+        if plaintext != data:
+            raise RuntimeError("The backend " + name + " does not decrypt its own data.")
+        ciphertexts.add(ciphertext)
+        print("{:>4} MB | {:<8} | encrypt {:>8.1f} MB/s | decrypt {:>8.1f} MB/s".format(
+            size, name, size / encrypt_time, size / decrypt_time))
+    if len(ciphertexts) > 1:
+        raise RuntimeError("The backends produce different ciphertexts.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the AES backends of the Crypter.")
+    parser.add_argument('--sizes', default='1,8,32', help="Comma separated vault sizes in MB. Default: 1,8,32")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement. The best is reported. Default: 5")
+    args = parser.parse_args()
+    salt = os.urandom(32)
+    backend_crypters = {backend: Crypter(salt, MASTER_PASSWORD, backend=backend)
+                        for backend in get_available_backends()}
+    for vault_size in [int(size) for size in args.sizes.split(',')]:
+        run(vault_size, args.repeat, backend_crypters)
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compares the ways of converting random bytes to passwords: convert_bytes_to_password for every digest and
+convert_bytes_to_passwords in pure Python and with NumPy. It checks that all produce the same passwords.
+
+Usage: python benchmarks/random_passwords.py --count 200000 --length 10
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from PasswordGenerator import CtSesam, RANDOM_DIGEST_SIZE, is_numpy_installed
+
+
+def run(count, length, digest_size):
+    """
+    Runs the benchmark and prints the results.
+    """
+    generator = CtSesam()
+    data = os.urandom(count * digest_size)
+    variants = [('scalar', lambda: [generator.convert_bytes_to_password(data[start:start + digest_size], length)
+                                    for start in range(0, len(data), digest_size)]),
+                ('python', lambda: generator.convert_bytes_to_passwords(data, length, digest_size, use_numpy=False))]
+    if is_numpy_installed():
+        variants.append(('numpy', lambda: generator.convert_bytes_to_passwords(data, length, digest_size,
+                                                                               use_numpy=True)))
+    results = []
+    for name, function in variants:
+        start = time.perf_counter()
+        results.append(function())
+        duration = time.perf_counter() - start
+        print("{:<7} | {:>8.3f} s | {:>10.0f} passwords/s".format(name, duration, count / duration))
+    if any(result != results[0] for result in results):
+        raise RuntimeError("The variants produce different passwords.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compares the bulk conversion of random bytes to passwords.")
+    parser.add_argument('--count', type=int, default=200000, help="Number of passwords. Default: 200000")
+    parser.add_argument('--length', type=int, default=10, help="Length of the passwords. Default: 10")
+    parser.add_argument('--digest-size', type=int, default=RANDOM_DIGEST_SIZE,
+                        help="Random bytes per password. Default: " + str(RANDOM_DIGEST_SIZE))
+    args = parser.parse_args()
+    run(args.count, args.length, args.digest_size)
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Measures searches for common terms in a large vault and compares them with a linear scan over all settings. It fails
+if a search is not at least the given factor faster than the scan.
+
+Usage: python benchmarks/search_index.py --settings 20000 --repeat 3 --factor 10
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from SearchIndex import SearchIndex
+from PasswordSetting import PasswordSetting
+
+QUERIES = ['https', 'login', 'user', 'note', '.com', 'co']
+
+
+def fastest(function, repeat):
+    """
+    Calls the function repeat times.
+
+    :return: the best time in seconds
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def build_index(count):
+    """
+    Builds an index of count settings whose domains, usernames, urls and notes share common terms.
+
+    :rtype: SearchIndex
+    """
+    index = SearchIndex()
+    for i in range(count):
+        setting = PasswordSetting(['shop', 'mail', 'bank', 'news'][i % 4] + str(i) + ['.com', '.de'][i % 2])
+        setting.set_username('user' + str(i))
+        setting.set_url('https://www.' + setting.get_domain() + '/login')
+        setting.set_notes('note ' + str(i))
+        index.add(setting)
+    return index
+
+
+def run(count, repeat, factor):
+    """
+    Runs the benchmark and prints the results.
+    """
+    index = build_index(count)
+    index.search(QUERIES[0])
+    baseline = fastest(lambda: [key for key, fields in index.documents.items() if 'note' in fields['notes']], repeat)
+    print("{:<8} | {:>8.3f} ms".format('scan', baseline * 1000))
+    too_slow = []
+    for query in QUERIES:
+        duration = fastest(lambda: index.search(query), repeat)
+        print("{:<8} | {:>8.3f} ms | {:>6.1f}x".format(query, duration * 1000, baseline / duration))
+        if duration * factor > baseline:
+            too_slow.append(query)
+    if len(too_slow) > 0:
+        raise RuntimeError("Searching for {} is not {} times faster than a linear scan.".format(
+            ', '.join(too_slow), factor))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures searches for common terms in a large vault.")
+    parser.add_argument('--settings', type=int, default=20000, help="Number of settings. Default: 20000")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per search. The best is reported. Default: 3")
+    parser.add_argument('--factor', type=float, default=10,
+                        help="Minimum speedup of a search over a linear scan. Default: 10")
+    args = parser.parse_args()
+    run(args.settings, args.repeat, args.factor)
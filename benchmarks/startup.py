@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Measures how long importing ctSESAM takes in a new interpreter and lists the slowest modules it imports. It fails if
+the import takes longer than the budget.
+
+Usage: python benchmarks/startup.py --repeat 5 --budget 100
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def get_import_times(module):
+    """
+    Imports the module in a new interpreter with -X importtime.
+
+    :param str module: name of the module
+    :return: module name -> cumulative import time in microseconds
+    :rtype: dict
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                             cwd=REPOSITORY_DIRECTORY, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    import_times = {}
+    for line in process.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            import_times[parts[2].strip()] = int(parts[1])
+    return import_times
+
+
+def run(repeat, budget, top):
+    """
+    Runs the benchmark and prints the results.
+    """
+    runs = [get_import_times('ctSESAM') for _ in range(repeat)]
+    fastest = min(runs, key=lambda import_times: import_times['ctSESAM'])
+    for module, import_time in sorted(fastest.items(), key=lambda item: -item[1])[:top]:
+        print("{:<40} | {:>8.1f} ms".format(module, import_time / 1000))
+    import_time = fastest['ctSESAM'] / 1000
+    if import_time > budget:
+        raise RuntimeError("Importing ctSESAM took {:.1f} ms. The budget is {} ms.".format(import_time, budget))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures the import time of ctSESAM.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of imports. The fastest counts. Default: 5")
+    parser.add_argument('--budget', type=int, default=100, help="Maximum import time in ms. Default: 100")
+    parser.add_argument('--top', type=int, default=15, help="Number of modules to list. Default: 15")
+    args = parser.parse_args()
+    run(args.repeat, args.budget, args.top)
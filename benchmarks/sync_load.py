@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Load test for the synchronization: several clients run pull-merge-push cycles at the same time against a local
+SyncServer. Every cycle adds one setting with a unique domain. At the end the harness checks which of these
+settings are missing on the server (lost updates).
+
+Usage: python benchmarks/sync_load.py --clients 4 --cycles 5 --sizes 1000,10000,100000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from PasswordSettingsManager import PasswordSettingsManager
+from PasswordSetting import PasswordSetting
+from Crypter import Crypter
+from Packer import Packer
+from Sync import Sync
+from SyncServer import SyncServer, create_self_signed_certificate
+
+USERNAME = 'load'
+PASSWORD = 'test'
+MASTER_PASSWORD = 'xyz'
+
+
+def percentile(values, fraction):
+    """
+    :param values: sorted list of numbers
+    :param float fraction: between 0 and 1
+    :return: the percentile
+    """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def create_manager(directory, name, server, certificate_file):
+    """
+    Creates a settings manager with its own settings file which syncs with the server.
+    """
+    manager = PasswordSettingsManager(os.path.join(directory, name + '.pws'))
+    manager.sync_manager.sync = Sync(server.get_url(), USERNAME, PASSWORD, certificate_file)
+    return manager
+
+
+def read_server_domains(server):
+    """
+    Decrypts the blob on the server.
+
+    :return: the domains of all settings on the server which are not deleted
+    :rtype: set
+    """
+    blob = server.data[USERNAME]
+    crypter = Crypter(blob[1:33], MASTER_PASSWORD)
+    data = json.loads(str(Packer.decompress(crypter.decrypt(blob[33:])), encoding='utf-8'))
+    return {domain for domain, data_set in data.items() if not data_set.get('deleted', False)}
+
+
+def run_client(manager, client_number, cycles, latencies, written_domains):
+    """
+    Runs the pull-merge-push cycles of one client.
+    """
+    for cycle in range(cycles):
+        start = time.perf_counter()
+        manager.update_from_sync(MASTER_PASSWORD)
+        setting = PasswordSetting('client-' + str(client_number) + '-cycle-' + str(cycle) + '.example')
+        manager.set_setting(setting)
+        manager.update_sync_server_if_necessary(MASTER_PASSWORD)
+        latencies.append(time.perf_counter() - start)
+        written_domains.append(setting.get_domain())
+
+
+def run(size, clients, cycles, directory, certificate_file, key_file):
+    """
+    Runs the load test for one blob size and prints the results.
+    """
+    server = SyncServer({USERNAME: PASSWORD}, certificate_file, key_file)
+    server.start()
+    try:
+        seed = create_manager(directory, 'seed-' + str(size), server, certificate_file)
+        seed.update_from_sync(MASTER_PASSWORD)
+        for i in range(size):
+            seed.add_setting(PasswordSetting('domain-' + str(i) + '.example'))
+        seed.update_sync_server_if_necessary(MASTER_PASSWORD)
+        blob_size = len(server.data[USERNAME])
+        managers = [create_manager(directory, 'client-' + str(size) + '-' + str(client_number), server,
+                                   certificate_file) for client_number in range(clients)]
+        latencies = []
+        written_domains = []
+        threads = [threading.Thread(target=run_client,
+                                    args=(managers[client_number], client_number, cycles, latencies, written_domains))
+                   for client_number in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+        server_domains = read_server_domains(server)
+        lost = [domain for domain in written_domains if domain not in server_domains]
+        latencies.sort()
+        print("{:>7} settings | blob {:>9} bytes | {:>6.2f} cycles/s | latency p50 {:>7.3f} s p95 {:>7.3f} s "
+              "p99 {:>7.3f} s | {} push conflicts | {} of {} updates lost".format(
+                  size, blob_size, len(latencies) / duration, percentile(latencies, 0.5),
+                  percentile(latencies, 0.95), percentile(latencies, 0.99), server.statistics['conflicts'],
+                  len(lost), len(written_domains)))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test for the synchronization with a local sync server.")
+    parser.add_argument('--clients', type=int, default=4, help="Number of concurrent clients. Default: 4")
+    parser.add_argument('--cycles', type=int, default=5, help="Pull-merge-push cycles per client. Default: 5")
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="Comma separated numbers of settings in the blob. Default: 1000,10000,100000")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        certificate = os.path.join(temporary_directory, 'certificate.pem')
+        key = os.path.join(temporary_directory, 'key.pem')
+        create_self_signed_certificate(certificate, key)
+        for blob_settings in [int(size) for size in args.sizes.split(',')]:
+            run(blob_settings, args.clients, args.cycles, temporary_directory, certificate, key)
@@ -4,37 +4,82 @@
 Main file for c't SESAM.
 """
 
-from PasswordGenerator import CtSesam
-from PasswordSettingsManager import PasswordSettingsManager
+from PasswordSettingsManager import PasswordSettingsManager, CONFLICT_KEEP_NEWER, CONFLICT_OVERWRITE, CONFLICT_SKIP
+from Crypter import create_kdf, KDF_PBKDF2, KDF_SCRYPT
+from domainExtractor import extract_top_domain
+from SyncManager import SHUTDOWN_TIMEOUT
 import zlib
 import argparse
 import getpass
+import sys
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Generate domain passwords from your masterpassword.")
-    parser.add_argument('-n', '--no-sync',
-                        action='store_const', const=True,
-                        help="Do not synchronize with a server.")
-    parser.add_argument('-u', '--update-sync-settings',
-                        action='store_const', const=True,
-                        help="Ask for server settings before synchronization.")
-    parser.add_argument('--master-password', help="If not specified it will be prompted.")
-    parser.add_argument('-d', '--domain', help="If not specified it will be prompted.")
-    parser.add_argument('-q', '--quiet',
-                        action='store_const', const=True,
-                        help="Display only prompts (if necessary) and the plain password")
-    args = parser.parse_args()
-    if args.master_password:
-        master_password = args.master_password
-    else:
-        master_password = getpass.getpass(prompt='Masterpasswort: ')
-    settings_manager = PasswordSettingsManager()
+
+def run(parser, args, settings_manager, master_password):
+    """
+    Loads the settings and does what the command line arguments ask for.
+
+    :param argparse.ArgumentParser parser: the parser of the arguments
+    :param argparse.Namespace args: the parsed arguments
+    :param PasswordSettingsManager settings_manager: the settings manager
+    :param str master_password: masterpassword
+    """
+    if args.password_cache:
+        settings_manager.enable_password_cache()
     try:
         settings_manager.load_settings(master_password, not args.no_sync, args.update_sync_settings)
         if args.update_sync_settings:
             settings_manager.sync_manager.ask_for_sync_settings()
+        if args.add_backup_sync_server:
+            settings_manager.sync_manager.ask_for_backup_sync_settings()
     except zlib.error:
         print("Falsches Masterpasswort. Es wurden keine Einstellungen geladen.")
+    if args.kdf_cost and not args.kdf:
+        try:
+            settings_manager.set_kdf_cost(args.kdf_cost)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.import_settings:
+        report = settings_manager.import_settings(master_password, args.import_settings,
+                                                  conflict_policy=args.conflict_policy)
+        for line_number, error in report['errors']:
+            print("Zeile " + str(line_number) + ": " + error)
+        print(str(report['imported']) + " Einstellungen importiert, " + str(report['skipped']) + " übersprungen, " +
+              str(report['invalid']) + " fehlerhaft.")
+    if args.export_settings:
+        count = settings_manager.export_settings(args.export_settings)
+        print(str(count) + " Einstellungen exportiert.")
+    if args.search:
+        for found_setting in settings_manager.search(args.search):
+            line = found_setting.get_domain()
+            if found_setting.has_username():
+                line += " (" + found_setting.get_username() + ")"
+            if found_setting.get_url():
+                line += " " + found_setting.get_url()
+            print(line)
+    if args.import_settings or args.export_settings or args.search:
+        sys.exit(0)
+    if args.serve is not None or args.serve_socket:
+        from PasswordService import PasswordService, PasswordHTTPServer, PasswordUnixServer
+        service = PasswordService(settings_manager, master_password)
+        if args.serve_socket:
+            try:
+                server = PasswordUnixServer(service, args.serve_socket)
+            except FileExistsError:
+                service.shutdown()
+                print(args.serve_socket + " existiert bereits und ist kein Socket.")
+                sys.exit(1)
+            print("Warte auf Anfragen an " + args.serve_socket + " ...")
+        else:
+            server = PasswordHTTPServer(service, args.serve)
+            print("Warte auf Anfragen an http://127.0.0.1:" + str(server.server_address[1]) + "/ ...")
+            print("Authorization: Bearer " + server.token)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        service.shutdown()
+        sys.exit(0)
     if args.domain:
         domain = args.domain
     else:
@@ -43,7 +88,19 @@ if __name__ == "__main__":
         print('Bitte gib eine Domain an, für die das Passwort generiert werden soll.')
         domain = input('Domain: ')
     setting_found = False
-    if domain in [dom[:len(domain)] for dom in settings_manager.get_domain_list()]:
+    url = None
+    if domain not in settings_manager.get_domain_list():
+        for found_setting in settings_manager.find_settings_by_url(domain):
+            print("Für die Domain '" + found_setting.get_domain() + "' wurden Einstellungen gefunden.")
+            answer = input("Sollen sie geladen werden [J/n]? ")
+            if answer not in ["n", "N", "Nein", "nein", "NEIN", "NO", "No", "no", "nay", "not", "Not", "NOT"]:
+                domain = found_setting.get_domain()
+                setting_found = True
+                break
+        if not setting_found and '://' in domain:
+            url = domain
+            domain = extract_top_domain(url)
+    if not setting_found and domain in [dom[:len(domain)] for dom in settings_manager.get_domain_list()]:
         if domain in settings_manager.get_domain_list():
             setting_found = True
             if not args.quiet:
@@ -58,27 +115,91 @@ if __name__ == "__main__":
                         setting_found = True
     setting = settings_manager.get_setting(domain)
     if not setting_found:
+        if url:
+            setting.set_url(url)
         setting.ask_for_input()
     if setting_found and setting.has_username() and not args.quiet:
         print("Benutzername: " + setting.get_username())
     settings_manager.set_setting(setting)
     settings_manager.store_settings(master_password)
+    if settings_manager.tombstone_report['collected'] > 0 and not args.quiet:
+        print(str(settings_manager.tombstone_report['collected']) + " gelöschte Einstellungen wurden aus den " +
+              "Sync-Daten entfernt (" + str(settings_manager.tombstone_report['bytes_saved']) + " Bytes gespart).")
     if setting_found and setting.has_legacy_password():
         if args.quiet:
             print(setting.get_legacy_password())
         else:
             print("klassisches Passwort: " + setting.get_legacy_password())
     else:
-        sesam = CtSesam()
-        sesam.set_password_character_set(setting.get_character_set())
-        sesam.set_salt(setting.get_salt())
-        password = sesam.generate(
-            master_password,
-            setting.get_domain(),
-            setting.get_username(),
-            setting.get_length(),
-            setting.get_iterations())
+        password = settings_manager.generate_password(master_password, setting)
         if args.quiet:
             print(password)
         else:
             print('Passwort: ' + password)
+
+
+def main(argv=None):
+    """
+    Entry point of the command line program. Sync requests which did not answer in time are waited for at most
+    SHUTDOWN_TIMEOUT seconds before the program exits (see SyncManager.shutdown).
+
+    :param [str] argv: the command line arguments. Defaults to sys.argv.
+    """
+    parser = argparse.ArgumentParser(description="Generate domain passwords from your masterpassword.")
+    parser.add_argument('-n', '--no-sync',
+                        action='store_const', const=True,
+                        help="Do not synchronize with a server.")
+    parser.add_argument('-u', '--update-sync-settings',
+                        action='store_const', const=True,
+                        help="Ask for server settings before synchronization.")
+    parser.add_argument('--add-backup-sync-server',
+                        action='store_const', const=True,
+                        help="Ask for the settings of a backup server which gets the same data as the sync server.")
+    parser.add_argument('--master-password', help="If not specified it will be prompted.")
+    parser.add_argument('-d', '--domain', help="A domain or an url. If not specified it will be prompted.")
+    parser.add_argument('-q', '--quiet',
+                        action='store_const', const=True,
+                        help="Display only prompts (if necessary) and the plain password")
+    parser.add_argument('-c', '--password-cache',
+                        action='store_const', const=True,
+                        help="Cache passwords of settings with a high iteration count in an encrypted file.")
+    parser.add_argument('-s', '--search', metavar='QUERY',
+                        help="Search domains, usernames, urls and notes of the saved settings and exit.")
+    parser.add_argument('--serve', metavar='PORT', type=int,
+                        help="Answer password requests of local programs via HTTP on this port.")
+    parser.add_argument('--serve-socket', metavar='FILE',
+                        help="Answer password requests of local programs via HTTP on this unix socket.")
+    parser.add_argument('--import-settings', metavar='FILE',
+                        help="Import settings from a CSV or JSON Lines (.jsonl) file and exit.")
+    parser.add_argument('--export-settings', metavar='FILE',
+                        help="Export all settings unencrypted to a CSV or JSON Lines (.jsonl) file and exit.")
+    parser.add_argument('--conflict-policy',
+                        choices=[CONFLICT_KEEP_NEWER, CONFLICT_OVERWRITE, CONFLICT_SKIP], default=CONFLICT_KEEP_NEWER,
+                        help="What to do if an imported domain already exists. Default: " + CONFLICT_KEEP_NEWER)
+    parser.add_argument('--kdf', choices=[KDF_PBKDF2, KDF_SCRYPT],
+                        help="Key derivation function for the settings file. It is used from the next save on. " +
+                             "Default: the one of the settings file")
+    parser.add_argument('--kdf-cost', metavar='N', type=int,
+                        help="Iterations of PBKDF2 (default 32768) or the cost parameter N of scrypt " +
+                             "(default 16384). Without --kdf it applies to the key derivation function of the " +
+                             "settings file.")
+    args = parser.parse_args(argv)
+    kdf = None
+    if args.kdf:
+        try:
+            kdf = create_kdf(args.kdf, args.kdf_cost)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.master_password:
+        master_password = args.master_password
+    else:
+        master_password = getpass.getpass(prompt='Masterpasswort: ')
+    settings_manager = PasswordSettingsManager(kdf=kdf)
+    try:
+        run(parser, args, settings_manager, master_password)
+    finally:
+        settings_manager.sync_manager.shutdown(SHUTDOWN_TIMEOUT)
+
+
+if __name__ == "__main__":
+    main()
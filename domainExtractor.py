@@ -1,10 +1,115 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 """
-Functions for extracting domains.
+Functions for extracting domains. The registrable domain is determined with the rules of the public suffix list.
+An unchanged snapshot of the list is bundled as public_suffix_list.dat so no network access is needed. Its version
+is noted in the header of the file. To refresh it replace the file with the current
+https://publicsuffix.org/list/public_suffix_list.dat.
 """
 
+import os
 import re
+from functools import lru_cache
+
+PUBLIC_SUFFIX_LIST_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'public_suffix_list.dat')
+HOST_CACHE_SIZE = 65536
+_URL_PATTERN = re.compile(r"(?:[A-Za-z][A-Za-z0-9+.\-]*://)?(?:[^@/?#\s]*@)?(\[[^\]/?#]*\]|[^:/?#\s]*)")
+_IPV4_PATTERN = re.compile(r"\d{1,3}(?:\.\d{1,3}){3}")
+_RULE = 1
+_EXCEPTION = 2
+_suffix_trie = None
+
+
+def load_public_suffix_list(filename=PUBLIC_SUFFIX_LIST_FILE):
+    """
+    Loads the rules of a public suffix list file into the lookup trie. Call this if you want to use a more recent
+    copy of the list than the bundled snapshot.
+
+    :param str filename: a file in the format of https://publicsuffix.org/list/public_suffix_list.dat
+    """
+    global _suffix_trie
+    trie = [{}, 0]
+    with open(filename, 'r', encoding='utf-8') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) < 1 or parts[0].startswith('//'):
+                continue
+            rule = parts[0]
+            kind = _RULE
+            if rule.startswith('!'):
+                kind = _EXCEPTION
+                rule = rule[1:]
+            node = trie
+            for label in reversed(rule.lower().split('.')):
+                node = node[0].setdefault(label, [{}, 0])
+            node[1] = kind
+    _suffix_trie = trie
+    _split_host.cache_clear()
+
+
+def _public_suffix_length(labels):
+    """
+    Returns the number of labels of the public suffix of a host. Hosts with an unknown top level domain have a
+    suffix of one label ("*" is the default rule).
+
+    :param labels: the labels of the host in reversed order
+    :type labels: [str]
+    :return: number of labels
+    :rtype: int
+    """
+    if _suffix_trie is None:
+        load_public_suffix_list()
+    suffix_length = 1
+    node = _suffix_trie
+    for depth, label in enumerate(labels, start=1):
+        child = node[0].get(label)
+        if child is None:
+            child = node[0].get('*')
+            if child is None:
+                break
+        if child[1] == _EXCEPTION:
+            return depth - 1
+        if child[1] == _RULE:
+            suffix_length = depth
+        node = child
+    return suffix_length
+
+
+@lru_cache(maxsize=HOST_CACHE_SIZE)
+def _split_host(host):
+    """
+    Determines the registrable domain of a host name. The results are cached because the same hosts appear over and
+    over again in lists of urls.
+
+    :param str host: the host part of an url
+    :return: the host without a trailing dot in its original case and the registrable domain in lower case
+    :rtype: (str, str)
+    """
+    host = host.rstrip('.')
+    normalized_host = host.lower()
+    if host.startswith('[') or _IPV4_PATTERN.fullmatch(host):
+        return host, normalized_host
+    labels = normalized_host.split('.')
+    labels.reverse()
+    registrable_length = _public_suffix_length(labels) + 1
+    if len(labels) <= registrable_length:
+        return host, normalized_host
+    return host, '.'.join(reversed(labels[:registrable_length]))
+
+
+def _extract_host(url):
+    """
+    Returns the host of an url or None if the url does not contain a domain name.
+
+    :param str url: Url with or without protocol
+    :return: the host
+    :rtype: str
+    """
+    host = _URL_PATTERN.match(url).group(1)
+    if '.' in host.strip('.') or host.startswith('['):
+        return host
+    else:
+        return None
 
 
 def extract_top_domain(url):
@@ -16,30 +121,49 @@ def extract_top_domain(url):
     :return: domain name without protocol, subdomains or path
     :rtype: str
     """
-    pattern = re.compile("(?:https?://)?(\w+\.)+(co\.\w+).*")
-    matches = pattern.match(url)
-    if matches and len(matches.groups()) >= 2:
-        return matches.group(len(matches.groups()) - 1) + matches.group(len(matches.groups()))
-    pattern = re.compile("(?:https?://)?(\w+\.)+(\w+).*")
-    matches = pattern.match(url)
-    if matches and len(matches.groups()) >= 2:
-        return matches.group(len(matches.groups()) - 1) + matches.group(len(matches.groups()))
+    host = _extract_host(url)
+    if host:
+        return _split_host(host)[1]
     else:
         return url
 
 
 def extract_full_domain(url):
     """
-    Extracts the domain from an url
+    Extracts the domain from an url. The case of the domain is kept.
 
     :param url: Url with https:// and /some/path
     :type url: str
     :return: domain name without protocol or path
     :rtype: str
     """
-    pattern = re.compile("(?:https?://)?((?:\w+\.)*)(\w+).*")
-    matches = pattern.match(url)
-    if matches and len(matches.groups()) >= 2:
-        return "".join(matches.groups())
+    host = _extract_host(url)
+    if host:
+        return _split_host(host)[0]
     else:
         return url
+
+
+def extract_domains(urls, full_domain=False):
+    """
+    Extracts the domains from many urls at once, for example from an exported browser history. This does the same
+    as calling extract_top_domain (or extract_full_domain) for every url but avoids the overhead per call.
+
+    :param urls: iterable of urls
+    :type urls: [str]
+    :param bool full_domain: keep subdomains?
+    :return: list of domains in the order of the urls
+    :rtype: [str]
+    """
+    index = 0 if full_domain else 1
+    match = _URL_PATTERN.match
+    split_host = _split_host
+    domains = []
+    append = domains.append
+    for url in urls:
+        host = match(url).group(1)
+        if '.' in host.strip('.') or host.startswith('['):
+            append(split_host(host)[index])
+        else:
+            append(url)
+    return domains
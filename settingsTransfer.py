@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Streaming import and export of password settings as CSV or JSON Lines. The readers and writers handle one record at a
+time so memory usage does not depend on the size of the file.
+"""
+
+import csv
+import json
+import binascii
+from base64 import b64decode
+from datetime import datetime
+
+FORMAT_CSV = 'csv'
+FORMAT_JSON_LINES = 'jsonl'
+CSV_FIELDS = ['domain', 'url', 'username', 'legacyPassword', 'notes', 'iterations', 'salt', 'length',
+              'cDate', 'mDate', 'usedCharacters', 'reserved']
+INTEGER_FIELDS = ['iterations', 'length']
+DATE_FIELDS = ['cDate', 'mDate']
+
+
+def guess_format(filename):
+    """
+    Guesses the file format from the extension of the filename. Everything which does not end with .csv is treated
+    as JSON Lines.
+
+    :param str filename: name of the file
+    :return: FORMAT_CSV or FORMAT_JSON_LINES
+    :rtype: str
+    """
+    if filename.lower().endswith('.csv'):
+        return FORMAT_CSV
+    else:
+        return FORMAT_JSON_LINES
+
+
+def validate_setting_dict(data_set):
+    """
+    Checks a raw record and converts it to the dict format PasswordSetting.load_from_dict expects. Empty fields are
+    dropped so the defaults of PasswordSetting apply.
+
+    :param dict data_set: a raw record from a CSV or JSON Lines file
+    :return: the cleaned record
+    :rtype: dict
+    :raises ValueError: if the record is not a valid setting
+    """
+    if type(data_set) != dict:
+        raise ValueError("The record is not an object.")
+    cleaned = {}
+    for key in CSV_FIELDS:
+        if key in data_set and data_set[key] is not None and data_set[key] != '':
+            cleaned[key] = data_set[key]
+    if 'domain' not in cleaned or type(cleaned['domain']) != str:
+        raise ValueError("The record has no domain.")
+    for key in INTEGER_FIELDS:
+        if key in cleaned:
+            value = cleaned[key]
+            if type(value) == bool or (type(value) == float and not value.is_integer()):
+                raise ValueError("The field " + key + " is not an integer.")
+            try:
+                cleaned[key] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError("The field " + key + " is not an integer.")
+            if cleaned[key] <= 0:
+                raise ValueError("The field " + key + " has to be positive.")
+    for key in DATE_FIELDS:
+        if key in cleaned:
+            try:
+                datetime.strptime(cleaned[key], "%Y-%m-%dT%H:%M:%S")
+            except (TypeError, ValueError):
+                raise ValueError("The field " + key + " is not a date of the format YYYY-MM-DDTHH:MM:SS.")
+    if 'salt' in cleaned:
+        try:
+            b64decode(cleaned['salt'], validate=True)
+        except (TypeError, ValueError, binascii.Error):
+            raise ValueError("The salt is not base64 encoded.")
+    for key in cleaned.keys():
+        if key not in INTEGER_FIELDS:
+            if type(cleaned[key]) != str:
+                raise ValueError("The field " + key + " is not a string.")
+            try:
+                cleaned[key].encode('utf-8')
+            except UnicodeEncodeError:
+                raise ValueError("The field " + key + " is not valid UTF-8.")
+    return cleaned
+
+
+def read_settings(file, file_format):
+    """
+    Reads records from an open text file. This is a generator which yields tuples of the line number, the validated
+    record and an error message. If the record is invalid the record is None and the error message is set.
+
+    Open the file with errors='surrogateescape' so records with bytes which are not valid in the encoding are
+    reported as invalid like any other broken record. If a strict decoder fails an error is yielded for the line
+    where decoding failed and the rest of the file is skipped because the decoder can not resume there.
+
+    :param file: a file object opened in text mode
+    :param str file_format: FORMAT_CSV or FORMAT_JSON_LINES
+    :return: generator of (line number, record, error message)
+    """
+    if file_format == FORMAT_CSV:
+        reader = csv.DictReader(file)
+        while True:
+            try:
+                data_set = next(reader)
+            except StopIteration:
+                return
+            except UnicodeDecodeError as error:
+                yield reader.line_num + 1, None, "The file is not encoded correctly: " + str(error)
+                return
+            try:
+                yield reader.line_num, validate_setting_dict(data_set), None
+            except ValueError as error:
+                yield reader.line_num, None, str(error)
+    elif file_format == FORMAT_JSON_LINES:
+        line_number = 0
+        while True:
+            try:
+                line = file.readline()
+            except UnicodeDecodeError as error:
+                yield line_number + 1, None, "The file is not encoded correctly: " + str(error)
+                return
+            if len(line) < 1:
+                return
+            line_number += 1
+            if len(line.strip()) < 1:
+                continue
+            try:
+                yield line_number, validate_setting_dict(json.loads(line)), None
+            except ValueError as error:
+                yield line_number, None, str(error)
+    else:
+        raise ValueError("Unknown file format: " + str(file_format))
+
+
+def write_settings(file, settings, file_format):
+    """
+    Writes the dicts of the given settings one at a time to an open text file.
+
+    :param file: a file object opened in text mode
+    :param settings: iterable of PasswordSetting objects
+    :param str file_format: FORMAT_CSV or FORMAT_JSON_LINES
+    :return: number of written records
+    :rtype: int
+    """
+    count = 0
+    if file_format == FORMAT_CSV:
+        writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for setting in settings:
+            writer.writerow(setting.to_dict())
+            count += 1
+    elif file_format == FORMAT_JSON_LINES:
+        for setting in settings:
+            file.write(json.dumps(setting.to_dict()) + "\n")
+            count += 1
+    else:
+        raise ValueError("Unknown file format: " + str(file_format))
+    return count
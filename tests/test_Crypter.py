@@ -1,8 +1,10 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import os
+import hashlib
 import unittest
-from Crypter import Crypter
+from Crypter import Crypter, get_available_backends, get_backend, create_kdf, check_kdf, KDF_PBKDF2, KDF_SCRYPT
 from base64 import b64encode, b64decode
 
 
@@ -33,5 +35,32 @@ class TestCrypter(unittest.TestCase):
                          b'be encrypted. This long message insures that more than one block is needed.',
                          crypter.decrypt(b64decode(ciphertext)))
 
+    def test_backends_are_identical(self):
+        backends = get_available_backends()
+        self.assertGreater(len(backends), 0)
+        self.assertEqual(backends[0], get_backend().name)
+        crypters = [Crypter(b'pepper', 'secret', backend=backend) for backend in backends]
+        for length in [0, 1, 15, 16, 17, 1000, 1024 * 1024]:
+            message = os.urandom(length)
+            ciphertexts = [crypter.encrypt(message) for crypter in crypters]
+            self.assertEqual(1, len(set(ciphertexts)))
+            for crypter in crypters:
+                self.assertEqual(message, crypter.decrypt(ciphertexts[0]))
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, get_backend, 'rot13')
+
+    def test_kdf(self):
+        crypter = Crypter(b'pepper', 'secret', kdf=create_kdf(KDF_SCRYPT, 1024))
+        self.assertEqual(hashlib.scrypt(b'secret', salt=b'pepper', n=1024, r=8, p=1, dklen=32), crypter.key)
+        self.assertEqual(b'message', crypter.decrypt(crypter.encrypt(b'message')))
+        crypter = Crypter(b'pepper', 'secret', kdf=create_kdf(KDF_PBKDF2, 1000))
+        self.assertEqual(hashlib.pbkdf2_hmac('sha512', b'secret', b'pepper', 1000)[:32], crypter.key)
+        self.assertRaises(ValueError, create_kdf, KDF_SCRYPT, 1000)
+        self.assertRaises(ValueError, create_kdf, KDF_PBKDF2, 0)
+        self.assertRaises(ValueError, check_kdf, {'algorithm': KDF_PBKDF2, 'hash': 'md5', 'iterations': 1000})
+        self.assertRaises(ValueError, check_kdf, None)
+
+
 if __name__ == '__main__':
     unittest.main()
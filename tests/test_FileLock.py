@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import sys
+import tempfile
+import threading
+import subprocess
+from FileLock import FileLock, write_file_atomically
+
+INCREMENT_SCRIPT = """
+import sys
+from FileLock import FileLock, write_file_atomically
+counter_file = sys.argv[1]
+lock = FileLock(counter_file + '.lock')
+for i in range(int(sys.argv[2])):
+    with lock:
+        with open(counter_file, 'rb') as file:
+            value = int(file.read())
+        write_file_atomically(counter_file, str(value + 1).encode('utf-8'))
+"""
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.counter_file = os.path.join(self.directory.name, 'counter')
+        write_file_atomically(self.counter_file, b'0')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_counter(self):
+        with open(self.counter_file, 'rb') as file:
+            return int(file.read())
+
+    def test_write_file_atomically(self):
+        write_file_atomically(self.counter_file, b'42')
+        self.assertEqual(42, self.read_counter())
+        self.assertEqual(['counter'], os.listdir(self.directory.name))
+
+    def test_lock_excludes_threads(self):
+        def increment():
+            lock = FileLock(self.counter_file + '.lock')
+            for i in range(50):
+                with lock:
+                    value = self.read_counter()
+                    write_file_atomically(self.counter_file, str(value + 1).encode('utf-8'))
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(400, self.read_counter())
+
+    def test_lock_excludes_processes(self):
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        processes = [subprocess.Popen([sys.executable, '-c', INCREMENT_SCRIPT, self.counter_file, '50'],
+                                      env=environment) for _ in range(6)]
+        for process in processes:
+            self.assertEqual(0, process.wait())
+        self.assertEqual(300, self.read_counter())
+        self.assertEqual(['counter', 'counter.lock'], sorted(os.listdir(self.directory.name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import asyncio
+import time
+import hashlib
+import threading
+from KdfExecutor import KdfExecutor, pbkdf2_hmac, apbkdf2_hmac, get_default_executor, set_default_executor, \
+    INTERACTIVE, SYNC, BATCH
+
+
+class TestKdfExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = KdfExecutor(workers=1)
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.order = []
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def block(self):
+        self.started.set()
+        return self.release.wait(5)
+
+    def record(self, name):
+        self.order.append(name)
+        return name
+
+    def test_priorities(self):
+        blocker = self.executor.submit(BATCH, self.block)
+        self.started.wait(5)
+        jobs = [self.executor.submit(BATCH, self.record, 'batch 1'),
+                self.executor.submit(BATCH, self.record, 'batch 2'),
+                self.executor.submit(SYNC, self.record, 'sync'),
+                self.executor.submit(INTERACTIVE, self.record, 'interactive')]
+        self.assertEqual({INTERACTIVE: 1, SYNC: 1, BATCH: 2}, self.executor.get_queue_lengths())
+        self.release.set()
+        self.assertTrue(blocker.result(5))
+        for job in jobs:
+            job.result(5)
+        self.assertEqual(['interactive', 'sync', 'batch 1', 'batch 2'], self.order)
+        self.assertGreaterEqual(jobs[0].wait_time, blocker.run_time)
+        self.assertEqual(3, self.executor.statistics[BATCH]['jobs'])
+        self.assertEqual(1, self.executor.statistics[INTERACTIVE]['jobs'])
+
+    def test_aging(self):
+        executor = KdfExecutor(workers=1, max_waits={SYNC: None, BATCH: 0.05})
+        try:
+            executor.submit(INTERACTIVE, self.block)
+            self.started.wait(5)
+            jobs = [executor.submit(SYNC, self.record, 'sync'), executor.submit(BATCH, self.record, 'batch')]
+            time.sleep(0.1)
+            jobs += [executor.submit(INTERACTIVE, self.record, 'interactive {}'.format(i)) for i in range(3)]
+            self.release.set()
+            for job in jobs:
+                job.result(5)
+            self.assertEqual(['batch', 'interactive 0', 'interactive 1', 'interactive 2', 'sync'], self.order)
+        finally:
+            executor.shutdown()
+
+    def test_batch_limit(self):
+        executor = KdfExecutor(workers=2)
+        try:
+            blocker = executor.submit(BATCH, self.block)
+            self.started.wait(5)
+            waiting = executor.submit(BATCH, self.record, 'batch')
+            self.assertEqual('interactive', executor.submit(INTERACTIVE, self.record, 'interactive').result(5))
+            self.assertFalse(waiting.done())
+            self.release.set()
+            self.assertEqual('batch', waiting.result(5))
+            self.assertTrue(blocker.result(5))
+        finally:
+            executor.shutdown()
+
+    def test_cancel(self):
+        self.executor.submit(BATCH, self.block)
+        self.started.wait(5)
+        job = self.executor.submit(INTERACTIVE, self.record, 'cancelled')
+        self.assertTrue(job.cancel())
+        self.release.set()
+        self.assertEqual('done', self.executor.submit(INTERACTIVE, self.record, 'done').result(5))
+        self.assertTrue(job.cancelled())
+        self.assertEqual(['done'], self.order)
+        self.assertEqual(1, self.executor.statistics[INTERACTIVE]['cancelled'])
+
+    def test_exception(self):
+        job = self.executor.submit(SYNC, int, 'no number')
+        self.assertRaises(ValueError, job.result, 5)
+        self.assertIsNotNone(job.run_time)
+        self.assertRaises(ValueError, self.executor.submit, 7, int, '1')
+
+    def test_pbkdf2_hmac(self):
+        self.assertEqual(hashlib.pbkdf2_hmac('sha512', b'secret', b'pepper', 1000),
+                         pbkdf2_hmac('sha512', b'secret', b'pepper', 1000, priority=BATCH))
+        self.assertEqual(hashlib.pbkdf2_hmac('sha256', b'secret', b'pepper', 1000, 16),
+                         pbkdf2_hmac('sha256', b'secret', b'pepper', 1000, 16))
+
+    def test_apbkdf2_hmac(self):
+        async def derive_keys():
+            return await asyncio.gather(*[apbkdf2_hmac('sha512', b'secret', salt, 1000) for salt in [b'a', b'b']])
+
+        set_default_executor(self.executor)
+        try:
+            self.assertIs(self.executor, get_default_executor())
+            self.assertEqual([hashlib.pbkdf2_hmac('sha512', b'secret', b'a', 1000),
+                              hashlib.pbkdf2_hmac('sha512', b'secret', b'b', 1000)], asyncio.run(derive_keys()))
+        finally:
+            set_default_executor(None)
+        self.assertTrue(self.executor.stopped)
+        self.assertEqual(hashlib.pbkdf2_hmac('sha256', b'secret', b'pepper', 1000),
+                         pbkdf2_hmac('sha256', b'secret', b'pepper', 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
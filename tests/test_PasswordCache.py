@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import time
+import tempfile
+from unittest import mock
+from PasswordCache import PasswordCache
+from PasswordSetting import PasswordSetting
+from Crypter import Crypter
+
+SALT = b'\x01' * 32
+KEY = b'\x02' * 32
+
+
+class TestPasswordCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, 'cache')
+        self.setting = PasswordSetting('unit.test')
+        self.setting.set_iterations(200000)
+
+    def create_cache(self, salt=SALT, key=KEY, **kwargs):
+        cache = PasswordCache(self.cache_file, **kwargs)
+        cache.set_vault_key(salt, key)
+        return cache
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_and_get(self):
+        cache = self.create_cache()
+        self.assertIsNone(cache.get('xyz', self.setting))
+        cache.put('xyz', self.setting, 'K6x/vyG9(p')
+        self.assertEqual('K6x/vyG9(p', cache.get('xyz', self.setting))
+        with mock.patch.object(Crypter, 'derive_key', side_effect=AssertionError("no key derivation")):
+            cache.save()
+            with open(self.cache_file, 'br') as file:
+                self.assertNotIn(b'K6x/vyG9(p', file.read())
+            cache = self.create_cache()
+            self.assertEqual('K6x/vyG9(p', cache.get('xyz', self.setting))
+        self.assertIsNone(cache.get('wrong', self.setting))
+        self.assertIsNone(self.create_cache(key=b'\x03' * 32).get('xyz', self.setting))
+        self.assertIsNone(self.create_cache(salt=b'\x03' * 32).get('xyz', self.setting))
+        cache = PasswordCache(self.cache_file)
+        self.assertIsNone(cache.get('xyz', self.setting))
+        cache.put('xyz', self.setting, 'Hsk9$8a')
+        self.assertIsNone(cache.entries)
+
+    def test_other_masterpassword(self):
+        cache = self.create_cache()
+        cache.put('xyz', self.setting, 'K6x/vyG9(p')
+        cache.put('other', PasswordSetting('other.test'), 'Hsk9$8a')
+        self.assertIsNone(cache.get('xyz', self.setting))
+        self.assertEqual('Hsk9$8a', cache.get('other', PasswordSetting('other.test')))
+
+    def test_new_vault_key(self):
+        cache = self.create_cache()
+        cache.put('xyz', self.setting, 'K6x/vyG9(p')
+        cache.save()
+        cache = self.create_cache()
+        cache.set_vault_key(b'\x03' * 32, b'\x04' * 32)
+        cache.save()
+        self.assertIsNone(self.create_cache().get('xyz', self.setting))
+        self.assertEqual('K6x/vyG9(p', self.create_cache(b'\x03' * 32, b'\x04' * 32).get('xyz', self.setting))
+
+    def test_interrupted_save_keeps_file(self):
+        cache = self.create_cache()
+        cache.put('xyz', self.setting, 'K6x/vyG9(p')
+        cache.save()
+        cache.put('xyz', PasswordSetting('other.test'), 'Hsk9$8a')
+        with mock.patch('os.fsync', side_effect=OSError("disk full")):
+            self.assertRaises(OSError, cache.save)
+        self.assertEqual(['cache'], os.listdir(self.directory.name))
+        cache = self.create_cache()
+        self.assertEqual('K6x/vyG9(p', cache.get('xyz', self.setting))
+
+    def test_invalidation(self):
+        cache = self.create_cache()
+        cache.put('xyz', self.setting, 'K6x/vyG9(p')
+        for change in [lambda s: s.set_username('Hugo'), lambda s: s.set_salt(b'salt'),
+                       lambda s: s.set_iterations(200001), lambda s: s.set_length(11),
+                       lambda s: s.set_use_extra(False)]:
+            setting = PasswordSetting('unit.test')
+            setting.load_from_dict(self.setting.to_dict())
+            change(setting)
+            cache.put('xyz', self.setting, 'K6x/vyG9(p')
+            self.assertIsNone(cache.get('xyz', setting))
+            self.assertIsNone(cache.get('xyz', self.setting))
+
+    def test_limits(self):
+        cache = self.create_cache(max_entries=2, max_age=60)
+        for domain in ['a.com', 'b.com', 'c.com']:
+            setting = PasswordSetting(domain)
+            cache.put('xyz', setting, domain)
+            time.sleep(0.01)
+        self.assertEqual(['b.com', 'c.com'], sorted(cache.entries.keys()))
+        cache.entries['b.com']['created'] -= 61
+        self.assertIsNone(cache.get('xyz', PasswordSetting('b.com')))
+        self.assertEqual('c.com', cache.get('xyz', PasswordSetting('c.com')))
+
+    def test_is_cacheable(self):
+        cache = PasswordCache(self.cache_file, min_iterations=100000)
+        self.assertTrue(cache.is_cacheable(self.setting))
+        self.assertFalse(cache.is_cacheable(PasswordSetting('unit.test')))
+        self.setting.set_legacy_password('K6x/vyG9(p')
+        self.assertFalse(cache.is_cacheable(self.setting))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,11 @@
 Test for CtSESAM class.
 """
 import unittest
-from PasswordGenerator import CtSesam
+import asyncio
+import os
+import sys
+from unittest import mock
+from PasswordGenerator import CtSesam, is_numpy_installed
 
 
 class TestCtSesam(unittest.TestCase):
@@ -24,3 +28,42 @@ class TestCtSesam(unittest.TestCase):
     def test_long(self):
         manager = CtSesam()
         self.assertEqual("5#%KiUvEE7}t<d:Y=Lzn;dKzaG0qU/t)", manager.generate('foo', 'some.domain', length=32))
+
+    def test_agenerate(self):
+        manager = CtSesam()
+        self.assertEqual("5#%KiUvEE7}t<d:Y=Lzn;dKzaG0qU/t)",
+                         asyncio.run(manager.agenerate('foo', 'some.domain', length=32)))
+
+    def check_bulk_conversion(self, use_numpy):
+        manager = CtSesam()
+        for characters in ['ab', 'abc', manager.password_characters, ''.join(chr(0x100 + i) for i in range(300))]:
+            manager.set_password_character_set(characters)
+            for digest_size in [1, 7, 64]:
+                data = bytes(digest_size) + bytes(digest_size - 1) + b'\x05' + os.urandom(100 * digest_size)
+                for length in [1, 10, 33]:
+                    self.assertEqual([manager.convert_bytes_to_password(data[start:start + digest_size], length)
+                                      for start in range(0, len(data), digest_size)],
+                                     manager.convert_bytes_to_passwords(data, length, digest_size, use_numpy))
+
+    def test_convert_bytes_to_passwords(self):
+        self.check_bulk_conversion(False)
+        manager = CtSesam()
+        self.assertEqual([], manager.convert_bytes_to_passwords(b'', 10))
+        self.assertRaises(ValueError, manager.convert_bytes_to_passwords, os.urandom(65), 10)
+        passwords = manager.generate_random_passwords(1000, 12)
+        self.assertEqual(1000, len(set(passwords)))
+        for password in passwords:
+            self.assertEqual(12, len(password))
+            self.assertTrue(set(password) <= set(manager.password_characters))
+
+    @unittest.skipIf(not is_numpy_installed(), "NumPy is not installed.")
+    def test_convert_bytes_to_passwords_with_numpy(self):
+        self.check_bulk_conversion(True)
+
+    def test_convert_bytes_to_passwords_without_numpy(self):
+        manager = CtSesam()
+        data = os.urandom(640)
+        with mock.patch.dict(sys.modules, {'numpy': None}):
+            self.assertEqual(manager.convert_bytes_to_passwords(data, 10, use_numpy=False),
+                             manager.convert_bytes_to_passwords(data, 10))
+            self.assertRaises(ImportError, manager.convert_bytes_to_passwords, data, 10, use_numpy=True)
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import stat
+import json
+import socket
+import tempfile
+import threading
+import http.client
+import urllib.request
+import urllib.error
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from PasswordService import PasswordService, PasswordHTTPServer, PasswordUnixServer, ServiceOverloaded
+from PasswordSettingsManager import PasswordSettingsManager
+from PasswordSetting import PasswordSetting
+
+
+class TestPasswordService(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.manager = PasswordSettingsManager(os.path.join(self.directory.name, 'settings.pws'))
+        for domain in ['unit.test', 'some.domain', 'third.domain']:
+            setting = PasswordSetting(domain)
+            setting.set_url('https://login.' + domain + '/')
+            setting.set_iterations(2000)
+            if domain == 'third.domain':
+                setting.set_username('Hugo')
+            self.manager.set_setting(setting)
+        self.service = PasswordService(self.manager, 'xyz', workers=4, max_queue=8)
+        self.server = PasswordHTTPServer(self.service, token='secret')
+        self.url = 'http://127.0.0.1:' + str(self.server.server_address[1]) + '/'
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        self.service.shutdown()
+        self.directory.cleanup()
+
+    def post(self, action, request, token='secret'):
+        http_request = urllib.request.Request(self.url + action, data=json.dumps(request).encode('utf-8'),
+                                              headers={'Authorization': 'Bearer ' + token})
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                return response.status, json.loads(str(response.read(), encoding='utf-8'))
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(str(error.read(), encoding='utf-8'))
+
+    def test_generate(self):
+        status, answer = self.post('generate', {'url': 'https://login.third.domain/path'})
+        self.assertEqual(200, status)
+        self.assertEqual('third.domain', answer['result']['domain'])
+        self.assertEqual('Hugo', answer['result']['username'])
+        self.assertEqual(self.manager.generate_password('xyz', self.manager.get_setting('third.domain')),
+                         answer['result']['password'])
+
+    def test_lookup_and_update(self):
+        status, answer = self.post('lookup', {'domain': 'unit.test'})
+        self.assertEqual(200, status)
+        self.assertEqual(2000, answer['result'][0]['iterations'])
+        status, answer = self.post('update', {'setting': {'domain': 'unit.test', 'iterations': 3000}})
+        self.assertEqual(200, status)
+        self.assertEqual(3000, self.manager.get_setting('unit.test').get_iterations())
+        status, answer = self.post('update', {'setting': {'domain': 'unit.test', 'iterations': 'many'}})
+        self.assertEqual(400, status)
+        self.assertFalse(answer['status'])
+
+    def test_errors(self):
+        self.assertEqual(401, self.post('generate', {'domain': 'unit.test'}, token='wrong')[0])
+        self.assertEqual(404, self.post('delete', {'domain': 'unit.test'})[0])
+        self.assertEqual(400, self.post('generate', ['unit.test'])[0])
+        self.assertEqual(400, self.post('generate', {})[0])
+        self.assertEqual(400, self.post('generate', {'url': ['unit.test']})[0])
+        self.assertEqual(400, self.post('lookup', {'domain': 5})[0])
+        self.assertEqual(400, self.post('lookup', {'url': {'host': 'unit.test'}})[0])
+        with patch.object(self.service, 'generate', side_effect=KeyError('domain')):
+            status, answer = self.post('generate', {'domain': 'unit.test'})
+        self.assertEqual(500, status)
+        self.assertFalse(answer['status'])
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        connection.putrequest('POST', '/generate')
+        connection.putheader('Authorization', 'Bearer secret')
+        connection.putheader('Content-Length', 'many')
+        connection.endheaders()
+        response = connection.getresponse()
+        self.assertEqual(400, response.status)
+        self.assertFalse(json.loads(str(response.read(), encoding='utf-8'))['status'])
+        connection.close()
+
+    def test_generated_token(self):
+        servers = [PasswordHTTPServer(self.service), PasswordHTTPServer(self.service, token='')]
+        for server in servers:
+            server.server_close()
+            self.assertGreaterEqual(len(server.token), 32)
+        self.assertNotEqual(servers[0].token, servers[1].token)
+        self.assertEqual(401, self.post('generate', {'domain': 'unit.test'}, token='')[0])
+
+    def test_single_flight_and_admission(self):
+        release = threading.Event()
+        first = self.service.submit('key', release.wait)
+        self.assertIs(first, self.service.submit('key', release.wait))
+        for i in range(7):
+            self.service.submit(i, release.wait)
+        self.assertRaises(ServiceOverloaded, self.service.submit, 'another key', release.wait)
+        release.set()
+        self.service.executor.shutdown(wait=True)
+        self.assertEqual(0, len(self.service.in_flight))
+        self.assertEqual({'jobs': 8, 'coalesced': 1, 'rejected': 1}, self.service.statistics)
+
+    def test_load(self):
+        domains = ['unit.test', 'some.domain', 'third.domain']
+        expected = {domain: self.manager.generate_password('xyz', self.manager.get_setting(domain))
+                    for domain in domains}
+        requests = [domains[i % len(domains)] for i in range(60)]
+        generate_password = self.manager.generate_password
+        release = threading.Event()
+        submitted = threading.Semaphore(0)
+        submit = self.service.submit
+
+        def held_generate_password(*args):
+            release.wait()
+            return generate_password(*args)
+
+        def counted_submit(*args):
+            try:
+                return submit(*args)
+            finally:
+                submitted.release()
+
+        with patch.object(self.manager, 'generate_password', held_generate_password), \
+                patch.object(self.service, 'submit', counted_submit), \
+                ThreadPoolExecutor(max_workers=len(requests)) as executor:
+            answers = executor.map(lambda domain: self.post('generate', {'domain': domain}), requests)
+            for _ in requests:
+                self.assertTrue(submitted.acquire(timeout=30))
+            release.set()
+            answers = list(answers)
+        for domain, (status, answer) in zip(requests, answers):
+            self.assertEqual(200, status)
+            self.assertEqual(expected[domain], answer['result']['password'])
+        self.assertEqual({'jobs': 3, 'coalesced': len(requests) - 3, 'rejected': 0}, self.service.statistics)
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "Unix sockets are not available.")
+    def test_unix_socket(self):
+        socket_file = os.path.join(self.directory.name, 'service.sock')
+        server = PasswordUnixServer(self.service, socket_file)
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(socket_file).st_mode))
+        server.socket.close()
+        server = PasswordUnixServer(self.service, socket_file)
+        server.server_close()
+        self.assertFalse(os.path.exists(socket_file))
+        vault_file = os.path.join(self.directory.name, 'vault.pws')
+        with open(vault_file, 'w') as file:
+            file.write('secret')
+        self.assertRaises(FileExistsError, PasswordUnixServer, self.service, vault_file)
+        with open(vault_file) as file:
+            self.assertEqual('secret', file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
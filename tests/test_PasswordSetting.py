@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import unittest
-from PasswordSetting import PasswordSetting
+from PasswordSetting import PasswordSetting, CHARACTER_SETS, LOWER_CASE, UPPER_CASE, DIGITS, EXTRA
 import json
 from base64 import b64encode
 
@@ -47,6 +47,40 @@ class TestPasswordSetting(unittest.TestCase):
         s.set_use_extra(False)
         self.assertEqual("abcdefghijklmnopqrstuvwxyzABCDEFGHJKLMNPQRTUVWXYZ", s.get_character_set())
 
+    def test_character_classes(self):
+        s = PasswordSetting("unit.test")
+        self.assertEqual(LOWER_CASE | UPPER_CASE | DIGITS | EXTRA, s.get_character_classes())
+        s.set_use_upper_case(False)
+        self.assertFalse(s.use_upper_case())
+        self.assertTrue(s.use_lower_case())
+        self.assertEqual("abcdefghijklmnopqrstuvwxyz0123456789#!\"§$%&/()[]{}=-_+*<>;:.", s.get_character_set())
+        s.set_use_upper_case(True)
+        self.assertFalse(s.use_custom_character_set())
+        s.set_use_lower_case(False)
+        self.assertTrue(s.use_upper_case())
+        s.set_character_classes(DIGITS | LOWER_CASE)
+        self.assertEqual("abcdefghijklmnopqrstuvwxyz0123456789", s.get_character_set())
+        self.assertTrue(s.use_custom_character_set())
+
+    def test_character_classes_of_custom_set(self):
+        s = PasswordSetting("unit.test")
+        s.set_custom_character_set("xyz0123456789")
+        self.assertEqual(DIGITS, s.get_character_classes())
+        s.set_use_digits(False)
+        self.assertEqual("xyz", s.get_character_set())
+        s.set_use_upper_case(True)
+        self.assertEqual("xyzABCDEFGHJKLMNPQRTUVWXYZ", s.get_character_set())
+        s.set_use_lower_case(True)
+        self.assertEqual("abcdefghijklmnopqrstuvwxyzABCDEFGHJKLMNPQRTUVWXYZ", s.get_character_set())
+        self.assertFalse(s.use_digits())
+        self.assertTrue(s.use_letters())
+
+    def test_stored_character_sets_are_kept(self):
+        for character_set in CHARACTER_SETS + ["AEIOUaeiou", "0123456789abcdefghijklmnopqrstuvwxyz"]:
+            s = PasswordSetting("unit.test")
+            s.load_from_dict({"usedCharacters": character_set})
+            self.assertEqual(character_set, s.to_dict()["usedCharacters"])
+
     def test_get_character_set(self):
         s = PasswordSetting("unit.test")
         self.assertEqual("c", s.get_character_set()[2])
@@ -87,6 +121,15 @@ class TestPasswordSetting(unittest.TestCase):
         s.set_notes("Beware of the password!")
         self.assertEqual("Beware of the password!", s.get_notes())
 
+    def test_url(self):
+        s = PasswordSetting("unit.test")
+        self.assertEqual("", s.get_url())
+        s.set_synced(True)
+        s.set_url("https://www.unit.test/login")
+        self.assertEqual("https://www.unit.test/login", s.get_url())
+        self.assertFalse(s.is_synced())
+        self.assertEqual("https://www.unit.test/login", s.to_dict()["url"])
+
     def test_to_json(self):
         s = PasswordSetting("unit.test")
         s.set_modification_date("2005-01-01T01:14:12")
@@ -140,6 +183,37 @@ class TestPasswordSetting(unittest.TestCase):
         self.assertEquals("2001-01-01T02:14:12", s.get_creation_date())
         self.assertEquals("2005-01-01T01:14:12", s.get_modification_date())
 
+    def test_cached_serialization(self):
+        s = PasswordSetting("unit.test")
+        s.set_creation_date("2001-01-01T02:14:12")
+        s.set_modification_date("2005-01-01T01:14:12")
+        self.assertEqual(json.dumps(s.to_dict()), s.to_json())
+        self.assertIs(s.to_json(), s.to_json())
+        s.to_dict()["length"] = 3
+        self.assertEqual(10, s.to_dict()["length"])
+        fingerprint = s.get_fingerprint()
+        s.set_synced(True)
+        self.assertEqual(fingerprint, s.get_fingerprint())
+        for change in [lambda: s.set_length(12), lambda: s.set_url("example.com"), lambda: s.set_use_digits(False),
+                       lambda: s.set_salt(b"salt"), lambda: s.set_modification_date("2006-01-01T01:14:12")]:
+            json_str = s.to_json()
+            change()
+            self.assertNotEqual(json_str, s.to_json())
+            self.assertEqual(json.dumps(s.to_dict()), s.to_json())
+        self.assertNotEqual(fingerprint, s.get_fingerprint())
+
+    def test_state_hash(self):
+        s = PasswordSetting("unit.test")
+        copy = s.copy()
+        self.assertEqual(s.get_state_hash(), copy.get_state_hash())
+        copy.set_username("")
+        self.assertEqual(s.get_state_hash(), copy.get_state_hash())
+        copy.set_username("Hugo")
+        self.assertNotEqual(s.get_state_hash(), copy.get_state_hash())
+        copy = s.copy()
+        copy.set_synced(True)
+        self.assertNotEqual(s.get_state_hash(), copy.get_state_hash())
+
 
 if __name__ == '__main__':
     unittest.main()
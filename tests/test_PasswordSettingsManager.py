@@ -3,13 +3,23 @@
 
 import unittest
 import os
+import time
+import asyncio
 import json
 import struct
-from PasswordSettingsManager import PasswordSettingsManager
-from PasswordSetting import PasswordSetting
-from Crypter import Crypter
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+from PasswordSettingsManager import PasswordSettingsManager, CONFLICT_KEEP_NEWER, CONFLICT_OVERWRITE, CONFLICT_SKIP
+from PasswordSetting import PasswordSetting, LOWER_CASE, DIGITS
+from Crypter import Crypter, DEFAULT_KDF, KDF_PBKDF2, KDF_SCRYPT, create_kdf
+from VaultHeader import unpack_header
 from Packer import Packer
-from base64 import b64encode, b64decode
+from SyncMerge import get_blob_hash, get_fingerprint
+from FileLock import write_file_atomically
+from SettingsSnapshot import SettingsSnapshot
 
 
 class MockSyncManager(object):
@@ -55,25 +65,74 @@ class MockSyncManager(object):
         }
         salt = os.urandom(32)
         crypter = Crypter(salt, 'xyz')
-        return True, str(b64encode(b'\x00' + salt + crypter.encrypt(
-            Packer.compress(json.dumps(remote_data).encode('utf-8')))), encoding='utf-8')
+        return True, b'\x00' + salt + crypter.encrypt(Packer.compress(json.dumps(remote_data).encode('utf-8')))
+
+    def get_replica_data(self):
+        return []
+
+
+class MemorySyncManager(object):
+    """
+    A sync server which keeps the blob in memory and counts the pushes. Like SyncServer it rejects pushes with a
+    wrong expected hash.
+    """
+    def __init__(self):
+        self.data = b''
+        self.pushes = 0
+        self.reachable = True
+        self.push_conflict = False
+
+    def get_binary_sync_settings(self):
+        return b''
+
+    def has_deferred_sync_settings(self):
+        return False
+
+    def has_sync_settings(self):
+        return True
+
+    def pull(self):
+        return self.reachable, self.data if self.reachable else b''
+
+    def get_replica_data(self):
+        return []
+
+    def push(self, data, expected_hash=None):
+        self.push_conflict = False
+        if not self.reachable:
+            return False
+        if expected_hash is not None and expected_hash != get_blob_hash(self.data):
+            self.push_conflict = True
+            return False
+        self.data = data
+        self.pushes += 1
+        return True
+
+    async def apull(self):
+        await asyncio.sleep(0)
+        return self.pull()
+
+    async def apush(self, data, expected_hash=None):
+        await asyncio.sleep(0)
+        return self.push(data, expected_hash)
 
 
 class TestPasswordSettingsManager(unittest.TestCase):
     def setUp(self):
-        self.manager = PasswordSettingsManager(os.path.expanduser('~/.ctSESAM_test.pws'))
+        self.directory = tempfile.mkdtemp()
+        self.settings_file = os.path.join(self.directory, 'ctSESAM_test.pws')
+        self.manager = PasswordSettingsManager(self.settings_file)
 
     # noinspection PyUnresolvedReferences
     def tearDown(self):
-        file = os.path.expanduser('~/.ctSESAM_test.pws')
-        if os.path.isfile(file):
+        if os.path.isfile(self.settings_file):
             try:
                 import win32con
                 import win32api
-                win32api.SetFileAttributes(file, win32con.FILE_ATTRIBUTE_NORMAL)
+                win32api.SetFileAttributes(self.settings_file, win32con.FILE_ATTRIBUTE_NORMAL)
             except ImportError:
                 pass
-            os.remove(file)
+        shutil.rmtree(self.directory)
 
     def test_get_setting(self):
         setting = self.manager.get_setting('abc.de')
@@ -87,11 +146,13 @@ class TestPasswordSettingsManager(unittest.TestCase):
         new_setting.set_length(12)
         self.manager.set_setting(new_setting)
         self.manager.save_settings_to_file('xyz')
-        with open(os.path.expanduser('~/.ctSESAM_test.pws'), 'br') as f:
+        with open(self.settings_file, 'br') as f:
             data = f.read()
-        crypter = Crypter(data[:32], 'xyz')
-        sync_settings_len = struct.unpack('!I', data[32:36])[0]
-        data = json.loads(Packer.decompress(crypter.decrypt(data[36+sync_settings_len:])).decode('utf8'))
+        kdf, offset = unpack_header(data)
+        self.assertEqual(DEFAULT_KDF, kdf)
+        crypter = Crypter(data[offset:offset+32], 'xyz', kdf=kdf)
+        sync_settings_len = struct.unpack('!I', data[offset+32:offset+36])[0]
+        data = json.loads(Packer.decompress(crypter.decrypt(data[offset+36+sync_settings_len:])).decode('utf8'))
         self.assertEqual('abc.de', data['settings']['abc.de']['domain'])
         self.assertEqual(10, data['settings']['abc.de']['length'])
         self.assertEqual('hugo.com', data['settings']['hugo.com']['domain'])
@@ -120,7 +181,7 @@ class TestPasswordSettingsManager(unittest.TestCase):
         }
         salt = os.urandom(32)
         crypter = Crypter(salt, 'xyz')
-        f = open(os.path.expanduser('~/.ctSESAM_test.pws'), 'bw')
+        f = open(self.settings_file, 'bw')
         f.write(salt + struct.pack('!I', 0) + crypter.encrypt(Packer.compress(json.dumps(settings).encode('utf-8'))))
         f.close()
         self.manager.load_settings_from_file('xyz')
@@ -132,6 +193,46 @@ class TestPasswordSettingsManager(unittest.TestCase):
         self.assertEqual(4, self.manager.get_setting('some.domain').get_length())
         self.assertEqual('6478593021', self.manager.get_setting('some.domain').get_character_set())
 
+    def test_kdf_in_file_header(self):
+        filename = self.settings_file
+        salt = os.urandom(32)
+        crypter = Crypter(salt, 'xyz')
+        with open(filename, 'bw') as file:
+            file.write(salt + struct.pack('!I', 0) + crypter.encrypt(Packer.compress(json.dumps(
+                {'settings': {'unit.test': {'domain': 'unit.test', 'length': 11}}, 'synced': []}))))
+        self.manager.load_settings_from_file('xyz')
+        self.manager.save_settings_to_file('xyz')
+        with open(filename, 'br') as file:
+            self.assertEqual(DEFAULT_KDF, unpack_header(file.read())[0])
+        scrypt_kdf = create_kdf(KDF_SCRYPT, 1024)
+        manager = PasswordSettingsManager(filename, kdf=scrypt_kdf)
+        manager.load_settings_from_file('xyz')
+        manager.get_setting('second.domain')
+        manager.save_settings_to_file('xyz')
+        with open(filename, 'br') as file:
+            self.assertEqual(scrypt_kdf, unpack_header(file.read())[0])
+        manager = PasswordSettingsManager(filename)
+        manager.load_settings_from_file('xyz')
+        self.assertEqual(scrypt_kdf, manager.kdf)
+        self.assertEqual(['second.domain', 'unit.test'], sorted(manager.get_domain_list()))
+        self.assertEqual(11, manager.get_setting('unit.test').get_length())
+        self.manager.get_setting('third.domain')
+        self.manager.save_settings_to_file('xyz')
+        manager.load_settings_from_file('xyz')
+        self.assertEqual(['second.domain', 'third.domain', 'unit.test'], sorted(manager.get_domain_list()))
+
+    def test_set_kdf_cost(self):
+        self.manager.set_kdf_cost(1000)
+        self.assertEqual(create_kdf(KDF_PBKDF2, 1000), self.manager.kdf)
+        manager = PasswordSettingsManager(self.settings_file, kdf=create_kdf(KDF_SCRYPT, 1024))
+        manager.save_settings_to_file('xyz')
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.load_settings_from_file('xyz')
+        manager.set_kdf_cost(2048)
+        self.assertEqual(create_kdf(KDF_SCRYPT, 2048), manager.kdf)
+        self.assertRaises(ValueError, manager.set_kdf_cost, 1000)
+        self.assertTrue(manager.is_dirty())
+
     def test_set_setting(self):
         setting = self.manager.get_setting('hugo.me')
         setting.set_length(6)
@@ -139,6 +240,60 @@ class TestPasswordSettingsManager(unittest.TestCase):
         self.assertIn('hugo.me', self.manager.get_domain_list())
         self.assertEqual(6, self.manager.get_setting('hugo.me').get_length())
 
+    def test_spliced_serialization(self):
+        for domain in ['unit.test', 'some.domain', 'third.domain']:
+            setting = self.manager.get_setting(domain)
+            setting.set_notes('Nötiz "' + domain + '"')
+            self.manager.set_setting(setting)
+        self.manager.delete_setting(self.manager.get_setting('third.domain'))
+        self.manager.set_synced('unit.test')
+        saved_settings = json.loads(self.manager.get_saved_settings_json())
+        self.assertEqual(self.manager.get_settings_as_dict()['settings'], saved_settings['settings'])
+        self.assertEqual(['unit.test'], saved_settings['synced'])
+        self.assertEqual(['third.domain'], list(saved_settings['deleted'].keys()))
+        export_data = self.manager.get_export_dict()
+        export_data['some.domain']['length'] = 20
+        self.assertEqual(json.dumps(export_data), self.manager.get_export_json(export_data))
+        self.assertEqual({domain_name: get_fingerprint(data_set) for domain_name, data_set in export_data.items()},
+                         self.manager.get_fingerprints(export_data))
+
+    def test_store_unchanged_settings(self):
+        server = MemorySyncManager()
+        filename = self.settings_file
+        self.manager.sync_manager = server
+        self.manager.load_settings('xyz', True, True)
+        self.assertTrue(self.manager.is_dirty())
+        self.manager.get_setting('unit.test')
+        self.manager.store_settings('xyz')
+        self.assertFalse(self.manager.is_dirty())
+        self.assertEqual(1, server.pushes)
+        manager = PasswordSettingsManager(filename)
+        manager.sync_manager = server
+        manager.load_settings('xyz', True, True)
+        self.assertFalse(manager.is_dirty())
+        self.assertFalse(manager.update_remote)
+        with open(filename, 'br') as file:
+            data = file.read()
+        with patch('PasswordSettingsManager.Crypter') as crypter:
+            setting = manager.get_setting('unit.test')
+            manager.set_setting(setting)
+            self.assertFalse(manager.update_remote)
+            self.assertEqual(0, len(manager.outbox))
+            manager.store_settings('xyz')
+            self.assertFalse(crypter.called)
+        with open(filename, 'br') as file:
+            self.assertEqual(data, file.read())
+        self.assertEqual(1, server.pushes)
+        setting.set_username('Hugo')
+        manager.set_setting(setting)
+        self.assertTrue(manager.is_dirty())
+        self.assertTrue(manager.update_remote)
+        manager.store_settings('xyz')
+        self.assertEqual(2, server.pushes)
+        with open(filename, 'br') as file:
+            self.assertNotEqual(data, file.read())
+        self.assertFalse(manager.is_dirty())
+
     def test_delete_setting(self):
         setting = self.manager.get_setting('hugo.me')
         setting.set_length(6)
@@ -175,7 +330,7 @@ class TestPasswordSettingsManager(unittest.TestCase):
         }
         salt = os.urandom(32)
         crypter = Crypter(salt, 'xyz')
-        f = open(os.path.expanduser('~/.ctSESAM_test.pws'), 'bw')
+        f = open(self.settings_file, 'bw')
         data = json.dumps(settings).encode('utf-8')
         f.write(salt + struct.pack('!I', 0) + crypter.encrypt(Packer.compress(data)))
         f.close()
@@ -214,12 +369,12 @@ class TestPasswordSettingsManager(unittest.TestCase):
         }
         salt = os.urandom(32)
         crypter = Crypter(salt, 'xyz')
-        f = open(os.path.expanduser('~/.ctSESAM_test.pws'), 'bw')
+        f = open(self.settings_file, 'bw')
         f.write(salt + struct.pack('!I', 0) + crypter.encrypt(
             Packer.compress(json.dumps(settings).encode('utf-8'))))
         f.close()
         self.manager.load_settings_from_file('xyz')
-        data = b64decode(self.manager.get_export_data('xyz'))
+        data = self.manager.get_export_data('xyz')
         salt = data[1:33]
         crypter = Crypter(salt, 'xyz')
         self.assertEqual(
@@ -254,7 +409,7 @@ class TestPasswordSettingsManager(unittest.TestCase):
         }
         salt = os.urandom(32)
         crypter = Crypter(salt, 'xyz')
-        f = open(os.path.expanduser('~/.ctSESAM_test.pws'), 'bw')
+        f = open(self.settings_file, 'bw')
         f.write(salt + struct.pack('!I', 0) + crypter.encrypt(
             Packer.compress(json.dumps(settings).encode('utf-8'))))
         f.close()
@@ -267,3 +422,585 @@ class TestPasswordSettingsManager(unittest.TestCase):
         self.assertEqual(5001, self.manager.get_setting('unit.test').get_iterations())
         self.assertEqual(4096, self.manager.get_setting('some.domain').get_iterations())
         self.assertEqual(4098, self.manager.get_setting('third.domain').get_iterations())
+
+    def test_export_and_import_settings(self):
+        setting = self.manager.get_setting('unit.test')
+        setting.set_length(11)
+        setting.set_modification_date('2014-08-02T10:37:12')
+        self.manager.set_setting(setting)
+        setting = self.manager.get_setting('some.domain')
+        setting.set_username('Hugo')
+        self.manager.set_setting(setting)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'export.csv')
+            self.assertEqual(2, self.manager.export_settings(filename))
+            manager = PasswordSettingsManager(self.settings_file)
+            report = manager.import_settings('xyz', filename)
+        self.assertEqual(2, report['imported'])
+        self.assertEqual(0, report['invalid'])
+        self.assertEqual(11, manager.get_setting('unit.test').get_length())
+        self.assertEqual('Hugo', manager.get_setting('some.domain').get_username())
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.load_settings_from_file('xyz')
+        self.assertEqual(['unit.test', 'some.domain'], manager.get_domain_list())
+
+    def test_import_settings_conflict_policy(self):
+        setting = self.manager.get_setting('unit.test')
+        setting.set_length(11)
+        setting.set_modification_date('2014-08-02T10:37:12')
+        self.manager.set_setting(setting)
+        self.manager.set_setting(self.manager.get_setting('some.domain'))
+        lines = [
+            json.dumps({'domain': 'unit.test', 'length': 12, 'mDate': '2013-08-02T10:37:12'}),
+            json.dumps({'domain': 'new.domain', 'length': 0}),
+            json.dumps({'domain': 'third.domain'}),
+            json.dumps({'domain': 'some.domain', 'length': 13})
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'import.jsonl')
+            with open(filename, 'w') as file:
+                file.write("\n".join(lines))
+            report = self.manager.import_settings('xyz', filename, conflict_policy=CONFLICT_KEEP_NEWER)
+            self.assertEqual({'imported': 1, 'skipped': 2, 'invalid': 1}, {
+                key: report[key] for key in ['imported', 'skipped', 'invalid']})
+            self.assertEqual(2, report['errors'][0][0])
+            self.assertEqual(11, self.manager.get_setting('unit.test').get_length())
+            self.assertNotEqual(13, self.manager.get_setting('some.domain').get_length())
+            report = self.manager.import_settings('xyz', filename, conflict_policy=CONFLICT_SKIP)
+            self.assertEqual(0, report['imported'])
+            self.assertEqual(3, report['skipped'])
+            report = self.manager.import_settings('xyz', filename, conflict_policy=CONFLICT_OVERWRITE)
+            self.assertEqual(3, report['imported'])
+            self.assertEqual(12, self.manager.get_setting('unit.test').get_length())
+            self.assertEqual(13, self.manager.get_setting('some.domain').get_length())
+            self.assertRaises(ValueError, self.manager.import_settings, 'xyz', filename, None, 'newest')
+
+    def test_import_settings_stores_once(self):
+        server = MemorySyncManager()
+        self.manager.sync_manager = server
+        self.manager.load_settings('xyz', True, True)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'import.jsonl')
+            with open(filename, 'w') as file:
+                file.write("\n".join([json.dumps({'domain': 'unit.test'}), json.dumps({'domain': 'some.domain'})]))
+            with patch('PasswordSettingsManager.write_file_atomically', wraps=write_file_atomically) as write:
+                report = self.manager.import_settings('xyz', filename)
+        self.assertEqual(2, report['imported'])
+        self.assertEqual([self.settings_file], [call[0][0] for call in write.call_args_list])
+        self.assertEqual(1, server.pushes)
+        self.assertFalse(self.manager.is_dirty())
+
+    def test_import_settings_with_invalid_bytes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'import.csv')
+            with open(filename, 'wb') as file:
+                file.write(b'domain,notes\r\nunit.test,\xff\r\nsome.domain,fine\r\n')
+            report = self.manager.import_settings('xyz', filename)
+        self.assertEqual(1, report['imported'])
+        self.assertEqual(1, report['invalid'])
+        self.assertEqual([(2, "The field notes is not valid UTF-8.")], report['errors'])
+        self.assertIn('some.domain', self.manager.get_domain_list())
+
+    def test_set_synced_keeps_indexes(self):
+        setting = PasswordSetting('Mail')
+        setting.set_url('https://mail.example.co.uk/login')
+        self.manager.set_setting(setting)
+        self.manager.set_setting(PasswordSetting('example.co.uk'))
+        with patch('SettingsSnapshot.SettingsSnapshot.put', autospec=True,
+                   side_effect=SettingsSnapshot.put) as put:
+            self.manager.set_synced('Mail')
+        self.assertEqual(1, put.call_count)
+        self.assertEqual(['Mail', 'example.co.uk'], self.manager.get_domain_list())
+        self.assertEqual([(True, 'Mail'), (False, 'example.co.uk')],
+                         [(s.is_synced(), s.get_domain()) for s in self.manager.find_settings_by_url(
+                             'https://www.example.co.uk/')])
+
+    def test_find_settings_by_url(self):
+        setting = PasswordSetting('Mail')
+        setting.set_url('https://mail.example.co.uk/login')
+        self.manager.set_setting(setting)
+        self.manager.set_setting(PasswordSetting('example.co.uk'))
+        self.manager.set_setting(PasswordSetting('other.com'))
+        self.assertEqual(['Mail'], [s.get_domain() for s in self.manager.find_settings_by_url(
+            'http://MAIL.example.co.uk/inbox?id=3')])
+        self.assertEqual(['Mail', 'example.co.uk'], [s.get_domain() for s in self.manager.find_settings_by_url(
+            'https://www.example.co.uk/')])
+        self.assertEqual(['other.com'], [s.get_domain() for s in self.manager.find_settings_by_url(
+            'https://deep.sub.other.com/path')])
+        self.assertEqual(['Mail'], [s.get_domain() for s in self.manager.find_settings_by_url('mail')])
+        self.assertEqual([], self.manager.find_settings_by_url('https://unknown.co.uk/'))
+        self.manager.delete_setting(setting)
+        self.assertEqual([], self.manager.find_settings_by_url('mail'))
+        self.assertEqual(['example.co.uk'], [s.get_domain() for s in self.manager.find_settings_by_url(
+            'http://mail.example.co.uk/inbox')])
+
+    def test_get_setting_returns_copy(self):
+        setting = self.manager.get_setting('unit.test')
+        snapshot = self.manager.get_snapshot()
+        setting.set_length(17)
+        self.assertEqual(10, self.manager.get_setting('unit.test').get_length())
+        self.manager.set_setting(setting)
+        setting.set_length(18)
+        self.assertEqual(17, self.manager.get_setting('unit.test').get_length())
+        self.assertEqual(10, snapshot.get('unit.test').get_length())
+        self.assertGreater(self.manager.get_snapshot().version, snapshot.version)
+
+    def test_lookups_do_not_wait_for_writers(self):
+        setting = self.manager.get_setting('unit.test')
+        setting.set_url('https://login.unit.test/')
+        self.manager.set_setting(setting)
+        writing = threading.Event()
+        release = threading.Event()
+
+        def write():
+            with self.manager.updating():
+                changed_setting = self.manager.get_setting('unit.test')
+                changed_setting.set_length(16)
+                self.manager.set_setting(changed_setting)
+                writing.set()
+                release.wait(10)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        self.assertTrue(writing.wait(10))
+        self.assertEqual(10, self.manager.get_setting('unit.test').get_length())
+        self.assertEqual(['unit.test'], [s.get_domain() for s in self.manager.find_settings_by_url('login.unit.test')])
+        self.assertEqual(['unit.test'], [s.get_domain() for s in self.manager.search('unit')])
+        self.assertEqual(['unit.test'], self.manager.get_domain_list())
+        release.set()
+        writer.join()
+        self.assertEqual(16, self.manager.get_setting('unit.test').get_length())
+
+    def test_concurrent_readers_and_writers(self):
+        writers = 4
+        changes = 50
+        errors = []
+        stopped = threading.Event()
+        self.manager.search('warm up the index')
+
+        def read():
+            try:
+                while not stopped.is_set():
+                    snapshot = self.manager.get_snapshot()
+                    for host, domains in snapshot.url_index.items():
+                        for domain in domains:
+                            self.assertIn(domain, snapshot.settings)
+                    for domain in snapshot.get_domain_list():
+                        self.assertEqual(domain, snapshot.get(domain).get_domain())
+                    self.manager.find_settings_by_url('https://writer0.test/')
+                    self.manager.search('writer')
+            except Exception as error:
+                errors.append(error)
+
+        def write(writer):
+            try:
+                for change in range(changes):
+                    setting = self.manager.get_setting('writer' + str(writer) + '.test')
+                    setting.set_length(change + 4)
+                    setting.set_notes('change ' + str(change))
+                    self.manager.set_setting(setting)
+                    self.manager.get_setting('writer' + str(writer) + '-' + str(change) + '.test')
+                    if change % 2 == 1:
+                        self.manager.delete_setting(
+                            self.manager.get_setting('writer' + str(writer) + '-' + str(change - 1) + '.test'))
+            except Exception as error:
+                errors.append(error)
+
+        readers = [threading.Thread(target=read) for _ in range(3)]
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+        for thread in readers + threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stopped.set()
+        for thread in readers:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(writers + writers * changes // 2, len(self.manager.get_domain_list()))
+        for writer in range(writers):
+            self.assertEqual(changes + 3, self.manager.get_setting('writer' + str(writer) + '.test').get_length())
+        self.assertEqual(writers, len(self.manager.search('change 49')))
+
+    def test_search(self):
+        setting = self.manager.get_setting('github.com')
+        setting.set_username('octocat')
+        self.manager.set_setting(setting)
+        self.assertEqual(['github.com'], [s.get_domain() for s in self.manager.search('octo')])
+        setting = PasswordSetting('gitlab.com')
+        setting.set_notes('Work account of octocat')
+        self.manager.set_setting(setting)
+        self.assertEqual(['github.com', 'gitlab.com'], [s.get_domain() for s in self.manager.search('octocat')])
+        self.manager.delete_setting(self.manager.get_setting('github.com'))
+        self.assertEqual(['gitlab.com'], [s.get_domain() for s in self.manager.search('octocat')])
+        self.manager.save_settings_to_file('xyz')
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.load_settings_from_file('xyz')
+        self.assertIsNone(manager.search_index)
+        self.assertEqual(['gitlab.com'], [s.get_domain() for s in manager.search('octocat')])
+        self.assertEqual(1, len(manager.search_index))
+
+    def test_rotate_policy(self):
+        for domain in ['unit.test', 'some.domain', 'third.domain']:
+            setting = self.manager.get_setting(domain)
+            setting.set_iterations(5)
+            setting.set_modification_date('2014-08-02T10:37:12')
+            if domain == 'third.domain':
+                setting.set_legacy_password('K6x/vyG9(p')
+            self.manager.set_setting(setting)
+        old_password = self.manager.generate_password('xyz', self.manager.get_setting('unit.test'))
+        report = self.manager.rotate_policy('xyz', lambda setting: setting.get_domain() != 'some.domain',
+                                            iterations=7, length=14, character_classes=LOWER_CASE | DIGITS,
+                                            workers=2)
+        self.assertEqual(1, len(report))
+        self.assertEqual('unit.test', report[0]['domain'])
+        self.assertEqual(old_password, report[0]['old_password'])
+        self.assertEqual(['iterations', 'length', 'usedCharacters'], report[0]['changes'])
+        setting = self.manager.get_setting('unit.test')
+        self.assertEqual(7, setting.get_iterations())
+        self.assertEqual(self.manager.generate_password('xyz', setting), report[0]['new_password'])
+        self.assertEqual(14, len(report[0]['new_password']))
+        self.assertRegex(report[0]['new_password'], '^[a-z0-9]+$')
+        self.assertNotEqual('2014-08-02T10:37:12', setting.get_modification_date())
+        self.assertEqual(5, self.manager.get_setting('some.domain').get_iterations())
+        self.assertEqual(5, self.manager.get_setting('third.domain').get_iterations())
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.load_settings_from_file('xyz')
+        self.assertEqual(7, manager.get_setting('unit.test').get_iterations())
+        report = self.manager.rotate_policy('xyz', new_salt=True)
+        self.assertEqual(['salt'], report[0]['changes'])
+        self.assertEqual(['salt'], report[1]['changes'])
+
+    def test_rotate_policy_does_not_block_writers(self):
+        setting = self.manager.get_setting('unit.test')
+        setting.set_iterations(5)
+        self.manager.set_setting(setting)
+        writer = threading.Thread(target=self.manager.set_setting, args=(self.manager.get_setting('new.domain'),))
+        writer_blocked = []
+
+        def generate(password, setting, save_cache=True, priority=None):
+            if len(writer_blocked) < 1:
+                writer.start()
+                writer.join(10)
+                writer_blocked.append(writer.is_alive())
+            return 'password'
+
+        with patch.object(self.manager, 'generate_password', side_effect=generate):
+            self.manager.rotate_policy('xyz', iterations=7, workers=1)
+        writer.join()
+        self.assertEqual([False], writer_blocked)
+        self.assertEqual(7, self.manager.get_setting('unit.test').get_iterations())
+        self.assertIn('new.domain', self.manager.get_domain_list())
+
+    def test_rotate_policy_repeats_concurrently_changed_settings(self):
+        for domain in ['unit.test', 'some.domain']:
+            setting = self.manager.get_setting(domain)
+            setting.set_iterations(5)
+            self.manager.set_setting(setting)
+        generated = []
+
+        def change_setting():
+            setting = self.manager.get_setting('unit.test')
+            setting.set_length(20)
+            self.manager.set_setting(setting)
+
+        def generate(password, setting, save_cache=True, priority=None):
+            if len(generated) < 1:
+                writer = threading.Thread(target=change_setting)
+                writer.start()
+                writer.join()
+            generated.append((setting.get_domain(), setting.get_iterations(), setting.get_length()))
+            return 'password'
+
+        with patch.object(self.manager, 'generate_password', side_effect=generate):
+            report = self.manager.rotate_policy('xyz', iterations=7, workers=1)
+        self.assertEqual(['some.domain', 'unit.test'], sorted(entry['domain'] for entry in report))
+        self.assertEqual(('unit.test', 7, 20), generated[-1])
+        setting = self.manager.get_setting('unit.test')
+        self.assertEqual(7, setting.get_iterations())
+        self.assertEqual(20, setting.get_length())
+        self.assertEqual(7, self.manager.get_setting('some.domain').get_iterations())
+
+    def test_password_cache(self):
+        self.manager.enable_password_cache(min_iterations=10)
+        setting = self.manager.get_setting('unit.test')
+        setting.set_iterations(20)
+        self.manager.generate_password('xyz', setting)
+        self.assertFalse(os.path.isfile(self.settings_file + '.cache'))
+        self.manager.save_settings_to_file('xyz')
+        password = self.manager.generate_password('xyz', setting)
+        self.assertTrue(os.path.isfile(self.settings_file + '.cache'))
+        self.manager.set_setting(self.manager.get_setting('other.domain'))
+        self.manager.save_settings_to_file('xyz')
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.enable_password_cache(min_iterations=10)
+        manager.load_settings_from_file('xyz')
+        with patch.object(Crypter, 'derive_key', side_effect=AssertionError("no key derivation")):
+            self.assertEqual(password, manager.password_cache.get('xyz', setting))
+        manager.password_cache.put('xyz', setting, 'from the cache')
+        self.assertEqual('from the cache', manager.generate_password('xyz', setting))
+        setting.set_length(12)
+        self.assertNotEqual('from the cache', manager.generate_password('xyz', setting))
+        self.assertEqual(password[:10], manager.generate_password('xyz', setting)[:10])
+
+    def test_sync_between_two_clients(self):
+        server = MemorySyncManager()
+        with tempfile.TemporaryDirectory() as directory:
+            first = PasswordSettingsManager(os.path.join(directory, 'first.pws'))
+            first.sync_manager = server
+            first.load_settings('xyz', True, True)
+            for domain in ['unit.test', 'some.domain']:
+                setting = first.get_setting(domain)
+                setting.set_modification_date('2014-08-02T10:37:12')
+                first.set_setting(setting)
+            first.store_settings('xyz')
+            self.assertEqual(1, server.pushes)
+            second = PasswordSettingsManager(os.path.join(directory, 'second.pws'))
+            second.sync_manager = server
+            second.load_settings('xyz', True, True)
+            self.assertEqual(['unit.test', 'some.domain'], second.get_domain_list())
+            self.assertFalse(second.update_remote)
+            second.store_settings('xyz')
+            self.assertEqual(1, server.pushes)
+            second.delete_setting(second.get_setting('unit.test'))
+            setting = second.get_setting('some.domain')
+            setting.set_username('Hugo')
+            setting.set_modification_date('2014-08-02T10:37:13')
+            second.set_setting(setting)
+            second.store_settings('xyz')
+            self.assertEqual(2, server.pushes)
+            self.assertEqual(0, second.tombstone_report['collected'])
+            first = PasswordSettingsManager(os.path.join(directory, 'first.pws'))
+            first.sync_manager = server
+            first.load_settings('xyz', True, True)
+            self.assertEqual(['some.domain'], first.get_domain_list())
+            self.assertEqual('Hugo', first.get_setting('some.domain').get_username())
+            self.assertIn('unit.test', first.deleted_settings)
+            self.assertFalse(first.update_remote)
+            first.store_settings('xyz')
+            self.assertEqual(2, server.pushes)
+
+    def test_sync_drops_collected_settings(self):
+        server = MemorySyncManager()
+        with tempfile.TemporaryDirectory() as directory:
+            first = PasswordSettingsManager(os.path.join(directory, 'first.pws'))
+            first.sync_manager = server
+            first.load_settings('xyz', True, True)
+            first.get_setting('unit.test')
+            first.get_setting('some.domain')
+            first.store_settings('xyz')
+            second = PasswordSettingsManager(os.path.join(directory, 'second.pws'))
+            second.sync_manager = server
+            second.load_settings('xyz', True, True)
+            second.save_settings_to_file('xyz')
+            first = PasswordSettingsManager(os.path.join(directory, 'first.pws'), tombstone_horizon=timedelta(0))
+            first.sync_manager = server
+            first.load_settings('xyz', True, True)
+            first.delete_setting(first.get_setting('unit.test'))
+            first.store_settings('xyz')
+            self.assertEqual(1, first.tombstone_report['collected'])
+            self.assertGreater(first.tombstone_report['bytes_saved'], 0)
+            self.assertEqual({}, first.deleted_settings)
+            second = PasswordSettingsManager(os.path.join(directory, 'second.pws'))
+            second.sync_manager = server
+            second.load_settings('xyz', True, True)
+            self.assertEqual(['some.domain'], second.get_domain_list())
+
+    def test_sync_takes_remote_change_of_unchanged_setting(self):
+        server = MemorySyncManager()
+        self.manager.sync_manager = server
+        self.manager.load_settings('xyz', True, True)
+        setting = self.manager.get_setting('unit.test')
+        setting.set_modification_date('2014-08-02T10:37:12')
+        self.manager.set_setting(setting)
+        self.manager.store_settings('xyz')
+        other = PasswordSettingsManager(self.settings_file)
+        other.sync_manager = server
+        other.load_settings('xyz', True, True)
+        setting = other.get_setting('unit.test')
+        setting.set_length(16)
+        setting.set_modification_date('2013-01-01T00:00:00')
+        other.set_setting(setting)
+        other.store_settings('xyz')
+        self.assertEqual(2, server.pushes)
+        self.manager.update_from_sync('xyz')
+        self.assertEqual(16, self.manager.get_setting('unit.test').get_length())
+        self.assertTrue(self.manager.get_setting('unit.test').is_synced())
+
+    def test_push_conflict_merges_and_retries(self):
+        server = MemorySyncManager()
+        with tempfile.TemporaryDirectory() as directory:
+            first = PasswordSettingsManager(os.path.join(directory, 'first.pws'))
+            first.sync_manager = server
+            first.load_settings('xyz', True, True)
+            second = PasswordSettingsManager(os.path.join(directory, 'second.pws'))
+            second.sync_manager = server
+            second.load_settings('xyz', True, True)
+            first.get_setting('first.domain')
+            first.store_settings('xyz')
+            second.get_setting('second.domain')
+            second.store_settings('xyz')
+            self.assertEqual(2, server.pushes)
+            self.assertEqual(0, len(second.outbox))
+            third = PasswordSettingsManager(os.path.join(directory, 'third.pws'))
+            third.sync_manager = server
+            third.load_settings('xyz', True, True)
+            self.assertEqual(['first.domain', 'second.domain'], sorted(third.get_domain_list()))
+
+    def test_async_load_and_store(self):
+        server = MemorySyncManager()
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def run(directory):
+            ticker = asyncio.ensure_future(tick())
+            first = PasswordSettingsManager(os.path.join(directory, 'first.pws'), blocking_workers=2)
+            first.sync_manager = server
+            second = PasswordSettingsManager(os.path.join(directory, 'second.pws'))
+            second.sync_manager = server
+            await asyncio.gather(first.aload('xyz'), second.aload('xyz'))
+            first.get_setting('first.domain')
+            second.get_setting('second.domain')
+            await first.astore_settings('xyz')
+            await second.astore_settings('xyz')
+            self.assertEqual(['first.domain', 'second.domain'], sorted(second.get_domain_list()))
+            self.assertTrue(await first.aupdate_from_sync('xyz'))
+            self.assertEqual(['first.domain', 'second.domain'], sorted(first.get_domain_list()))
+            await first.astore_settings('xyz')
+            setting = first.get_setting('first.domain')
+            setting.set_iterations(300000)
+            password = await first.agenerate_password('xyz', setting)
+            await asyncio.sleep(0.02)
+            ticker.cancel()
+            return password, setting
+
+        with tempfile.TemporaryDirectory() as directory:
+            password, setting = asyncio.run(run(directory))
+            self.assertEqual(self.manager.generate_password('xyz', setting), password)
+            self.assertEqual(2, server.pushes)
+            third = PasswordSettingsManager(os.path.join(directory, 'first.pws'))
+            third.load_settings_from_file('xyz')
+            self.assertEqual(['first.domain', 'second.domain'], sorted(third.get_domain_list()))
+            self.assertTrue(third.get_setting('second.domain').is_synced())
+        self.assertGreater(len(ticks), 2)
+        self.assertLess(max(later - earlier for earlier, later in zip(ticks, ticks[1:])), 0.25)
+
+    def test_concurrent_saves_are_merged(self):
+        self.manager.get_setting('unit.test')
+        self.manager.get_setting('some.domain')
+        self.manager.save_settings_to_file('xyz')
+        first = PasswordSettingsManager(self.settings_file)
+        first.load_settings_from_file('xyz')
+        second = PasswordSettingsManager(self.settings_file)
+        second.load_settings_from_file('xyz')
+        first.delete_setting(first.get_setting('some.domain'))
+        first.get_setting('first.domain')
+        first.save_settings_to_file('xyz')
+        setting = second.get_setting('unit.test')
+        setting.set_length(17)
+        second.set_setting(setting)
+        second.get_setting('second.domain')
+        second.save_settings_to_file('xyz')
+        self.assertEqual(['first.domain', 'second.domain', 'unit.test'], sorted(second.get_domain_list()))
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.load_settings_from_file('xyz')
+        self.assertEqual(['first.domain', 'second.domain', 'unit.test'], sorted(manager.get_domain_list()))
+        self.assertEqual(17, manager.get_setting('unit.test').get_length())
+        self.assertIn('some.domain', manager.deleted_settings)
+
+    def test_parallel_writers(self):
+        writers = 8
+        saves = 3
+        errors = []
+        with tempfile.TemporaryDirectory() as directory:
+            settings_file = os.path.join(directory, 'shared.pws')
+
+            def write(writer):
+                try:
+                    for save in range(saves):
+                        manager = PasswordSettingsManager(settings_file)
+                        manager.load_settings_from_file('xyz', True)
+                        manager.get_setting('writer' + str(writer) + '.save' + str(save) + '.test')
+                        manager.save_settings_to_file('xyz')
+                except Exception as error:
+                    errors.append(error)
+
+            threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual([], errors)
+            manager = PasswordSettingsManager(settings_file)
+            manager.load_settings_from_file('xyz', True)
+            self.assertEqual(writers * saves, len(manager.get_domain_list()))
+            self.assertEqual(['shared.pws', 'shared.pws.lock'], sorted(os.listdir(directory)))
+
+    def test_get_export_data_with_tombstones(self):
+        self.manager.get_setting('unit.test')
+        self.manager.delete_setting(self.manager.get_setting('some.domain'))
+        data = self.manager.get_export_data('xyz')
+        crypter = Crypter(data[1:33], 'xyz')
+        exported = json.loads(str(Packer.decompress(crypter.decrypt(data[33:])), encoding='utf-8'))
+        self.assertEqual(['some.domain', 'unit.test'], sorted(exported.keys()))
+        self.assertTrue(exported['some.domain']['deleted'])
+        self.manager.save_settings_to_file('xyz')
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.load_settings_from_file('xyz')
+        self.assertEqual(['unit.test'], manager.get_domain_list())
+        self.assertEqual(['some.domain'], list(manager.deleted_settings.keys()))
+
+    def test_deferred_sync_settings(self):
+        self.manager.get_setting('unit.test')
+        self.manager.sync_manager.server_address = 'https://sync.example.com/'
+        self.manager.sync_manager.certificate = 'CERTIFICATE'
+        self.manager.sync_manager.sync = True
+        self.manager.save_settings_to_file('xyz')
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.load_settings('xyz', update_from_sync=False)
+        self.assertIsNone(manager.sync_manager.sync)
+        self.assertEqual(['unit.test'], manager.get_domain_list())
+        manager.save_settings_to_file('xyz')
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.load_settings_from_file('xyz')
+        self.assertEqual('https://sync.example.com/', manager.sync_manager.server_address)
+        self.assertEqual('CERTIFICATE', manager.sync_manager.certificate)
+        self.assertIsNotNone(manager.sync_manager.sync)
+
+    def test_outbox_keeps_changes_until_pushed(self):
+        server = MemorySyncManager()
+        self.manager.sync_manager = server
+        self.manager.load_settings('xyz', True, True)
+        self.manager.get_setting('unit.test')
+        self.manager.store_settings('xyz')
+        self.assertEqual(1, server.pushes)
+        self.assertEqual(0, len(self.manager.outbox))
+        server.reachable = False
+        for length in [11, 12, 13]:
+            setting = self.manager.get_setting('unit.test')
+            setting.set_length(length)
+            self.manager.set_setting(setting)
+        self.manager.delete_setting(self.manager.get_setting('unit.test'))
+        setting = self.manager.get_setting('unit.test')
+        self.manager.set_setting(setting)
+        setting.set_length(14)
+        self.manager.set_setting(setting)
+        self.manager.store_settings('xyz')
+        self.assertEqual(1, len(self.manager.outbox))
+        self.assertTrue(os.path.isfile(self.settings_file + '.outbox'))
+        manager = PasswordSettingsManager(self.settings_file)
+        manager.sync_manager = server
+        manager.load_settings_from_file('xyz')
+        self.assertEqual({'unit.test'}, manager.outbox.get_pending_domains())
+        self.assertFalse(manager.flush_outbox('xyz'))
+        server.reachable = True
+        self.assertTrue(manager.flush_outbox('xyz'))
+        self.assertEqual(2, server.pushes)
+        self.assertFalse(os.path.isfile(self.settings_file + '.outbox'))
+        other = PasswordSettingsManager(os.path.join(self.directory, 'ctSESAM_test_other.pws'))
+        other.sync_manager = server
+        other.update_from_sync('xyz')
+        self.assertEqual(14, other.get_setting('unit.test').get_length())
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from SearchIndex import SearchIndex, SEARCH_FIELDS, FIELD_WEIGHTS, get_rank_key
+from PasswordSetting import PasswordSetting
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        for domain, username, url, notes in [
+                ('github.com', 'octocat', 'https://github.com/login', ''),
+                ('mail.example.com', 'hugo.habicht', '', 'Account for the newsletter'),
+                ('bank.de', 'k', 'https://banking.bank.de/', 'PIN is stored elsewhere'),
+                ('hub.org', 'gitter', '', '')]:
+            setting = PasswordSetting(domain)
+            setting.set_username(username)
+            setting.set_url(url)
+            setting.set_notes(notes)
+            self.index.add(setting)
+
+    def test_substring(self):
+        self.assertEqual([(5, 'hub.org'), (5, 'github.com')], self.index.search('HUB'))
+        self.assertEqual([(4, 'mail.example.com')], self.index.search('habicht'))
+        self.assertEqual([(2, 'mail.example.com')], self.index.search('newsletter'))
+
+    def test_field_ranking(self):
+        self.assertEqual([(5, 'github.com'), (4, 'hub.org')], self.index.search('git'))
+
+    def test_short_query(self):
+        self.assertEqual([(5, 'bank.de')], self.index.search('k'))
+        self.assertEqual([(4, 'mail.example.com')], self.index.search('.h'))
+        self.assertEqual([], self.index.search(''))
+
+    def test_typo(self):
+        results = self.index.search('newsleter')
+        self.assertEqual('mail.example.com', results[0][1])
+        self.assertLess(results[0][0], 1)
+        self.assertEqual([], self.index.search('newsleter', min_similarity=1))
+
+    def test_limit(self):
+        self.assertEqual(1, len(self.index.search('o', limit=1)))
+        for domain in ['bbb.de', 'aaa.de', 'ccc.de']:
+            self.index.add(PasswordSetting(domain))
+        self.assertEqual([(5, 'aaa.de'), (5, 'bbb.de')], self.index.search('.de', limit=2))
+
+    def test_find_matches_and_rank(self):
+        matches = self.index.find_matches('git', limit=1)
+        self.assertEqual(([('domain', ['github.com'])], {}), matches)
+        self.index.remove('github.com')
+        self.assertEqual([(5, 'github.com')], self.index.rank(matches, limit=1))
+        substring_matches, similar = self.index.find_matches('newsleter')
+        self.assertEqual(['mail.example.com'], list(similar.keys()))
+
+    def test_update_and_remove(self):
+        setting = PasswordSetting('hub.org')
+        setting.set_username('someone')
+        self.index.add(setting)
+        self.assertEqual([(5, 'github.com')], self.index.search('git'))
+        self.index.remove('github.com')
+        self.assertEqual([], self.index.search('git'))
+        self.assertEqual(3, len(self.index))
+
+    def test_common_terms_on_large_vault(self):
+        index = SearchIndex()
+        for i in range(20000):
+            setting = PasswordSetting(['shop', 'mail', 'bank', 'news'][i % 4] + str(i) + ['.com', '.de'][i % 2])
+            setting.set_username('user' + str(i))
+            setting.set_url('https://www.' + setting.get_domain() + '/login')
+            setting.set_notes('note ' + str(i))
+            index.add(setting)
+        self.assertEqual([(5, 'bank2.com'), (5, 'bank6.com')], index.search('.com', limit=2))
+        for query in ['https', 'login', 'user', 'note', '.com', 'co']:
+            expected = []
+            for field in SEARCH_FIELDS:
+                found = {key for score, key in expected}
+                keys = sorted((key for key, fields in index.documents.items()
+                               if query in fields[field] and key not in found), key=get_rank_key)
+                expected += [(1 + FIELD_WEIGHTS[field], key) for key in keys[:10 - len(expected)]]
+            self.assertEqual(expected, index.search(query))
+
+
+if __name__ == '__main__':
+    unittest.main()
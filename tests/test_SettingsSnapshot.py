@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from SettingsSnapshot import SettingsSnapshot
+from PasswordSetting import PasswordSetting
+
+
+class TestSettingsSnapshot(unittest.TestCase):
+    def test_draft_does_not_change_the_snapshot(self):
+        snapshot = SettingsSnapshot()
+        draft = snapshot.create_draft()
+        draft.put(PasswordSetting('unit.test'))
+        self.assertEqual(1, draft.version)
+        self.assertEqual(['unit.test'], draft.get_domain_list())
+        self.assertEqual([], snapshot.get_domain_list())
+        next_draft = draft.create_draft()
+        next_draft.remove('unit.test')
+        self.assertNotIn('unit.test', next_draft)
+        self.assertIn('unit.test', draft)
+        self.assertEqual(['unit.test'], [setting.get_domain() for setting in draft.find_settings_by_url('unit.test')])
+
+    def test_url_index(self):
+        draft = SettingsSnapshot().create_draft()
+        first = PasswordSetting('example.com')
+        draft.put(first)
+        second = PasswordSetting('login')
+        second.set_url('https://login.example.com/')
+        draft.put(second)
+        self.assertEqual(['example.com', 'login'],
+                         [setting.get_domain() for setting in draft.find_settings_by_url('https://example.com/a')])
+        self.assertEqual(['login'],
+                         [setting.get_domain() for setting in draft.find_settings_by_url('login.example.com')])
+        snapshot = draft
+        draft = snapshot.create_draft()
+        draft.put(PasswordSetting('example.com'))
+        self.assertEqual(['login', 'example.com'],
+                         [setting.get_domain() for setting in draft.find_settings_by_url('example.com')])
+        self.assertEqual(['example.com', 'login'],
+                         [setting.get_domain() for setting in snapshot.find_settings_by_url('example.com')])
+        draft.remove('login')
+        self.assertEqual(['example.com'],
+                         [setting.get_domain() for setting in draft.find_settings_by_url('login.example.com')])
+        self.assertEqual({'example.com'}, set(draft.url_index.keys()))
+
+    def test_put_keeps_position(self):
+        draft = SettingsSnapshot().create_draft()
+        for domain in ['a.test', 'b.test', 'c.test']:
+            draft.put(PasswordSetting(domain))
+        setting = PasswordSetting('a.test')
+        setting.set_length(20)
+        draft.put(setting, keep_position=True)
+        self.assertEqual(['a.test', 'b.test', 'c.test'], draft.get_domain_list())
+        self.assertEqual(20, draft.get('a.test').get_length())
+        draft.put(setting)
+        self.assertEqual(['b.test', 'c.test', 'a.test'], draft.get_domain_list())
+
+
+if __name__ == '__main__':
+    unittest.main()
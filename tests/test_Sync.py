@@ -2,8 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import os
+import asyncio
+import tempfile
+import threading
+import requests
 from unittest.mock import patch
-from Sync import Sync
+from Sync import Sync, CircuitBreaker
 from base64 import b64encode
 import json
 
@@ -12,8 +17,9 @@ class MockResponse(object):
     """
     A response with a similar format as requests.post produces.
     """
-    def __init__(self, blob=''):
-        self.status_code = 200
+    def __init__(self, blob='', status_code=200):
+        self.status_code = status_code
+        self.headers = {'content-type': 'application/json'}
         if len(blob) > 0:
             self.text = json.dumps({
                 "status": "ok",
@@ -25,7 +31,7 @@ class MockResponse(object):
             })
 
 
-def mock_requests_post_empty(url, data, headers, verify):
+def mock_requests_post_empty(url, data, headers, verify, timeout):
     """
     Returns a response with a similar format as requests.post produces.
 
@@ -33,13 +39,14 @@ def mock_requests_post_empty(url, data, headers, verify):
     :param data:
     :param headers:
     :param verify:
+    :param timeout:
     :return:
     :rtype: MockResponse
     """
     return MockResponse()
 
 
-def mock_requests_post(url, data, headers, verify):
+def mock_requests_post(url, data, headers, verify, timeout):
     """
     Returns a response with a similar format as requests.post produces.
 
@@ -47,6 +54,7 @@ def mock_requests_post(url, data, headers, verify):
     :param data:
     :param headers:
     :param verify:
+    :param timeout:
     :return:
     :rtype: MockResponse
     """
@@ -59,19 +67,130 @@ class TestSync(unittest.TestCase):
         sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
         status, blob = sync.pull()
         self.assertTrue(status)
-        self.assertEqual('', blob)
+        self.assertEqual(b'', blob)
 
     @patch('requests.post', mock_requests_post)
     def test_pull(self):
         sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
         status, blob = sync.pull()
         self.assertTrue(status)
-        self.assertEqual(str(b64encode(b'Test'), encoding='utf-8'), blob)
+        self.assertEqual(b'Test', blob)
 
     @patch('requests.post', mock_requests_post)
     def test_push(self):
         sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
-        self.assertTrue(sync.push(str(b64encode(b'Test'), encoding='utf-8')))
+        self.assertTrue(sync.push(b'Test'))
+
+    @patch('time.sleep')
+    def test_pull_retries(self, sleep):
+        answers = [requests.exceptions.ConnectionError(), MockResponse(status_code=502),
+                   MockResponse(str(b64encode(b'Test'), encoding='utf-8'))]
+        with patch('requests.post', side_effect=answers) as post:
+            sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem', timeout=(1, 2))
+            self.assertEqual((True, b'Test'), sync.pull())
+        self.assertEqual(3, post.call_count)
+        self.assertEqual((1, 2), post.call_args[1]['timeout'])
+        self.assertEqual(2, sleep.call_count)
+        for attempt, call in enumerate(sleep.call_args_list):
+            self.assertLessEqual(call[0][0], 0.5 * 2 ** attempt)
+
+    def test_pull_stops_retrying(self):
+        stop = threading.Event()
+        stop.set()
+        with patch('requests.post', side_effect=requests.exceptions.ConnectionError()) as post:
+            sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem', pull_retries=3)
+            self.assertEqual((False, b''), sync.pull(stop))
+        self.assertEqual(1, post.call_count)
+
+    @patch('time.sleep')
+    def test_pull_invalid_answer(self, sleep):
+        answer = MockResponse()
+        answer.text = '<html>Bad Gateway</html>'
+        with patch('requests.post', return_value=answer) as post:
+            sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem', pull_retries=1)
+            self.assertEqual((False, b''), sync.pull())
+        self.assertEqual(2, post.call_count)
+        with patch('requests.post', return_value=MockResponse(status_code=401)) as post:
+            self.assertEqual((False, b''), sync.pull())
+        self.assertEqual(1, post.call_count)
+        with patch('requests.post', return_value=MockResponse('not base64!')):
+            self.assertEqual((False, b''), sync.pull())
+
+    @patch('time.sleep')
+    def test_circuit_breaker(self, sleep):
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, 'sync-state')
+            sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem', pull_retries=0,
+                        circuit_breaker=CircuitBreaker(state_file, failure_threshold=2))
+            with patch('requests.post', side_effect=requests.exceptions.Timeout()) as post:
+                self.assertFalse(sync.push(b'data'))
+                self.assertEqual((False, b''), sync.pull())
+                self.assertEqual(2, post.call_count)
+                self.assertTrue(sync.is_suspended())
+                self.assertEqual((False, b''), sync.pull())
+                self.assertEqual(2, post.call_count)
+            circuit_breaker = CircuitBreaker(state_file, failure_threshold=2)
+            self.assertTrue(circuit_breaker.is_open())
+            self.assertGreater(circuit_breaker.get_remaining_cool_down(), 0)
+            circuit_breaker.opened_until = 0
+            sync.circuit_breaker = circuit_breaker
+            with patch('requests.post', mock_requests_post):
+                self.assertTrue(sync.push(b'data'))
+            self.assertFalse(os.path.isfile(state_file))
+            self.assertFalse(CircuitBreaker(state_file).is_open())
+
+    def test_push_with_expected_hash(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        with patch('requests.post', return_value=MockResponse(status_code=409)) as post:
+            self.assertFalse(sync.push(b'data', 'abc'))
+        self.assertEqual({'data': 'ZGF0YQ==', 'expectedHash': 'abc'}, post.call_args[1]['data'])
+        self.assertTrue(sync.conflict)
+        with patch('requests.post', mock_requests_post):
+            self.assertTrue(sync.push(b'data', 'abc'))
+        self.assertFalse(sync.conflict)
+
+    def test_binary_variant(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        answer = MockResponse()
+        answer.headers = {'content-type': 'application/octet-stream'}
+        answer.content = b'Test'
+        with patch('requests.post', return_value=answer) as post:
+            self.assertEqual((True, b'Test'), sync.pull())
+        self.assertIn('application/octet-stream', post.call_args[1]['headers']['Accept'])
+        self.assertTrue(sync.binary)
+        with patch('requests.post', return_value=MockResponse()) as post:
+            self.assertTrue(sync.push(b'Data', 'abc'))
+        self.assertEqual(b'Data', post.call_args[1]['data'])
+        self.assertEqual('abc', post.call_args[1]['headers']['X-Expected-Hash'])
+        with patch('requests.post', side_effect=[MockResponse(status_code=415), MockResponse()]) as post:
+            self.assertTrue(sync.push(b'Data'))
+        self.assertEqual({'data': str(b64encode(b'Data'), encoding='utf-8')}, post.call_args[1]['data'])
+        self.assertFalse(sync.binary)
+
+    def test_async_requests_use_post(self):
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem', timeout=(1, 2))
+        with patch('requests.post', mock_requests_post):
+            self.assertEqual((True, b'Test'), asyncio.run(sync.apull()))
+        with patch('requests.post', return_value=MockResponse(status_code=409)) as post:
+            self.assertFalse(asyncio.run(sync.apush(b'data', 'abc')))
+        self.assertTrue(sync.conflict)
+        self.assertEqual({'data': 'ZGF0YQ==', 'expectedHash': 'abc'}, post.call_args[1]['data'])
+        self.assertEqual((1, 2), post.call_args[1]['timeout'])
+        with patch('requests.post', side_effect=requests.exceptions.ConnectionError()):
+            self.assertFalse(asyncio.run(sync.apush(b'data')))
+        self.assertFalse(sync.conflict)
+
+    def test_apull_retries(self):
+        responses = [None, MockResponse(status_code=503), MockResponse('YWJj')]
+
+        async def apost(path, data):
+            return responses.pop(0)
+
+        sync = Sync("https://ersatzworld.net/ctpwdgen-server/", 'inter', 'op', 'file.pem')
+        sync.get_backoff = lambda attempt: 0
+        sync.apost = apost
+        self.assertEqual((True, b'abc'), asyncio.run(sync.apull()))
+        self.assertEqual(0, len(responses))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+from datetime import datetime, timedelta
+from SyncMerge import merge_settings, merge_replicas, get_fingerprint, create_tombstone, is_tombstone, differs, \
+    merge_tombstones, collect_tombstones
+
+
+class TestSyncMerge(unittest.TestCase):
+    def setUp(self):
+        self.old = {'domain': 'unit.test', 'length': 10, 'mDate': '2014-08-02T10:37:11'}
+        self.local = {'domain': 'unit.test', 'length': 11, 'mDate': '2014-08-02T10:37:12'}
+        self.remote = {'domain': 'unit.test', 'length': 12, 'mDate': '2014-08-02T10:37:13'}
+
+    def test_fingerprint(self):
+        self.assertEqual(get_fingerprint(self.old), get_fingerprint(dict(reversed(list(self.old.items())))))
+        self.assertNotEqual(get_fingerprint(self.old), get_fingerprint(self.local))
+
+    def test_one_side_changed(self):
+        base = {'unit.test': get_fingerprint(self.old)}
+        self.assertEqual({'unit.test': self.local},
+                         merge_settings({'unit.test': self.local}, {'unit.test': self.old}, base))
+        self.assertEqual({'unit.test': self.remote},
+                         merge_settings({'unit.test': self.old}, {'unit.test': self.remote}, base))
+        older_remote = dict(self.remote, mDate='2010-01-01T00:00:00')
+        self.assertEqual({'unit.test': older_remote},
+                         merge_settings({'unit.test': self.old}, {'unit.test': older_remote}, base))
+
+    def test_both_sides_changed(self):
+        base = {'unit.test': get_fingerprint(self.old)}
+        self.assertEqual({'unit.test': self.remote},
+                         merge_settings({'unit.test': self.local}, {'unit.test': self.remote}, base))
+        self.assertEqual({'unit.test': self.remote},
+                         merge_settings({'unit.test': self.local}, {'unit.test': self.remote}, {}))
+        local = dict(self.local, mDate='2015-01-01T00:00:00')
+        self.assertEqual({'unit.test': local}, merge_settings({'unit.test': local}, {'unit.test': self.remote}, {}))
+
+    def test_fingerprints_are_calculated_once(self):
+        remote = dict(self.remote, mDate=self.local['mDate'])
+        local = {'unit.test': self.local, 'local.test': dict(self.old, domain='local.test')}
+        local_fingerprints = {'unit.test': get_fingerprint(self.local)}
+        with patch('SyncMerge.get_fingerprint', wraps=get_fingerprint) as fingerprint:
+            merged = merge_settings(local, {'unit.test': remote}, {}, local_fingerprints)
+        self.assertEqual(2, fingerprint.call_count)
+        self.assertEqual(max([self.local, remote], key=get_fingerprint), merged['unit.test'])
+        self.assertIn('local.test', merged)
+
+    def test_merge_replicas(self):
+        base = {'unit.test': get_fingerprint(self.old), 'collected.test': get_fingerprint(self.old)}
+        tombstone = create_tombstone('2014-08-02T10:37:14')
+        self.assertEqual({'unit.test': self.remote, 'new.test': self.local},
+                         merge_replicas({'unit.test': self.remote}, {'new.test': self.local}, base))
+        self.assertEqual({'unit.test': self.remote},
+                         merge_replicas({'unit.test': self.old}, {'unit.test': self.remote}, base))
+        self.assertEqual({'unit.test': self.remote},
+                         merge_replicas({'unit.test': self.remote}, {'unit.test': self.old}, base))
+        self.assertEqual({'unit.test': tombstone},
+                         merge_replicas({'unit.test': tombstone}, {'unit.test': self.old}, base))
+        self.assertEqual({'unit.test': self.remote},
+                         merge_replicas({'unit.test': self.remote}, {'collected.test': self.old}, base))
+
+    def test_deletions(self):
+        base = {'unit.test': get_fingerprint(self.old)}
+        tombstone = create_tombstone('2014-08-02T10:37:12')
+        self.assertTrue(is_tombstone(tombstone))
+        self.assertEqual({'unit.test': tombstone},
+                         merge_settings({'unit.test': tombstone}, {'unit.test': self.old}, base))
+        self.assertEqual({'unit.test': tombstone},
+                         merge_settings({'unit.test': self.old}, {'unit.test': tombstone}, base))
+        self.assertEqual({'unit.test': self.remote},
+                         merge_settings({'unit.test': tombstone}, {'unit.test': self.remote}, base))
+        self.assertEqual({}, merge_settings({'unit.test': tombstone}, {}, base))
+        self.assertEqual({'unit.test': tombstone}, merge_settings({}, {'unit.test': tombstone}, {}))
+        self.assertEqual({}, merge_settings({'unit.test': self.old}, {}, base))
+        self.assertEqual({'unit.test': self.local}, merge_settings({'unit.test': self.local}, {}, base))
+
+    def test_merge_tombstones(self):
+        older = create_tombstone('2014-08-02T10:37:12')
+        newer = create_tombstone('2014-08-02T10:37:13')
+        self.assertEqual({'mDate': '2014-08-02T10:37:13', 'deleted': True}, merge_tombstones(older, newer))
+        self.assertEqual({'unit.test': newer}, merge_settings({'unit.test': older}, {'unit.test': newer}, {}))
+
+    def test_collect_tombstones(self):
+        now = datetime(2016, 1, 1)
+        data = {
+            'unit.test': self.old,
+            'recent': create_tombstone('2015-12-30T00:00:00'),
+            'too.old': create_tombstone('2015-01-01T00:00:00')
+        }
+        compacted, collected = collect_tombstones(data, timedelta(days=90), now)
+        self.assertEqual({'unit.test': self.old, 'recent': data['recent']}, compacted)
+        self.assertEqual({'too.old': data['too.old']}, collected)
+
+    def test_differs(self):
+        self.assertFalse(differs({'unit.test': self.old}, {'unit.test': dict(self.old)}))
+        self.assertTrue(differs({'unit.test': self.old}, {'unit.test': self.local}))
+        self.assertTrue(differs({'unit.test': self.old}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import json
+import tempfile
+from SyncOutbox import SyncOutbox, OutboxFlusher
+from SyncMerge import create_tombstone
+from Crypter import Crypter
+from Packer import Packer
+
+
+class MockSettingsManager(object):
+    """
+    Counts the flushes.
+    """
+    def __init__(self, outbox):
+        self.outbox = outbox
+        self.flushes = 0
+
+    def flush_outbox(self, password):
+        self.flushes += 1
+        self.outbox.acknowledge(dict(self.outbox.entries))
+        return True
+
+
+class TestSyncOutbox(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.outbox = SyncOutbox(os.path.join(self.directory.name, 'settings.pws.outbox'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_record_and_acknowledge(self):
+        self.outbox.record('unit.test', {'domain': 'unit.test', 'length': 10})
+        self.outbox.record('unit.test', {'domain': 'unit.test', 'length': 11})
+        self.outbox.record('some.domain', create_tombstone('2014-08-02T10:37:12'))
+        self.outbox.record('third.domain', create_tombstone('2014-08-02T10:37:12'))
+        self.assertEqual(3, len(self.outbox))
+        self.assertEqual({'unit.test', 'some.domain', 'third.domain'}, self.outbox.get_pending_domains())
+        self.outbox.acknowledge({'unit.test': {'domain': 'unit.test', 'length': 10},
+                                 'some.domain': create_tombstone('2014-08-02T10:37:13'),
+                                 'third.domain': {'domain': 'third.domain'}})
+        self.assertEqual({'unit.test', 'third.domain'}, self.outbox.get_pending_domains())
+        self.outbox.acknowledge({'unit.test': {'domain': 'unit.test', 'length': 11},
+                                 'third.domain': {'domain': 'third.domain'}})
+        self.assertEqual({'third.domain'}, self.outbox.get_pending_domains())
+        self.outbox.acknowledge({})
+        self.assertEqual(0, len(self.outbox))
+
+    def test_refresh(self):
+        self.outbox.record('unit.test', {'domain': 'unit.test', 'length': 10})
+        self.outbox.record('some.domain', {'domain': 'some.domain'})
+        self.outbox.refresh({'unit.test': {'domain': 'unit.test', 'length': 12}})
+        self.assertEqual({'unit.test': {'domain': 'unit.test', 'length': 12}}, self.outbox.entries)
+
+    def test_save_and_load(self):
+        salt = os.urandom(32)
+        crypter = Crypter(salt, 'xyz')
+        self.outbox.record('unit.test', {'domain': 'unit.test', 'length': 10})
+        self.outbox.save(salt, crypter.key)
+        outbox = SyncOutbox(self.outbox.outbox_file)
+        outbox.load(salt, crypter.key)
+        self.assertEqual(self.outbox.entries, outbox.entries)
+        outbox.load(os.urandom(32), crypter.key)
+        self.assertEqual(0, len(outbox))
+        outbox.load(salt, Crypter(salt, 'abc').key)
+        self.assertEqual(0, len(outbox))
+        self.outbox.acknowledge(self.outbox.entries)
+        self.outbox.save(salt, crypter.key)
+        self.assertFalse(os.path.isfile(self.outbox.outbox_file))
+
+    def test_key_differs_from_settings_file(self):
+        salt = os.urandom(32)
+        crypter = Crypter(salt, 'xyz')
+        self.outbox.record('unit.test', {'domain': 'unit.test', 'length': 10})
+        plaintext = Packer.compress(json.dumps(self.outbox.entries))
+        vault_body = crypter.encrypt(plaintext)
+        self.outbox.save(salt, crypter.key)
+        with open(self.outbox.outbox_file, 'rb') as file:
+            first = file.read()
+        self.outbox.save(salt, crypter.key)
+        with open(self.outbox.outbox_file, 'rb') as file:
+            second = file.read()
+        self.assertEqual(salt, first[:32])
+        self.assertEqual(len(vault_body), len(first[64:]))
+        self.assertNotEqual(vault_body[:16], first[64:80])
+        self.assertNotEqual(first[32:64], second[32:64])
+        self.assertNotEqual(first[64:80], second[64:80])
+
+    def test_flusher(self):
+        settings_manager = MockSettingsManager(self.outbox)
+        flusher = OutboxFlusher(settings_manager, 'xyz', interval=0.01)
+        flusher.start()
+        flusher.stop()
+        self.assertEqual(0, settings_manager.flushes)
+        self.outbox.record('unit.test', {'domain': 'unit.test', 'length': 10})
+        self.outbox.record('unit.test', {'domain': 'unit.test', 'length': 11})
+        self.assertTrue(flusher.flush())
+        self.assertEqual(1, settings_manager.flushes)
+        self.assertEqual(0, len(self.outbox))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import json
+import asyncio
+import shutil
+import tempfile
+from unittest.mock import patch
+from Sync import Sync
+from SyncManager import SyncManager
+from SyncServer import SyncServer, create_self_signed_certificate
+from SyncMerge import get_blob_hash
+from Packer import Packer
+from PasswordSettingsManager import PasswordSettingsManager
+
+
+@unittest.skipIf(shutil.which('openssl') is None, "openssl is needed to create a certificate.")
+class TestSyncServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.certificate_file = os.path.join(cls.directory.name, 'certificate.pem')
+        cls.key_file = os.path.join(cls.directory.name, 'key.pem')
+        create_self_signed_certificate(cls.certificate_file, cls.key_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.server = SyncServer({'alice': 'secret'}, self.certificate_file, self.key_file)
+        self.server.start()
+        self.backup_server = SyncServer({'alice': 'secret'}, self.certificate_file, self.key_file)
+        self.backup_server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.backup_server.stop()
+
+    def configure(self, sync_manager, servers):
+        with open(self.certificate_file) as file:
+            certificate = file.read()
+        sync_settings = [{"server-address": server.get_url(), "username": 'alice', "password": 'secret',
+                          "certificate": certificate} for server in servers]
+        sync_settings[0]["backups"] = sync_settings[1:]
+        sync_manager.load_binary_sync_settings(Packer.compress(json.dumps(sync_settings[0]).encode('utf-8')))
+
+    def test_pull_and_push(self):
+        sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file)
+        self.assertEqual((True, b''), sync.pull())
+        self.assertTrue(sync.push(b'abc'))
+        self.assertEqual((True, b'abc'), sync.pull())
+        self.assertEqual({'reads': 2, 'writes': 1, 'conflicts': 0}, self.server.statistics)
+
+    def test_wrong_password(self):
+        sync = Sync(self.server.get_url(), 'alice', 'wrong', self.certificate_file, pull_retries=0)
+        self.assertEqual((False, b''), sync.pull())
+        self.assertFalse(sync.push(b'abc'))
+        self.assertEqual({}, self.server.data)
+
+    def test_compare_and_swap(self):
+        sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file)
+        other_sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file)
+        self.assertTrue(sync.push(b'abc', get_blob_hash(b'')))
+        self.assertFalse(other_sync.push(b'def', get_blob_hash(b'')))
+        self.assertTrue(other_sync.conflict)
+        self.assertTrue(other_sync.push(b'def', get_blob_hash(b'abc')))
+        self.assertFalse(sync.push(b'ghi', get_blob_hash(b'abc')))
+        self.assertEqual((True, b'def'), sync.pull())
+        self.assertEqual({'reads': 1, 'writes': 2, 'conflicts': 2}, self.server.statistics)
+
+    def test_async_pull_and_push(self):
+        sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file, max_connections=2)
+        other_sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file)
+
+        async def run():
+            self.assertEqual((True, b''), await sync.apull())
+            self.assertTrue(await sync.apush(b'abc', get_blob_hash(b'')))
+            self.assertFalse(await other_sync.apush(b'def', get_blob_hash(b'')))
+            self.assertTrue(other_sync.conflict)
+            return await asyncio.gather(*[sync.apull() for _ in range(5)])
+
+        self.assertEqual([(True, b'abc')] * 5, asyncio.run(run()))
+        self.assertEqual({'reads': 6, 'writes': 1, 'conflicts': 1}, self.server.statistics)
+
+    def test_async_wrong_password(self):
+        sync = Sync(self.server.get_url(), 'alice', 'wrong', self.certificate_file, pull_retries=0)
+        self.assertEqual((False, b''), asyncio.run(sync.apull()))
+        self.assertFalse(asyncio.run(sync.apush(b'abc')))
+        self.assertEqual({}, self.server.data)
+
+    def test_fan_out(self):
+        sync_manager = SyncManager()
+        self.configure(sync_manager, [self.server, self.backup_server])
+        self.assertEqual(2, len(sync_manager.get_targets()))
+        self.assertEqual((True, b''), sync_manager.pull())
+        self.assertTrue(sync_manager.push(b'abc', get_blob_hash(b'')))
+        self.assertEqual({'alice': b'abc'}, self.server.data)
+        self.assertEqual({'alice': b'abc'}, self.backup_server.data)
+        self.backup_server.data['alice'] = b'def'
+        self.assertEqual((True, b'abc'), sync_manager.pull())
+        self.assertEqual([b'def'], sync_manager.get_replica_data())
+        self.assertTrue(sync_manager.push(b'ghi', get_blob_hash(b'abc')))
+        self.assertEqual({'alice': b'ghi'}, self.backup_server.data)
+        self.assertEqual((True, b'ghi'), asyncio.run(sync_manager.apull()))
+        self.assertEqual([], sync_manager.get_replica_data())
+        self.assertTrue(asyncio.run(sync_manager.apush(b'jkl', get_blob_hash(b'ghi'))))
+        self.assertEqual({'alice': b'jkl'}, self.backup_server.data)
+        loaded_sync_manager = SyncManager()
+        loaded_sync_manager.load_binary_sync_settings(sync_manager.get_binary_sync_settings())
+        self.assertEqual([self.server.get_url(), self.backup_server.get_url()],
+                         [target.server_url for target in loaded_sync_manager.get_targets()])
+
+    def test_slow_and_unreachable_servers(self):
+        sync_manager = SyncManager()
+        sync_manager.grace_period = 0.1
+        self.configure(sync_manager, [self.server, self.backup_server])
+        self.server.data['alice'] = b'abc'
+        self.backup_server.data['alice'] = b'def'
+        self.server.delay = 2
+        self.assertEqual((True, b'def'), sync_manager.pull())
+        self.assertEqual(1, len(sync_manager.stragglers))
+        self.assertTrue(sync_manager.shutdown(5))
+        self.assertEqual(set(), sync_manager.stragglers)
+        self.assertIs(sync_manager.backup_syncs[0], sync_manager.main_target)
+        self.assertEqual([True, False], [health['slow'] for health in sync_manager.get_target_health()])
+        self.assertIsNotNone(sync_manager.get_target_health()[1]['latency'])
+        self.server.delay = 0
+        self.assertTrue(sync_manager.push(b'ghi', get_blob_hash(b'def')))
+        self.assertEqual(b'abc', self.server.data['alice'])
+        self.backup_server.stop()
+        self.assertEqual((True, b'abc'), asyncio.run(sync_manager.apull()))
+        self.assertIs(sync_manager.sync, sync_manager.main_target)
+        self.assertTrue(sync_manager.push(b'jkl', get_blob_hash(b'abc')))
+        self.assertEqual(b'jkl', self.server.data['alice'])
+        self.backup_server = SyncServer({'alice': 'secret'}, self.certificate_file, self.key_file)
+        self.backup_server.start()
+
+    def test_settings_manager_merges_replicas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = PasswordSettingsManager(os.path.join(directory, 'first.pws'))
+            self.configure(first.sync_manager, [self.server, self.backup_server])
+            first.load_settings('xyz', True, True)
+            first.get_setting('first.domain')
+            first.store_settings('xyz')
+            second = PasswordSettingsManager(os.path.join(directory, 'second.pws'))
+            self.configure(second.sync_manager, [self.backup_server])
+            second.load_settings('xyz', True, True)
+            second.get_setting('second.domain')
+            second.store_settings('xyz')
+            self.assertNotEqual(self.server.data, self.backup_server.data)
+            first.update_from_sync('xyz')
+            self.assertEqual(['first.domain', 'second.domain'], sorted(first.get_domain_list()))
+            self.assertTrue(first.update_remote)
+            first.store_settings('xyz')
+            self.assertEqual(self.server.data, self.backup_server.data)
+            third = PasswordSettingsManager(os.path.join(directory, 'third.pws'))
+            self.configure(third.sync_manager, [self.server])
+            third.load_settings('xyz', True, True)
+            self.assertEqual(['first.domain', 'second.domain'], sorted(third.get_domain_list()))
+
+    def test_large_blob(self):
+        sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file)
+        blob = os.urandom(1024 * 1024)
+        self.assertTrue(sync.push(blob))
+        self.assertEqual((True, blob), sync.pull())
+
+    def test_binary_variant(self):
+        sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file)
+        blob = os.urandom(64 * 1024)
+        other_blob = os.urandom(64 * 1024)
+        self.assertEqual((True, b''), sync.pull())
+        self.assertTrue(sync.binary)
+        self.assertTrue(sync.push(blob, get_blob_hash(b'')))
+        self.assertEqual((True, blob), sync.pull())
+        self.assertTrue(sync.binary)
+        self.assertFalse(sync.push(b'changed', get_blob_hash(b'wrong')))
+        self.assertTrue(sync.conflict)
+        self.assertTrue(asyncio.run(sync.apush(other_blob, get_blob_hash(blob))))
+        self.assertEqual((True, other_blob), asyncio.run(sync.apull()))
+        form_sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file, allow_binary=False)
+        self.server.traffic = {'received': 0, 'sent': 0}
+        self.assertEqual((True, other_blob), form_sync.pull())
+        self.assertTrue(form_sync.push(blob))
+        form_traffic = dict(self.server.traffic)
+        self.server.traffic = {'received': 0, 'sent': 0}
+        self.assertEqual((True, blob), sync.pull())
+        self.assertTrue(sync.push(other_blob))
+        self.assertLess(self.server.traffic['sent'], form_traffic['sent'] * 0.8)
+        self.assertLess(self.server.traffic['received'], form_traffic['received'] * 0.8)
+
+    def test_binary_fallback(self):
+        sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file)
+        self.assertTrue(sync.push(b'abc'))
+        self.assertEqual((True, b'abc'), sync.pull())
+        self.assertTrue(sync.binary)
+        self.server.binary = False
+        self.assertTrue(sync.push(b'def'))
+        self.assertFalse(sync.binary)
+        self.assertEqual({'alice': b'def'}, self.server.data)
+        self.assertEqual((True, b'def'), asyncio.run(sync.apull()))
+        self.assertFalse(sync.binary)
+        self.server.data['alice'] = b''
+        self.assertEqual((True, b''), sync.pull())
+
+    def test_invalid_form_data(self):
+        sync = Sync(self.server.get_url(), 'alice', 'secret', self.certificate_file, allow_binary=False)
+        with patch.object(sync, 'get_push_form', return_value={'data': 'not base64!'}):
+            self.assertFalse(sync.push(b'abc'))
+        self.assertEqual({}, self.server.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
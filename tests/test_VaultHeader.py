@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import struct
+from VaultHeader import pack_header, unpack_header, MAGIC, LEGACY_KDF
+from Crypter import create_kdf, KDF_SCRYPT
+
+
+class TestVaultHeader(unittest.TestCase):
+    def test_pack_and_unpack(self):
+        kdf = create_kdf(KDF_SCRYPT, 1024)
+        header = pack_header(kdf)
+        self.assertTrue(header.startswith(MAGIC))
+        self.assertEqual((kdf, len(header)), unpack_header(header + b'salt'))
+
+    def test_legacy_file(self):
+        self.assertEqual((LEGACY_KDF, 0), unpack_header(b'\x00' * 32 + struct.pack('!I', 0)))
+
+    def test_damaged_header(self):
+        header = pack_header(create_kdf())
+        self.assertRaises(ValueError, unpack_header, header[:-1])
+        self.assertRaises(ValueError, unpack_header, MAGIC + b'\x02' + header[len(MAGIC) + 1:])
+        self.assertRaises(ValueError, unpack_header, MAGIC + struct.pack('!BI', 1, 4) + b'[1]x')
+        unknown_kdf = b'{"kdf": {"algorithm": "md5"}}'
+        self.assertRaises(ValueError, unpack_header, MAGIC + struct.pack('!BI', 1, len(unknown_kdf)) + unknown_kdf)
+        huge_scrypt = b'{"kdf": {"algorithm": "scrypt", "n": 1073741824, "r": 8, "p": 1}}'
+        self.assertRaises(ValueError, unpack_header, MAGIC + struct.pack('!BI', 1, len(huge_scrypt)) + huge_scrypt)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import sys
+import tempfile
+import subprocess
+from unittest.mock import patch
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+NETWORK_MODULES = ['Sync', 'requests', 'urllib3', 'chardet', 'charset_normalizer', 'idna']
+SLOW_MODULES = ['asyncio', 'numpy', 'cryptography', 'Crypto']
+
+
+def get_import_times(module):
+    """
+    Imports the module in a new interpreter with -X importtime.
+
+    :param str module: name of the module
+    :return: module name -> cumulative import time in microseconds
+    :rtype: dict
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                             cwd=REPOSITORY_DIRECTORY, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    import_times = {}
+    for line in process.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            import_times[parts[2].strip()] = int(parts[1])
+    return import_times
+
+
+class TestCtSESAMStartup(unittest.TestCase):
+    def test_no_network_modules(self):
+        import_times = get_import_times('ctSESAM')
+        for module in NETWORK_MODULES:
+            self.assertNotIn(module, import_times)
+
+    def test_no_slow_modules(self):
+        import_times = get_import_times('ctSESAM')
+        for module in SLOW_MODULES:
+            self.assertNotIn(module, import_times)
+
+
+class TestCtSESAMMain(unittest.TestCase):
+    def run_main(self, argv):
+        import ctSESAM
+        with patch('ctSESAM.PasswordSettingsManager') as settings_manager_class:
+            settings_manager = settings_manager_class.return_value
+            settings_manager.search.return_value = []
+            with self.assertRaises(SystemExit) as context:
+                ctSESAM.main(['--master-password', 'xyz', '--no-sync'] + argv)
+        settings_manager.sync_manager.shutdown.assert_called_once_with(ctSESAM.SHUTDOWN_TIMEOUT)
+        return context.exception.code
+
+    def test_shutdown_after_search(self):
+        self.assertEqual(0, self.run_main(['--search', 'unit.test']))
+
+    def test_shutdown_after_failed_serve(self):
+        with tempfile.NamedTemporaryFile() as file:
+            self.assertEqual(1, self.run_main(['--serve-socket', file.name]))
+
+    def test_shutdown_after_error(self):
+        import ctSESAM
+        with patch('ctSESAM.PasswordSettingsManager') as settings_manager_class:
+            settings_manager = settings_manager_class.return_value
+            settings_manager.load_settings.side_effect = OSError()
+            self.assertRaises(OSError, ctSESAM.main, ['--master-password', 'xyz', '-d', 'unit.test'])
+        settings_manager.sync_manager.shutdown.assert_called_once_with(ctSESAM.SHUTDOWN_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import io
+import json
+from settingsTransfer import validate_setting_dict, read_settings, write_settings, guess_format, \
+    FORMAT_CSV, FORMAT_JSON_LINES
+from PasswordSetting import PasswordSetting
+
+
+class TestSettingsTransfer(unittest.TestCase):
+    def test_guess_format(self):
+        self.assertEqual(FORMAT_CSV, guess_format("export.CSV"))
+        self.assertEqual(FORMAT_JSON_LINES, guess_format("export.jsonl"))
+
+    def test_validate_setting_dict(self):
+        self.assertEqual({'domain': 'unit.test', 'length': 12, 'iterations': 5000},
+                         validate_setting_dict({'domain': 'unit.test', 'length': '12', 'iterations': 5000,
+                                                'notes': ''}))
+        self.assertRaises(ValueError, validate_setting_dict, {'length': 12})
+        self.assertRaises(ValueError, validate_setting_dict, {'domain': 'unit.test', 'length': 'long'})
+        self.assertRaises(ValueError, validate_setting_dict, {'domain': 'unit.test', 'iterations': -3})
+        self.assertRaises(ValueError, validate_setting_dict, {'domain': 'unit.test', 'length': True})
+        self.assertRaises(ValueError, validate_setting_dict, {'domain': 'unit.test', 'length': 12.7})
+        self.assertRaises(ValueError, validate_setting_dict, {'domain': 'unit.test', 'iterations': '12.7'})
+        self.assertEqual({'domain': 'unit.test', 'length': 12},
+                         validate_setting_dict({'domain': 'unit.test', 'length': 12.0}))
+        self.assertRaises(ValueError, validate_setting_dict, {'domain': 'unit.test', 'mDate': '2015-13-01'})
+        self.assertRaises(ValueError, validate_setting_dict, {'domain': 'unit.test', 'salt': 'no base64!'})
+        self.assertRaises(ValueError, validate_setting_dict, ['unit.test'])
+
+    def test_read_json_lines(self):
+        file = io.StringIO(json.dumps({'domain': 'unit.test', 'length': 11}) + "\n\n" +
+                           "{broken\n" +
+                           json.dumps({'domain': 'some.domain', 'iterations': 'many'}) + "\n")
+        records = list(read_settings(file, FORMAT_JSON_LINES))
+        self.assertEqual(3, len(records))
+        self.assertEqual((1, {'domain': 'unit.test', 'length': 11}, None), records[0])
+        self.assertEqual(3, records[1][0])
+        self.assertIsNone(records[1][1])
+        self.assertEqual(4, records[2][0])
+        self.assertIsNotNone(records[2][2])
+
+    def test_read_invalid_encoding(self):
+        data = (json.dumps({'domain': 'unit.test'}) + "\n").encode('utf-8') + b'{"domain": "\xff"}\n' + \
+            (json.dumps({'domain': 'some.domain'}) + "\n").encode('utf-8')
+        file = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='surrogateescape')
+        records = list(read_settings(file, FORMAT_JSON_LINES))
+        self.assertEqual(3, len(records))
+        self.assertEqual((1, {'domain': 'unit.test'}, None), records[0])
+        self.assertEqual((2, None, "The field domain is not valid UTF-8."), records[1])
+        self.assertEqual((3, {'domain': 'some.domain'}, None), records[2])
+        file = io.TextIOWrapper(io.BytesIO(b'domain,notes\r\nunit.test,\xff\r\n'), encoding='utf-8',
+                                errors='surrogateescape', newline='')
+        self.assertEqual([(2, None, "The field notes is not valid UTF-8.")], list(read_settings(file, FORMAT_CSV)))
+        for file_format in [FORMAT_JSON_LINES, FORMAT_CSV]:
+            file = io.TextIOWrapper(io.BytesIO(b'domain\r\n\xff\r\n'), encoding='utf-8', newline='')
+            records = list(read_settings(file, file_format))
+            self.assertIsNone(records[-1][1])
+            self.assertIn("not encoded correctly", records[-1][2])
+
+    def test_write_and_read_csv(self):
+        setting = PasswordSetting('unit.test')
+        setting.set_username('Hugo')
+        setting.set_notes('Some, note with "quotes"\nand a newline.')
+        setting.set_creation_date("2001-01-01T02:14:12")
+        setting.set_modification_date("2005-01-01T01:14:12")
+        file = io.StringIO(newline='')
+        self.assertEqual(1, write_settings(file, [setting], FORMAT_CSV))
+        file.seek(0)
+        records = list(read_settings(file, FORMAT_CSV))
+        self.assertEqual(1, len(records))
+        self.assertIsNone(records[0][2])
+        self.assertEqual(setting.to_dict(), records[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()